@@ -3,8 +3,8 @@
 
 import urllib
 
-from django.db import models
-from django.db.models import Max, Min
+from django.db import connection, models, transaction
+from django.db.models import Exists, Max, Min, OuterRef, Q, Subquery
 from django.db.models.signals import post_delete, pre_delete, post_save, pre_save
 from django.dispatch import receiver
 
@@ -73,8 +73,9 @@ class Article(models.Model):
     read_later = models.BooleanField(default=False)
     archive = models.BooleanField(default=False)
 
-    categories = models.CharField(max_length=250, null=True, blank=True)
+    categories = models.CharField(max_length=250, null=True, blank=True)  # ';'-separated - normalized in ArticleTag
     language = models.CharField(max_length=6, null=True, blank=True)
+    language_code = models.CharField(max_length=2, null=True, blank=True, db_index=True)  # e.g. 'en' of 'en-GB'
 
     guid = models.CharField(max_length=95, null=True, blank=True)
     hash = models.CharField(max_length=100)
@@ -108,6 +109,14 @@ class Article(models.Model):
     # def _dict(self):
     #    return model_to_dict(self, fields=[field.name for field in self._meta.fields])
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        """Remember the loaded categories - the tags are only re-saved if they changed (see sync_article_tags)"""
+        instance = super().from_db(db, field_names, values)
+        if "categories" in field_names:
+            instance._loaded_categories = values[field_names.index("categories")]
+        return instance
+
     def save(self, *args, **kwargs):
         """Make sure the min and max fields are refreshed on every update"""
         self.mailto_link = self.__calc_mailto_link()
@@ -133,14 +142,89 @@ def truncate_long_fields(sender, instance, **kwargs):
         "hash",
         "mailto_link",
     ]  # all fields with max_length limit and not filled by code
+    deferred_fields = instance.get_deferred_fields()  # e.g. if loaded with .only() - not saved so nothing to truncate
 
     for field_name in fields_to_check:
+        if field_name in deferred_fields:
+            continue
         field = getattr(instance, field_name)
         max_length = instance._meta.get_field(field_name).max_length
         if field is not None and len(field) > max_length:
             setattr(instance, field_name, field[:max_length])
 
 
+@receiver(pre_save, sender=Article)
+def set_language_code(sender, instance, **kwargs):
+    """Make sure the indexed two-letter language_code matches the language (e.g. 'en' of 'en-GB')"""
+    if "language" in instance.get_deferred_fields():
+        return
+    language = (instance.language or "").strip()
+    instance.language_code = language[:2].lower() if len(language) >= 2 else None
+
+
+class ArticleTag(models.Model):
+    """Django Model Class of the normalized (lower-case) categories of an article to filter articles by an index"""
+
+    article = models.ForeignKey(Article, on_delete=models.CASCADE, related_name="tags")
+    name = models.CharField(max_length=100)
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=["article", "name"], name="unique_article_tag")]
+        indexes = [models.Index(fields=["name", "article"])]
+
+    def __str__(self):
+        return f"{self.article_id} - {self.name}"
+
+
+def get_tag_names(categories):
+    """normalized tags of ';'-separated categories"""
+    max_length = ArticleTag._meta.get_field("name").max_length
+    tag_names = [i.strip().lower()[:max_length] for i in (categories or "").split(";")]
+    return list(dict.fromkeys(i for i in tag_names if i != ""))
+
+
+def tagged_with(*names):
+    """Q of the articles with any of the tags - an indexed lookup instead of searching the categories"""
+    return Q(pk__in=ArticleTag.objects.filter(name__in=[i.strip().lower() for i in names]).values("article_id"))
+
+
+def save_article_tags(articles, new=False):
+    """
+    replace the tags of the (saved) articles by the tags of their categories with two queries (one if they are new) -
+    for bulk operations, the tags of articles saved one by one are kept in sync by sync_article_tags
+    """
+    articles = [i for i in articles if i.pk is not None]
+    if len(articles) == 0:
+        return
+    if new is False:
+        ArticleTag.objects.filter(article_id__in={i.pk for i in articles}).delete()
+    ArticleTag.objects.bulk_create(
+        [ArticleTag(article_id=i.pk, name=name) for i in articles for name in get_tag_names(i.categories)],
+        ignore_conflicts=True,
+    )
+
+
+@receiver(post_save, sender=Article)
+def sync_article_tags(sender, instance, created, update_fields, **kwargs):
+    """Make sure the tags of an article match its categories whenever they were changed"""
+    if "categories" in instance.get_deferred_fields() or (
+        update_fields is not None and "categories" not in update_fields
+    ):
+        return
+    if created:
+        save_article_tags([instance], new=True)
+    elif instance.categories != getattr(instance, "_loaded_categories", object()):
+        save_article_tags([instance])
+    instance._loaded_categories = instance.categories
+
+
+def get_untagged_articles():
+    """articles with categories but without tags - e.g. saved before the tags were added"""
+    return Article.objects.exclude(Q(categories__isnull=True) | Q(categories="")).filter(
+        ~Exists(ArticleTag.objects.filter(article_id=OuterRef("pk")))
+    )
+
+
 class FeedPosition(models.Model):
     """Django Model Class linking a single article/video with a specific feed and containing the relevant
     position in that feed"""
@@ -156,6 +240,52 @@ class FeedPosition(models.Model):
         return f"{self.feed} - {self.position}"
 
 
+class ArticleEmbedding(models.Model):
+    """Django Model Class storing the sentence embedding of an article's title and extract to group articles - only
+    re-computed if the text (or the embedding model) changes"""
+
+    article = models.OneToOneField(Article, on_delete=models.CASCADE, primary_key=True)
+    model_name = models.CharField(max_length=100)
+    text_hash = models.CharField(max_length=64)  # sha256 of the embedded text
+    vector = models.BinaryField()  # float32 array
+
+    def __str__(self):
+        return f"{self.article_id} - {self.model_name}"
+
+
+class ArticleMinHash(models.Model):
+    """Django Model Class storing the MinHash signature of an article's title and feed summary to link near-duplicates
+    at ingest (see feed_scraper/near_duplicates.py)"""
+
+    article = models.OneToOneField(Article, on_delete=models.CASCADE, primary_key=True)
+    signature = models.BinaryField()  # uint32 array
+
+    def __str__(self):
+        return f"{self.article_id}"
+
+
+class ArticleMinHashBand(models.Model):
+    """Django Model Class for the LSH index of the MinHash signatures - one row per band of a signature"""
+
+    article = models.ForeignKey(Article, on_delete=models.CASCADE)
+    key = models.BigIntegerField(db_index=True)  # hash of the band number and the band's values of the signature
+
+    def __str__(self):
+        return f"{self.article_id} - {self.key}"
+
+
+class ArticleNearDuplicate(models.Model):
+    """Django Model Class linking a feed entry (guid and hash) to the existing article of the same publisher it is a
+    near-duplicate of - later refreshes find the article without comparing the MinHash signatures again"""
+
+    article = models.ForeignKey(Article, on_delete=models.CASCADE)
+    guid = models.CharField(max_length=95, null=True, blank=True, db_index=True)
+    hash = models.CharField(max_length=100, unique=True)
+
+    def __str__(self):
+        return f"{self.article_id} - {self.hash}"
+
+
 def __recalc_article_min_max(article):
     """function to re-calculate the Article's min/max values if FeedPositions were changed"""
     min_max_values = article.feedposition_set.all().aggregate(
@@ -182,3 +312,31 @@ def save_feedposition_hook(sender, instance, using, **kwargs):
 def delete_feedposition_hook(sender, instance, using, **kwargs):
     """signal to re-calculate the Article min/max values if FeedPositin was deleted"""
     __recalc_article_min_max(article=instance.article)
+
+
+def recalc_articles_min_max(article_ids):
+    """set-based re-calculation of the Articles' min/max values from their FeedPositions - one UPDATE, no signals"""
+    if len(article_ids) == 0:
+        return
+    feed_positions = FeedPosition.objects.filter(article=OuterRef("pk")).order_by().values("article")
+    Article.objects.filter(pk__in=article_ids).update(
+        max_importance=Subquery(feed_positions.annotate(value=Max("importance")).values("value")),
+        min_feed_position=Subquery(feed_positions.annotate(value=Min("position")).values("value")),
+        min_article_relevance=Subquery(feed_positions.annotate(value=Min("relevance")).values("value")),
+    )
+
+
+def replace_feed_positions(feed, feed_positions):
+    """
+    Bulk path to replace all FeedPositions of a feed with the given (unsaved) FeedPositions and to refresh the min/max
+    values of all affected Articles afterwards - without firing the per-row FeedPosition signals
+    """
+    with transaction.atomic():
+        old_feed_positions = FeedPosition.objects.filter(feed=feed)
+        article_ids = set(old_feed_positions.values_list("article_id", flat=True))
+        # a single DELETE statement - QuerySet.delete() would collect the rows to send the post_delete signals
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {FeedPosition._meta.db_table} WHERE feed_id = %s", [feed.pk])
+        FeedPosition.objects.bulk_create(feed_positions)
+        article_ids.update(i.article_id for i in feed_positions)
+        recalc_articles_min_max(article_ids)
@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+"""
+Full-text search over the title, extract, and full text of the articles - ranked with a highlighted snippet.
+
+- PostgreSQL: a generated (stored) tsvector column weighting the title over the extract over the full text with a GIN
+  index
+- SQLite: an FTS5 table with the article table as external content kept up to date by triggers on insert, update, and
+  delete - combined group articles are not indexed
+
+Both are maintained by the database itself, so articles saved in bulk are indexed too. The index is created once - at
+start-up by manage.py and the celery worker or by the first search of a process - and the existing articles are indexed
+when it is created. On SQLite, the articles are re-indexed if the triggers are missing (dropped if a migration
+re-creates the article table) as the articles saved meanwhile were not indexed.
+"""
+
+import html
+import re
+
+from django.db import connection
+
+from articles.models import Article
+
+SEARCH_MAX_WORDS = 10
+SEARCH_MAX_RESULTS = 100
+SEARCH_MIN_PREFIX_LENGTH = 3  # shorter last words are only matched as whole words (their prefixes match most articles)
+SNIPPET_WORDS = 16
+SNIPPET_START, SNIPPET_END = "\x02", "\x03"  # markers of the matches - replaced by <b></b> after escaping the text
+POSTGRES_SEARCH_CONFIG = "simple"  # no stemming as the articles are in several languages
+POSTGRES_MAX_TEXT_LENGTH = 200_000  # a tsvector is limited to 1 MB
+SQLITE_FTS_TABLE = "articles_article_fts"
+SQLITE_FTS_WEIGHTS = "10.0, 4.0, 1.0"  # bm25 weights of title, extract, and full text
+SQLITE_FTS_TRIGGERS = [f"{SQLITE_FTS_TABLE}_insert", f"{SQLITE_FTS_TABLE}_delete", f"{SQLITE_FTS_TABLE}_update"]
+WORD_PATTERN = re.compile(r"\w+")
+
+__search_index_ready = False
+
+
+def get_sqlite_search_index_sql():
+    """
+    statements creating the FTS5 table, the triggers keeping it up to date, and indexing the existing articles - the
+    article table is the external content of the FTS5 table but only the articles which are not groups are indexed
+    (i.e. its 'rebuild' command must not be used)
+    """
+    table = Article._meta.db_table
+    columns = "title, extract, full_text_text"
+    delete_old = (
+        f"INSERT INTO {SQLITE_FTS_TABLE}({SQLITE_FTS_TABLE}, rowid, {columns}) "
+        f"SELECT 'delete', old.id, old.title, old.extract, old.full_text_text WHERE old.content_type IS NOT 'group';"
+    )
+    insert_new = (
+        f"INSERT INTO {SQLITE_FTS_TABLE}(rowid, {columns}) "
+        f"SELECT new.id, new.title, new.extract, new.full_text_text WHERE new.content_type IS NOT 'group';"
+    )
+    return [
+        f"CREATE VIRTUAL TABLE {SQLITE_FTS_TABLE} USING fts5({columns}, content='{table}', content_rowid='id', "
+        "tokenize='unicode61 remove_diacritics 2')",
+        f"CREATE TRIGGER IF NOT EXISTS {SQLITE_FTS_TABLE}_insert AFTER INSERT ON {table} BEGIN {insert_new} END",
+        f"CREATE TRIGGER IF NOT EXISTS {SQLITE_FTS_TABLE}_delete AFTER DELETE ON {table} BEGIN {delete_old} END",
+        # only re-indexed if a searched text changed (not e.g. if an article is added to read later)
+        f"CREATE TRIGGER IF NOT EXISTS {SQLITE_FTS_TABLE}_update AFTER UPDATE OF {columns}, content_type ON {table} "
+        "WHEN old.title IS NOT new.title OR old.extract IS NOT new.extract "
+        "OR old.full_text_text IS NOT new.full_text_text OR old.content_type IS NOT new.content_type "
+        f"BEGIN {delete_old} {insert_new} END",
+        f"INSERT INTO {SQLITE_FTS_TABLE}(rowid, {columns}) "
+        f"SELECT id, {columns} FROM {table} WHERE content_type IS NOT 'group'",
+    ]
+
+
+def get_sqlite_search_triggers():
+    """names of the existing triggers keeping the FTS5 table up to date"""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'trigger' AND tbl_name = %s", [Article._meta.db_table]
+        )
+        return [i[0] for i in cursor.fetchall() if i[0] in SQLITE_FTS_TRIGGERS]
+
+
+def get_postgres_search_index_sql():
+    """statements adding the generated tsvector column and its GIN index"""
+    table = Article._meta.db_table
+    return [
+        f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS search_vector tsvector GENERATED ALWAYS AS ("
+        f"setweight(to_tsvector('{POSTGRES_SEARCH_CONFIG}', coalesce(title, '')), 'A') || "
+        f"setweight(to_tsvector('{POSTGRES_SEARCH_CONFIG}', coalesce(extract, '')), 'B') || "
+        f"setweight(to_tsvector('{POSTGRES_SEARCH_CONFIG}', "
+        f"left(coalesce(full_text_text, ''), {POSTGRES_MAX_TEXT_LENGTH})), 'C')) STORED",
+        f"CREATE INDEX IF NOT EXISTS {table}_search_vector_idx ON {table} USING GIN (search_vector)",
+    ]
+
+
+def ensure_search_index():
+    """create the search index if it does not exist yet - returns False if the database is not supported"""
+    global __search_index_ready
+    if __search_index_ready:
+        return True
+    if connection.vendor == "postgresql":
+        with connection.cursor() as cursor:
+            columns = connection.introspection.get_table_description(cursor, Article._meta.db_table)
+        # altering the table locks it - only done if the column is missing
+        statements = [] if "search_vector" in [i.name for i in columns] else get_postgres_search_index_sql()
+    elif connection.vendor == "sqlite":
+        if SQLITE_FTS_TABLE not in connection.introspection.table_names():
+            print("Creating the full-text search index of all articles...")
+            statements = get_sqlite_search_index_sql()
+        elif len(get_sqlite_search_triggers()) < len(SQLITE_FTS_TRIGGERS):
+            # the triggers are dropped if a migration re-creates the article table - the articles saved since then are
+            # missing, so the index is emptied and re-filled
+            print("Re-creating the full-text search index triggers and re-indexing all articles...")
+            statements = [f"INSERT INTO {SQLITE_FTS_TABLE}({SQLITE_FTS_TABLE}) VALUES('delete-all')"]
+            statements += get_sqlite_search_index_sql()[1:]
+        else:
+            statements = []
+    else:
+        return False
+    with connection.cursor() as cursor:
+        for statement in statements:
+            cursor.execute(statement)
+    __search_index_ready = True
+    return True
+
+
+def get_search_words(query):
+    """lower-case words of the search query"""
+    return [i.lower() for i in WORD_PATTERN.findall(query or "")][:SEARCH_MAX_WORDS]
+
+
+def format_snippet(snippet):
+    """html of the snippet with the matches in bold"""
+    return html.escape(snippet or "").replace(SNIPPET_START, "<b>").replace(SNIPPET_END, "</b>")
+
+
+def search_article_ids(query, limit=20):
+    """
+    [(article pk, rank, snippet html)] of the articles matching all words of the query ordered by rank - the last word
+    also as prefix if it has at least SEARCH_MIN_PREFIX_LENGTH letters. Combined group articles are excluded as they
+    repeat the text of their first article.
+    """
+    words = get_search_words(query)
+    if len(words) == 0:
+        return []
+    limit = max(1, min(limit, SEARCH_MAX_RESULTS))
+    table = Article._meta.db_table
+    is_prefix = len(words[-1]) >= SEARCH_MIN_PREFIX_LENGTH
+
+    if not ensure_search_index():
+        articles = Article.objects.exclude(content_type="group")
+        for word in words:
+            articles = articles.filter(title__icontains=word)
+        return [(i.pk, None, format_snippet(i.extract)) for i in articles.order_by("-pub_date")[:limit]]
+
+    if connection.vendor == "postgresql":
+        sql = (
+            f"SELECT id, rank, ts_headline('{POSTGRES_SEARCH_CONFIG}', "
+            "concat_ws(' ', title, extract, left(full_text_text, 5000)), query, "
+            f"'MaxWords={SNIPPET_WORDS}, MinWords={SNIPPET_WORDS // 2}, MaxFragments=1, "
+            f'StartSel="{SNIPPET_START}", StopSel="{SNIPPET_END}"\') '
+            f"FROM (SELECT id, title, extract, full_text_text, query, ts_rank_cd(search_vector, query) AS rank "
+            f"FROM {table}, to_tsquery('{POSTGRES_SEARCH_CONFIG}', %s) query "
+            "WHERE search_vector @@ query AND content_type != 'group' ORDER BY rank DESC LIMIT %s) AS matches "
+            "ORDER BY rank DESC"
+        )
+        params = [" & ".join(words[:-1] + [f"{words[-1]}:*" if is_prefix else words[-1]]), limit]
+    else:
+        # the snippets are only made of the best matches (the subquery) - not of all matching articles
+        sql = (
+            f"SELECT {SQLITE_FTS_TABLE}.rowid, matches.rank, "
+            f"snippet({SQLITE_FTS_TABLE}, -1, '{SNIPPET_START}', '{SNIPPET_END}', '…', {SNIPPET_WORDS}) "
+            f"FROM {SQLITE_FTS_TABLE} JOIN (SELECT rowid AS id, "
+            f"-bm25({SQLITE_FTS_TABLE}, {SQLITE_FTS_WEIGHTS}) AS rank FROM {SQLITE_FTS_TABLE} "
+            f"WHERE {SQLITE_FTS_TABLE} MATCH %s ORDER BY rank DESC LIMIT %s) AS matches "
+            f"ON matches.id = {SQLITE_FTS_TABLE}.rowid WHERE {SQLITE_FTS_TABLE} MATCH %s ORDER BY matches.rank DESC"
+        )
+        match = " ".join([f'"{i}"' for i in words[:-1]] + [f'"{words[-1]}"' + ("*" if is_prefix else "")])
+        params = [match, limit, match]
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return [(pk, rank, format_snippet(snippet)) for pk, rank, snippet in cursor.fetchall()]
+
+
+def search_articles(query, limit=20):
+    """ranked search results with the article data to list them (without the full texts) - two queries"""
+    results = search_article_ids(query, limit)
+    articles = Article.objects.filter(pk__in=[i[0] for i in results]).values(
+        "pk",
+        "title",
+        "publisher__name",
+        "image_url",
+        "link",
+        "has_full_text",
+        "content_type",
+        "pub_date",
+        "language",
+    )
+    articles = {i["pk"]: i for i in articles}
+    return [dict(**articles[pk], rank=rank, snippet=snippet) for pk, rank, snippet in results if pk in articles]
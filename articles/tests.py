@@ -1,3 +1,153 @@
+"""Tests for articles app"""
+
+import datetime
+
+from django.conf import settings
+from django.core.management import call_command
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from feed_scraper.article_scraper import save_article_groups
+from feeds.models import Publisher
+
+from .models import Article, ArticleGroup, ArticleTag, get_untagged_articles
+
+
+class SaveArticleGroupsTestCase(TestCase):
+    """article groups and their combined articles are saved in bulk - a fixed number of queries for any number of
+    groups"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.publisher = Publisher.objects.create(name="Example News", link="https://example.com")
+
+    def create_articles(self, n):
+        """n articles - the first of each pair is the more relevant one"""
+        now = settings.TIME_ZONE_OBJ.localize(datetime.datetime.now())
+        Article.objects.bulk_create(
+            [
+                Article(
+                    publisher=self.publisher,
+                    title=f"Article {i}",
+                    link=f"https://example.com/article-{i}",
+                    hash=f"https://example.com/article-{i}",
+                    extract=f"Extract {i}",
+                    full_text_text=f"Full text {i}",
+                    categories=f"frontpage;topic {i}",
+                    language="en-GB",
+                    pub_date=now - datetime.timedelta(minutes=i),
+                    min_article_relevance=i,
+                    min_feed_position=i + 1,
+                    max_importance=i % 5,
+                )
+                for i in range(n)
+            ]
+        )
+        return list(Article.objects.filter(content_type="article").order_by("min_article_relevance"))
+
+    def count_queries(self, articles, groups_positions):
+        with CaptureQueriesContext(connection) as queries:
+            save_article_groups(articles, groups_positions)
+        return len(queries)
+
+    def test_new_groups_num_queries(self):
+        articles = self.create_articles(6)
+        # ArticleGroups and articles: 2 | combined articles: 4 reads, 1 insert, 2 tags, 1 ArticleGroup update
+        with self.assertNumQueries(10):
+            self.assertEqual(save_article_groups(articles, [[0, 1], [2, 3], [4, 5]]), 3)
+
+    def test_num_queries_independent_of_group_count(self):
+        articles = self.create_articles(24)
+        self.assertEqual(
+            self.count_queries(articles[:4], [[0, 1], [2, 3]]),
+            self.count_queries(articles[4:], [[i, i + 1] for i in range(0, 20, 2)]),
+        )
+
+    def test_unchanged_groups_are_kept(self):
+        articles = self.create_articles(6)
+        groups_positions = [[0, 1], [2, 3], [4, 5]]
+        save_article_groups(articles, groups_positions)
+        article_groups = set(ArticleGroup.objects.values_list("pk", "combined_article_id"))
+
+        articles = list(Article.objects.filter(content_type="article").order_by("min_article_relevance"))
+        # no new ArticleGroups, articles unchanged: 4 reads, 1 update, 2 tags
+        with self.assertNumQueries(7):
+            save_article_groups(articles, groups_positions)
+        self.assertEqual(set(ArticleGroup.objects.values_list("pk", "combined_article_id")), article_groups)
+        self.assertEqual(Article.objects.filter(content_type="group").count(), 3)
+
+    def test_regrouped_articles(self):
+        articles = self.create_articles(4)
+        save_article_groups(articles, [[0, 1], [2, 3]])
+        articles = list(Article.objects.filter(content_type="article").order_by("min_article_relevance"))
+        save_article_groups(articles, [[0, 2], [1, 3]])
+        self.assertEqual(ArticleGroup.objects.count(), 2)
+        self.assertEqual(Article.objects.filter(content_type="group").count(), 2)
+        groups = {i.article_group_id for i in Article.objects.filter(content_type="article")}
+        self.assertEqual(groups, set(ArticleGroup.objects.values_list("pk", flat=True)))
+
+    def test_combined_article(self):
+        articles = self.create_articles(3)
+        save_article_groups(articles, [[2, 0, 1]])
+        combined_article = ArticleGroup.objects.get().combined_article
+        self.assertEqual(combined_article.content_type, "group")
+        self.assertEqual(combined_article.title, "Article 0")  # the most relevant article
+        self.assertEqual(combined_article.full_text_text, "Full text 0")
+        self.assertEqual(combined_article.pub_date, articles[0].pub_date)  # the latest article
+        self.assertEqual(combined_article.min_feed_position, 1)
+        self.assertEqual(combined_article.max_importance, 2)
+        self.assertEqual(combined_article.language_code, "en")
+        self.assertEqual(set(combined_article.categories.split(";")), {"frontpage", "topic 0", "topic 1", "topic 2"})
+        self.assertIn("Article 1", combined_article.full_text_html)
+        self.assertEqual(
+            set(ArticleTag.objects.filter(article=combined_article).values_list("name", flat=True)),
+            {"frontpage", "topic 0", "topic 1", "topic 2"},
+        )
+
+
+class ArticleTagsTestCase(TestCase):
+    """the tags of an article follow its categories"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.publisher = Publisher.objects.create(name="Example News", link="https://example.com")
+
+    def get_tags(self, article):
+        return set(ArticleTag.objects.filter(article=article).values_list("name", flat=True))
+
+    def create_article(self, categories):
+        article = Article(
+            publisher=self.publisher, title="Title", link="https://example.com/a", hash="a", categories=categories
+        )
+        article.save()
+        return article
+
+    def test_saved_article(self):
+        article = self.create_article("Frontpage; Markets")
+        self.assertEqual(self.get_tags(article), {"frontpage", "markets"})
+        article.categories = "Frontpage;World"
+        article.save()
+        self.assertEqual(self.get_tags(article), {"frontpage", "world"})
+
+    def test_unchanged_categories(self):
+        article = Article.objects.select_related("publisher").get(pk=self.create_article("Frontpage").pk)
+        article.title = "New title"
+        with self.assertNumQueries(1):
+            article.save()
+        article = (
+            Article.objects.select_related("publisher").only("title", "link", "publisher__name").get(pk=article.pk)
+        )
+        with self.assertNumQueries(1):
+            article.save(update_fields=["title"])
+        self.assertEqual(self.get_tags(article), {"frontpage"})
 
-# Create your tests here.
+    def test_backfill(self):
+        articles = [self.create_article(i) for i in ["Frontpage", "Markets", None]]
+        ArticleTag.objects.filter(article=articles[1]).delete()
+        self.assertEqual(list(get_untagged_articles()), [articles[1]])
+        call_command("backfill_article_facets")
+        self.assertEqual(self.get_tags(articles[1]), {"markets"})
+        self.assertFalse(get_untagged_articles().exists())
+        with self.assertNumQueries(2):  # language codes and an empty batch
+            call_command("backfill_article_facets")
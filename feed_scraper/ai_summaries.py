@@ -0,0 +1,247 @@
+# -*- coding: utf-8 -*-
+"""
+AI article summaries via an OpenAI-compatible chat completions API (OPENAI_BASE_URL, e.g. a local stand-in server).
+
+Requests run concurrently (OPENAI_MAX_CONCURRENCY) under token-bucket limits on the prompt + completion tokens and on
+the requests per minute of the API. Summaries are cached by a hash of the normalized article text, so re-published
+copies of an article are summarized for free. The log rows are buffered and written to the csv log at once.
+"""
+
+import concurrent.futures
+import datetime
+import hashlib
+import html
+import re
+import threading
+import time
+
+from bs4 import BeautifulSoup
+from django.conf import settings
+from django.core.cache import cache
+from openai import OpenAI
+
+from articles.models import Article, truncate_long_fields
+
+CHARS_PER_TOKEN = 5  # rough estimate for english news texts
+MAX_ARTICLE_TOKENS = 3000  # longer articles are cut
+MIN_ARTICLE_TOKENS = 500  # shorter articles are not summarized
+MAX_SUMMARY_TOKENS = 300  # max. completion tokens - reserved in the token bucket with the prompt tokens
+COST_TOKEN_INPUT = 0.0005  # USD per 1k tokens
+COST_TOKEN_OUTPUT = 0.0015  # USD per 1k tokens
+NET_USD_TO_GROSS_GBP = 1.2 * 0.785
+AI_SUMMARY_CACHE_SECONDS = 3600 * 24 * 14
+LOG_BUFFER_ROWS = 50
+WORD_PATTERN = re.compile(r"\w+")
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket refilled continuously with capacity tokens per period - acquire() blocks until enough
+    tokens are available. Requests larger than the capacity wait for a full bucket.
+    """
+
+    def __init__(self, capacity, period=60):
+        self.capacity = max(1, capacity)
+        self.rate = self.capacity / period
+        self.__tokens = float(self.capacity)
+        self.__last_refill = time.monotonic()
+        self.__condition = threading.Condition()
+
+    def __refill(self):
+        now = time.monotonic()
+        self.__tokens = min(self.capacity, self.__tokens + (now - self.__last_refill) * self.rate)
+        self.__last_refill = now
+
+    def acquire(self, tokens=1):
+        """take tokens from the bucket - waits until they are available"""
+        tokens = min(tokens, self.capacity)
+        with self.__condition:
+            self.__refill()
+            while self.__tokens < tokens:
+                self.__condition.wait((tokens - self.__tokens) / self.rate)
+                self.__refill()
+            self.__tokens -= tokens
+
+    def adjust(self, tokens):
+        """correct a previous acquire by the difference of the used to the reserved tokens (negative to refund)"""
+        with self.__condition:
+            self.__refill()
+            self.__tokens = min(self.capacity, self.__tokens - tokens)
+            self.__condition.notify_all()
+
+
+class BufferedLog:
+    """csv log (';'-separated) collecting rows in memory and appending them to the file in one write"""
+
+    def __init__(self, path, buffer_rows=LOG_BUFFER_ROWS):
+        self.path = path
+        self.buffer_rows = buffer_rows
+        self.__rows = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.flush()
+
+    def write(self, row):
+        """add a row - the buffer is written once it is full"""
+        self.__rows.append(";".join(row) + "\n")
+        if len(self.__rows) >= self.buffer_rows:
+            self.flush()
+
+    def flush(self):
+        """append the buffered rows to the file"""
+        if len(self.__rows) > 0:
+            with open(self.path, "a+") as file:
+                file.writelines(self.__rows)
+            self.__rows = []
+
+
+def get_article_summary_text(article_obj):
+    """plain text of the article to summarize - the html is only parsed if the plain text was not saved"""
+    if article_obj.full_text_text:
+        article_text = article_obj.full_text_text
+    else:
+        article_text = BeautifulSoup(article_obj.full_text_html or "", "lxml").text
+    return " ".join(html.unescape(article_text).split())[: MAX_ARTICLE_TOKENS * CHARS_PER_TOKEN]
+
+
+def get_summary_bullets(article_text):
+    """number of bullet points of the summary depending on the article length (None if too short to summarize)"""
+    tokens = len(article_text) / CHARS_PER_TOKEN
+    if tokens < MIN_ARTICLE_TOKENS:
+        return None
+    elif tokens < 1000:
+        return 2
+    elif tokens < 2000:
+        return 3
+    return 4
+
+
+def get_summary_cache_key(article_text, model):
+    """cache key of the summary - hash of the model and the text without case, punctuation and whitespace"""
+    normalized_text = " ".join([model] + WORD_PATTERN.findall(article_text.lower()))
+    return f"aiSummary_{hashlib.sha256(normalized_text.encode('utf-8')).hexdigest()}"
+
+
+def format_summary(completion_text):
+    """turn the bullet points of the completion into a html list"""
+    article_summary = completion_text.replace("- ", "<li>").replace("\n", "</li>\n")
+    return "<ul>\n" + article_summary + "</li>\n</ul>"
+
+
+def get_openai_client():
+    """client of the OpenAI-compatible API or None if neither OPENAI_API_KEY nor OPENAI_BASE_URL are set"""
+    if settings.OPENAI_API_KEY is None and settings.OPENAI_BASE_URL is None:
+        return None
+    return OpenAI(
+        # a local stand-in server does not require a key but the client does
+        api_key=settings.OPENAI_API_KEY or "none",
+        base_url=settings.OPENAI_BASE_URL,
+        max_retries=3,
+        timeout=120,
+    )
+
+
+class AISummarizer:
+    """Summarizes many articles concurrently within the token and request limits of the API"""
+
+    def __init__(
+        self, client=None, model=None, max_workers=None, tokens_per_minute=None, requests_per_minute=None, log_path=None
+    ):
+        self.max_workers = max(1, settings.OPENAI_MAX_CONCURRENCY if max_workers is None else max_workers)
+        self.client = get_openai_client() if client is None else client
+        self.model = settings.OPENAI_MODEL if model is None else model
+        self.token_bucket = TokenBucket(
+            settings.OPENAI_TOKENS_PER_MINUTE if tokens_per_minute is None else tokens_per_minute
+        )
+        self.request_bucket = TokenBucket(
+            settings.OPENAI_REQUESTS_PER_MINUTE if requests_per_minute is None else requests_per_minute
+        )
+        self.log_path = str(settings.BASE_DIR) + "/data/ai_summaries.csv" if log_path is None else log_path
+
+    def __request_summary(self, article_text, bullets):
+        """request the summary once the limits allow it - returns (summary html, cost in GBP)"""
+        reserved_tokens = len(article_text) // CHARS_PER_TOKEN + MAX_SUMMARY_TOKENS
+        self.request_bucket.acquire()
+        self.token_bucket.acquire(reserved_tokens)
+        try:
+            completion = self.client.chat.completions.create(
+                model=self.model,
+                messages=[
+                    {"role": "system", "content": f"Summarize this article in {bullets} bulletpoints"},
+                    {"role": "user", "content": article_text},
+                ],
+                max_tokens=MAX_SUMMARY_TOKENS,
+            )
+        except Exception:
+            self.token_bucket.adjust(-reserved_tokens)
+            raise
+        usage = completion.usage
+        self.token_bucket.adjust(usage.prompt_tokens + usage.completion_tokens - reserved_tokens)
+        cost = (
+            (usage.prompt_tokens * COST_TOKEN_INPUT + usage.completion_tokens * COST_TOKEN_OUTPUT)
+            / 1000
+            * NET_USD_TO_GROSS_GBP
+        )
+        return format_summary(completion.choices[0].message.content), round(cost, 8)
+
+    def summarize(self, article_obj_lst):
+        """
+        add AI summaries to the articles and save them in bulk - returns (articles summarized, API requests, cost in
+        GBP). Articles with the same text are only requested once.
+        """
+        if self.client is None:
+            print("Not Requesting AI article summaries as neither OPENAI_API_KEY nor OPENAI_BASE_URL are set.")
+            return 0, 0, 0.0
+
+        jobs = {}  # {cache key: (article text, bullets, [articles])}
+        for article_obj in article_obj_lst:
+            article_text = get_article_summary_text(article_obj)
+            if (bullets := get_summary_bullets(article_text)) is not None:
+                job = jobs.setdefault(get_summary_cache_key(article_text, self.model), (article_text, bullets, []))
+                job[2].append(article_obj)
+        print(f"Requesting AI article summaries for {len(jobs)} article texts.")
+
+        results = {k: ("CACHED", v, 0.0) for k, v in cache.get_many(list(jobs.keys())).items()}
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = {
+                executor.submit(self.__request_summary, article_text, bullets): key
+                for key, (article_text, bullets, _) in jobs.items()
+                if key not in results
+            }
+            for future in concurrent.futures.as_completed(futures):
+                try:
+                    results[futures[future]] = ("SUCCESS", *future.result())
+                except Exception as e:
+                    print(f"Error getting AI article summary for {jobs[futures[future]][2][0]}:", e)
+                    results[futures[future]] = ("ERROR", None, 0.0)
+        cache.set_many(
+            {k: summary for k, (status, summary, _) in results.items() if status == "SUCCESS"},
+            AI_SUMMARY_CACHE_SECONDS,
+        )
+
+        summarized_articles = []
+        with BufferedLog(self.log_path) as log:
+            for key, (status, summary, cost) in results.items():
+                for i, article_obj in enumerate(jobs[key][2]):
+                    if summary is not None:
+                        setattr(article_obj, "ai_summary", summary)
+                        truncate_long_fields(sender=Article, instance=article_obj)
+                        summarized_articles.append(article_obj)
+                    log.write(
+                        [
+                            str(datetime.datetime.now().isoformat()),
+                            str(article_obj.pk),
+                            str(article_obj.publisher.name),
+                            f'"{article_obj.title}"',
+                            str(article_obj.pub_date.isoformat()),
+                            str(article_obj.min_article_relevance),
+                            f'"{article_obj.categories}"',
+                            "CACHED" if i > 0 and status == "SUCCESS" else status,
+                            str(cost if i == 0 else 0),
+                        ]
+                    )
+        Article.objects.bulk_update(summarized_articles, ["ai_summary"], batch_size=500)
+        return len(summarized_articles), len(futures), sum(i[2] for i in results.values())
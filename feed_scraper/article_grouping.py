@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+"""
+Grouping of articles about the same topic based on their (normalized) sentence embeddings.
+
+- full re-cluster: hierarchical clustering of all articles of a page - O(n²), so it only runs periodically
+- incremental: only new articles are grouped - each joins the group with the nearest centroid or forms a new group
+  with the nearest ungrouped article, existing groups are kept as they are
+"""
+
+import numpy as np
+
+# max. distance of articles in a group - ward linkage distance of the full re-cluster and euclidean distance to the
+# group centroid when grouping incrementally (for two articles both are their euclidean distance)
+ARTICLE_GROUP_DISTANCE_THRESHOLD = 1.0
+MAX_ARTICLE_GROUP_SIZE = 9  # larger groups are probably incorrect
+
+
+def cluster_articles(embeddings, distance_threshold=ARTICLE_GROUP_DISTANCE_THRESHOLD):
+    """cluster all articles and return the positions of the articles of each group with more than one article"""
+    # imported here so that only the celery worker loads sklearn - the web process also imports the article scraper
+    from sklearn.cluster import AgglomerativeClustering
+
+    if len(embeddings) < 2:
+        return []
+    clustering = AgglomerativeClustering(n_clusters=None, distance_threshold=distance_threshold, linkage="ward")
+    groups = {}
+    for position, label in enumerate(clustering.fit_predict(embeddings)):
+        groups.setdefault(label, []).append(position)
+    return [i for i in groups.values() if 1 < len(i) <= MAX_ARTICLE_GROUP_SIZE]
+
+
+def assign_new_articles(embeddings, group_ids, new_positions, distance_threshold=ARTICLE_GROUP_DISTANCE_THRESHOLD):
+    """
+    Group the new articles incrementally (nearest neighbour search by brute force, which is fast enough for a page of
+    articles). group_ids are the current group ids of all articles (None if not grouped). Every new article joins the
+    group with the nearest centroid or forms a new group with the nearest ungrouped article if closer than the
+    distance threshold. Returns the positions of the articles of each changed group as {group id: [positions]} -
+    new groups have the keys ("new", <n>).
+    """
+    groups = {}
+    for position, group_id in enumerate(group_ids):
+        if group_id is not None:
+            groups.setdefault(group_id, []).append(position)
+    new_positions = set(new_positions)
+    ungrouped = [i for i, group_id in enumerate(group_ids) if group_id is None and i not in new_positions]
+    changed_groups = set()
+
+    for position in sorted(new_positions):
+        if group_ids[position] is not None:
+            continue
+        vector = embeddings[position]
+        open_groups = [k for k, v in groups.items() if len(v) < MAX_ARTICLE_GROUP_SIZE]
+        group_distances = np.array(
+            [np.linalg.norm(embeddings[groups[k]].mean(axis=0) - vector) for k in open_groups], dtype=np.float32
+        )
+        article_distances = np.linalg.norm(embeddings[ungrouped] - vector, axis=1) if ungrouped else np.zeros(0)
+
+        if (
+            len(group_distances) > 0
+            and group_distances.min() < distance_threshold
+            and (len(article_distances) == 0 or group_distances.min() <= article_distances.min())
+        ):
+            group_id = open_groups[int(group_distances.argmin())]
+            groups[group_id].append(position)
+        elif len(article_distances) > 0 and article_distances.min() < distance_threshold:
+            group_id = ("new", len(changed_groups))
+            groups[group_id] = [ungrouped.pop(int(article_distances.argmin())), position]
+        else:
+            ungrouped.append(position)
+            continue
+        changed_groups.add(group_id)
+
+    return {k: groups[k] for k in changed_groups}
@@ -1,33 +1,54 @@
 # -*- coding: utf-8 -*-
 """This file is doing the article scraping"""
 
+import contextlib
 import datetime
-import html
+import decimal
 import math
 import os
 import random
 import threading
 import time
-import urllib
+import uuid
 
-import feedparser
-import ratelimit
-import requests  # type: ignore
-from bs4 import BeautifulSoup
 from django.conf import settings
 from django.core.cache import cache
-from django.db.models import Count, F, Q
-from openai import OpenAI
+from django.db import connection, transaction
+from django.db.models import Count, FloatField, Q
+from django.db.models.functions import Cast
 from webpush import send_group_notification
-from itertools import groupby
 from django.db.models import Max, Min
 
-from articles.models import Article, ArticleGroup, FeedPosition
+from articles.models import (
+    Article,
+    ArticleGroup,
+    FeedPosition,
+    replace_feed_positions,
+    save_article_tags,
+    set_language_code,
+    tagged_with,
+    truncate_long_fields,
+)
 from feeds.models import Feed, Publisher
 from preferences.models import Page
 
+from .ai_summaries import AISummarizer
+from .article_grouping import MAX_ARTICLE_GROUP_SIZE, assign_new_articles, cluster_articles
 from .article_scraper_class import ScrapedArticle
-from news_platform.pages.pageAPI import get_articles
+from .embeddings import get_article_embeddings
+from .enrichment import ArticleEnricher
+from .feed_fetcher import FeedDownloader, download_feed, print_fetch_timings
+from .feed_scheduler import get_due_feeds, schedule_next_fetch
+from .keywords import add_article_keywords
+from .language_id import identify_languages
+from .near_duplicates import (
+    find_linked_articles,
+    find_near_duplicate_articles,
+    get_scraped_article_minhash,
+    save_article_minhashes,
+    save_near_duplicate_links,
+)
+from news_platform.pages.pageAPI import get_articles_query
 
 
 def postpone(function):
@@ -44,213 +65,414 @@ def postpone(function):
     return decorator
 
 
-def find_grouped_articles():
-    """Finds articles about the same topic and adds ArticleGroup objects"""
-    # sentence_transformers pulls in torch (several hundred MB of RSS and a slow
-    # import). Importing it at module scope made it a hard dependency of the
-    # *web* process too: news_platform.urls -> pages.pageHome -> this module.
-    # Django's system checks import the root URLconf, so `manage.py check` - and
-    # therefore supervisord's `check && exec gunicorn` - blocked on the torch
-    # import before gunicorn ever bound :80. Keep it local to the one function
-    # that needs it so only the celery worker actually pays for it.
-    from sentence_transformers import SentenceTransformer
-    from sklearn.cluster import AgglomerativeClustering
+ARTICLE_GROUP_BATCH_SIZE = 500  # article groups per query
+# aggregates of the articles of a group that are shown by its combined article
+COMBINED_ARTICLE_AGGREGATES = {
+    "pub_date": Max("pub_date"),
+    "publisher_article_position": Min("publisher_article_position"),
+    "min_feed_position": Min("min_feed_position"),
+    "min_article_relevance": Min("min_article_relevance"),
+    "max_importance": Max("max_importance"),
+}
+COMBINED_ARTICLE_RELEVANCE_FIELDS = [
+    "publisher_article_position",
+    "min_feed_position",
+    "min_article_relevance",
+    "max_importance",
+]
+COMBINED_ARTICLE_FIELDS = [
+    "title",
+    "publisher",
+    "link",
+    "image_url",
+    "language",
+    "language_code",
+    "mailto_link",
+    "extract",
+    "categories",
+    "full_text_html",
+    "full_text_text",
+    "ai_summary",
+    "added_date",
+    "last_updated_date",
+] + list(COMBINED_ARTICLE_AGGREGATES)
+
+
+def get_combined_article_aggregates(article_group_ids=None):
+    """aggregates of the articles of each group as {article_group_id: {field: value}} - of all groups if None"""
+    grouped_articles = Article.objects.filter(article_group__isnull=False)
+    if article_group_ids is not None:
+        grouped_articles = grouped_articles.filter(article_group_id__in=article_group_ids)
+    return {
+        row.pop("article_group_id"): {k: row[f"group_{k}"] for k in COMBINED_ARTICLE_AGGREGATES}
+        for row in grouped_articles.order_by()
+        .values("article_group_id")
+        .annotate(**{f"group_{k}": v for k, v in COMBINED_ARTICLE_AGGREGATES.items()})
+    }
+
+
+def get_combined_article_extract_html(articles):
+    """table of the further articles of a group shown by its combined article"""
+    extract_html_rows = [
+        f'<tr class="context-card border-top border-bottom" article_id="{i.pk}" article_target="{"view" if i.has_full_text else "redirect"}"><td>{i.title}<br><span class="text-muted">{i.publisher.name} - <script>document.write(createDateStr("{i.pub_date.isoformat()}", "{i.added_date.isoformat()}", "medium"));</script></span></td></tr>'
+        for i in articles[1:4]
+    ]
+    extract_html_rows = "\n".join(extract_html_rows)
+    return f"\n<tbody>\n{extract_html_rows}\n</tbody>\n"
+
+
+def save_combined_articles(article_group_ids, now):
+    """(re-)create the combined articles of the groups in bulk - a fixed number of queries per batch of groups"""
+    for start in range(0, len(article_group_ids), ARTICLE_GROUP_BATCH_SIZE):
+        batch = article_group_ids[start : start + ARTICLE_GROUP_BATCH_SIZE]
+        aggregates = get_combined_article_aggregates(batch)
+        groups_articles = {}
+        for article in (
+            Article.objects.filter(article_group_id__in=batch)
+            .select_related("publisher")
+            .defer("full_text_html", "full_text_text")
+            .order_by("article_group_id", "min_article_relevance")
+        ):
+            groups_articles.setdefault(article.article_group_id, []).append(article)
+        full_texts = dict(
+            Article.objects.filter(pk__in=[i[0].pk for i in groups_articles.values()]).values_list(
+                "pk", "full_text_text"
+            )
+        )
+        article_groups = ArticleGroup.objects.filter(pk__in=groups_articles.keys()).in_bulk()
+
+        new_combined_articles, updated_combined_articles = {}, []
+        for article_group_id, articles in groups_articles.items():
+            article_group = article_groups[article_group_id]
+            combined_article = Article(
+                pk=article_group.combined_article_id,
+                title=articles[0].title,
+                publisher=articles[0].publisher,
+                link=articles[0].link,
+                image_url=articles[0].image_url,
+                language=articles[0].language,
+                mailto_link=articles[0].mailto_link,
+                content_type="group",
+                extract=articles[0].extract,
+                categories=";".join(set(";".join(i.categories or "" for i in articles).split(";"))),
+                full_text_html=get_combined_article_extract_html(articles),
+                full_text_text=full_texts[articles[0].pk],
+                has_full_text=False,
+                ai_summary=articles[0].ai_summary,
+                added_date=now,
+                last_updated_date=now,
+                **aggregates[article_group_id],
+            )
+            truncate_long_fields(Article, combined_article)
+            set_language_code(Article, combined_article)
+            if article_group.combined_article_id is None:
+                combined_article.hash = "group_" + str(random.randint(1, 1_000_000_000_000_000))
+                new_combined_articles[article_group_id] = combined_article
+            else:
+                updated_combined_articles.append(combined_article)
+
+        Article.objects.bulk_create(new_combined_articles.values())
+        Article.objects.bulk_update(updated_combined_articles, COMBINED_ARTICLE_FIELDS)
+        save_article_tags(list(new_combined_articles.values()) + updated_combined_articles)
+        for article_group_id, combined_article in new_combined_articles.items():
+            article_groups[article_group_id].combined_article = combined_article
+        ArticleGroup.objects.bulk_update(
+            [article_groups[i] for i in new_combined_articles.keys()], ["combined_article"]
+        )
+
+
+def save_article_groups(articles, groups_positions):
+    """
+    Save the found groups (positions of their articles) in bulk and return the number of saved groups. An article
+    group is kept if all its grouped articles stay together - otherwise the involved groups are replaced by new ones.
+    """
+    now = settings.TIME_ZONE_OBJ.localize(datetime.datetime.now())
+    groups_articles = [[articles[i] for i in positions] for positions in groups_positions]
+    # ensure not insane large article groups - probably incorrect group then
+    groups_articles = [i for i in groups_articles if len(i) <= MAX_ARTICLE_GROUP_SIZE]
+
+    # resolve the ArticleGroup of each group - existing if it is the only one of its articles and not already taken
+    existing_group_ids = [{i.article_group_id for i in group_articles} - {None} for group_articles in groups_articles]
+    conflicting_group_ids = {j for i in existing_group_ids if len(i) > 1 for j in i}
+    article_group_ids = []
+    for group_ids in existing_group_ids:
+        group_id = next(iter(group_ids)) if len(group_ids) == 1 else None
+        article_group_ids.append(
+            None if group_id in conflicting_group_ids or group_id in article_group_ids else group_id
+        )
+    if len(conflicting_group_ids) > 0:
+        Article.objects.filter(content_type="group", articlegroup__in=conflicting_group_ids).delete()
+        ArticleGroup.objects.filter(pk__in=conflicting_group_ids).delete()
+    new_article_groups = ArticleGroup.objects.bulk_create([ArticleGroup() for i in article_group_ids if i is None])
+    new_article_group_ids = iter([i.pk for i in new_article_groups])
+    article_group_ids = [next(new_article_group_ids) if i is None else i for i in article_group_ids]
+
+    # add ArticleGroup to articles
+    changed_articles = []
+    for article_group_id, group_articles in zip(article_group_ids, groups_articles):
+        for article in group_articles:
+            if article.article_group_id != article_group_id:
+                article.article_group_id = article_group_id
+                changed_articles.append(article)
+    Article.objects.bulk_update(changed_articles, ["article_group"], batch_size=ARTICLE_GROUP_BATCH_SIZE)
+
+    save_combined_articles(article_group_ids, now)
+    return len(article_group_ids)
+
+
+def update_combined_articles_relevance():
+    """refresh the relevance of all combined articles from their group's articles - only changed ones are written"""
+    now = settings.TIME_ZONE_OBJ.localize(datetime.datetime.now())
+    aggregates = get_combined_article_aggregates()
+    changed_combined_articles = []
+    for article_group_id, combined_article_id, *values in ArticleGroup.objects.filter(
+        combined_article__isnull=False
+    ).values_list("pk", "combined_article_id", *[f"combined_article__{i}" for i in COMBINED_ARTICLE_RELEVANCE_FIELDS]):
+        if article_group_id not in aggregates:
+            continue
+        new_values = {k: aggregates[article_group_id][k] for k in COMBINED_ARTICLE_RELEVANCE_FIELDS}
+        if list(new_values.values()) != values:
+            changed_combined_articles.append(Article(pk=combined_article_id, last_updated_date=now, **new_values))
+    Article.objects.bulk_update(
+        changed_combined_articles,
+        COMBINED_ARTICLE_RELEVANCE_FIELDS + ["last_updated_date"],
+        batch_size=ARTICLE_GROUP_BATCH_SIZE,
+    )
+
 
-    print("Finding article groups...")
+def get_pages_articles():
+    """the articles of every page that are candidates for grouping - one list per page"""
     pages_kwargs = Page.objects.all().order_by("-position_index").values_list("url_parameters_json", flat=True)
-    model = SentenceTransformer("all-MiniLM-L6-v2")
-    new_article_groups = 0
+    return [list(get_articles_query(grouped_articles=False, **page_kwargs)[1]) for page_kwargs in pages_kwargs]
 
-    for page_kwargs in pages_kwargs:
-        _, articles, _ = get_articles(grouped_articles=False, force_recache=True, **page_kwargs)
-        articles_query = [
-            {"id": i.id, "title": i.title, "summary": i.extract, "article_group": i.article_group} for i in articles
-        ]
 
-        articles_text = [f"{i['title']}.\n{i['summary']}" for i in articles_query]
-        embeddings = model.encode(articles_text)
-
-        clustering = AgglomerativeClustering(n_clusters=None, distance_threshold=1.0, linkage="ward")
-        hierarchical_labels = clustering.fit_predict(embeddings)
-
-        article_groups = {
-            i: cat
-            for i, cat in zip(range(len(hierarchical_labels)), hierarchical_labels)
-            if {i: hierarchical_labels.tolist().count(i) for i in range(max(hierarchical_labels) + 1)}[cat] > 1
-        }
-        sorted_article_groups = sorted(article_groups.items(), key=lambda item: item[1])
-        grouped_article_groups = {
-            k: [i[0] for i in g] for k, g in groupby(sorted_article_groups, key=lambda item: item[1])
-        }
-
-        for _, article_pos in grouped_article_groups.items():
-            if len(article_pos) < 10:  # ensure not insane large article groups - probably incorrect group then
-                new_article_groups += 1
-                existing_article_groups = [articles_query[i]["article_group"] for i in article_pos]
-                article_ids = [articles_query[i]["id"] for i in article_pos]
-                common_article_group = max([-1] + [x.id for x in existing_article_groups if x is not None])
-                all_same_groups = all([i is None or i.id == common_article_group for i in existing_article_groups])
-
-                # if different existing article groups - delete existing grouped articles
-                if all_same_groups is False:
-                    for i in existing_article_groups:
-                        if i is not None:
-                            i.delete()
-
-                # get existing ArticleGroup
-                if common_article_group != -1 and all_same_groups:
-                    article_group = ArticleGroup.objects.filter(id=common_article_group)
-                    if len(article_group) > 0:
-                        article_group = article_group[0]
-                    else:
-                        article_group = ArticleGroup()
-                        article_group.save()
-
-                # create new ArticleGroup
-                else:
-                    article_group = ArticleGroup()
-                    article_group.save()
-
-                # add ArticleGroup to articles
-                for article_id in article_ids:
-                    article = Article.objects.get(id=article_id)
-                    setattr(article, "article_group", article_group)
-                    article.save()
-
-                articles = Article.objects.filter(article_group__id=article_group.id).order_by("min_article_relevance")
-
-                categories = ";".join(set(";".join(i.categories for i in articles).split(";")))
-                extract_html_rows = [
-                    f'<tr class="context-card border-top border-bottom" article_id="{i.pk}" article_target="{"view" if i.has_full_text else "redirect"}"><td>{i.title}<br><span class="text-muted">{i.publisher.name} - <script>document.write(createDateStr("{i.pub_date.isoformat()}", "{i.added_date.isoformat()}", "medium"));</script></span></td></tr>'
-                    for i in articles[1:]
-                ]
-                extract_html_rows = "\n".join(extract_html_rows[: min(3, len(extract_html_rows))])
-                extract_html = f"\n<tbody>\n{extract_html_rows}\n</tbody>\n"
-
-                combined_article = Article(
-                    title=articles[0].title,
-                    publisher=articles[0].publisher,
-                    link=articles[0].link,
-                    image_url=articles[0].image_url,
-                    language=articles[0].language,
-                    mailto_link=articles[0].mailto_link,
-                    content_type="group",
-                    pub_date=articles.aggregate(Max("pub_date"))["pub_date__max"],
-                    added_date=articles.aggregate(Max("added_date"))["added_date__max"],
-                    last_updated_date=articles.aggregate(Max("last_updated_date"))["last_updated_date__max"],
-                    publisher_article_position=articles.aggregate(Min("publisher_article_position"))[
-                        "publisher_article_position__min"
-                    ],
-                    min_feed_position=articles.aggregate(Min("min_feed_position"))["min_feed_position__min"],
-                    min_article_relevance=articles.aggregate(Min("min_article_relevance"))[
-                        "min_article_relevance__min"
-                    ],
-                    max_importance=articles.aggregate(Max("max_importance"))["max_importance__max"],
-                    extract=articles[0].extract,
-                    categories=categories,
-                    full_text_html=extract_html,
-                    full_text_text=articles[0].full_text_text,
-                    has_full_text=False,
-                    ai_summary=articles[0].ai_summary,
-                    hash="group_" + str(random.randint(1, 1_000_000_000_000_000)),
-                )
-                combined_article.save()
+def find_grouped_articles(full_recluster=None):
+    """
+    Finds articles about the same topic and adds ArticleGroup objects. The articles of all pages are grouped together
+    once (each article only once) - the pages pick up the groups when they are re-cached. New articles are added to
+    the existing groups (or form new ones) and all articles are only re-clustered every
+    ARTICLE_GROUPING_FULL_RECLUSTER_HOURS hours.
+    """
+    run_start = settings.TIME_ZONE_OBJ.localize(datetime.datetime.now())
+    last_run = cache.get("articleGroupingLastRun")
+    if full_recluster is None:
+        full_recluster = last_run is None or cache.get("articleGroupingLastFullRecluster") is None
+    new_since = None if last_run is None else datetime.datetime.fromisoformat(last_run)
+    print(f"Finding article groups ({'full re-cluster' if full_recluster else 'new articles only'})...")
+    pages_articles = get_pages_articles()
+    articles = list({i.pk: i for page_articles in pages_articles for i in page_articles}.values())
+    print(f"Grouping {len(articles)} articles of {len(pages_articles)} pages")
+
+    if full_recluster:
+        grouped_article_groups = dict(enumerate(cluster_articles(get_article_embeddings(articles))))
+    else:
+        new_positions = [
+            pos
+            for pos, article in enumerate(articles)
+            if article.article_group_id is None and (new_since is None or article.added_date >= new_since)
+        ]
+        grouped_article_groups = {}
+        if len(new_positions) > 0:
+            grouped_article_groups = assign_new_articles(
+                get_article_embeddings(articles), [i.article_group_id for i in articles], new_positions
+            )
 
-                setattr(article_group, "combined_article", combined_article)
-                article_group.save()
+    new_article_groups = save_article_groups(articles, grouped_article_groups.values())
 
     # Delete old article groups
     ArticleGroup.objects.filter(article=None).delete()
     Article.objects.filter(content_type="group", articlegroup__isnull=True).delete()
 
     # Update not new article group's relevance
-    all_article_groups = ArticleGroup.objects.all()
-    for article_group in all_article_groups:
-        articles = Article.objects.filter(article_group__id=article_group.id)
-        combined_article = article_group.combined_article
-
-        if len(articles) > 0 and combined_article is not None:
-            setattr(
-                combined_article,
-                "publisher_article_position",
-                articles.aggregate(Min("publisher_article_position"))["publisher_article_position__min"],
-            )
-            setattr(
-                combined_article,
-                "min_feed_position",
-                articles.aggregate(Min("min_feed_position"))["min_feed_position__min"],
-            )
-            setattr(
-                combined_article,
-                "min_article_relevance",
-                articles.aggregate(Min("min_article_relevance"))["min_article_relevance__min"],
-            )
-            setattr(combined_article, "max_importance", articles.aggregate(Max("max_importance"))["max_importance__max"])
-
-            combined_article.save()
-
-    print(f"Found {new_article_groups} article groups.")
-
+    update_combined_articles_relevance()
+
+    cache.set("articleGroupingLastRun", run_start.isoformat(), 60 * 60 * 24 * 7)
+    if full_recluster:
+        cache.set(
+            "articleGroupingLastFullRecluster",
+            run_start.isoformat(),
+            int(settings.ARTICLE_GROUPING_FULL_RECLUSTER_HOURS * 60 * 60),
+        )
+    print(f"Found {new_article_groups} {'article groups' if full_recluster else 'new or extended article groups'}.")
 
-def update_feeds():
-    """Main function that refreshes/scrapes articles from article feed sources."""
-    start_time = time.time()
 
+def prepare_feed_refresh(all_feeds=False):
+    """Delete the feed positions of inactive feeds and get the active rss feeds that are due for refreshing."""
     # delete feed positions of inactive feeds
     inactive_feeds = Feed.objects.filter(~Q(active=True))
     for feed in inactive_feeds:
         delete_feed_positions(feed=feed)
 
-    # get active feeds
+    # get active feeds that are due for refreshing (all if force re-fetching)
+    force_refetch = os.getenv("FORCE_REFETCH", "False").lower() == "true"
     feeds = Feed.objects.filter(active=True, feed_type="rss")
+    if force_refetch is False and all_feeds is False:
+        feeds = get_due_feeds(feeds)
+        print(f"{len(feeds)} feeds are due for refreshing")
     if settings.TESTING:
         # when testing is turned on only fetch 10% of feeds to not having to wait too long
         feeds = [feeds[i] for i in range(0, len(feeds), len(feeds) // (len(feeds) // 10))]
-    force_refetch = os.getenv("FORCE_REFETCH", "False").lower() == "true"
+    return list(feeds)
 
-    added_articles = 0
-    for feed in feeds:
-        add_articles, feed__last_fetched = fetch_feed(feed, force_refetch)
-        added_articles += add_articles
-        setattr(feed, "last_fetched", feed__last_fetched)
-        feed.save()
-
-    # apply publisher feed position
-    publishers = Publisher.objects.all()
-    for publisher in publishers:
-        articles = (
-            Article.objects.filter(feedposition__feed__publisher__pk=publisher.pk)
-            .exclude(min_feed_position__isnull=True)
-            .exclude(min_article_relevance__isnull=True)
-            .exclude(content_type="video")
-            .annotate(feed_count=Count("feedposition"))
-            .annotate(calc_rel_feed_pos=F("min_feed_position") * 1000 / (F("max_importance") + 4))
-            .order_by(
-                "-calc_rel_feed_pos",
-                "feed_count",
+
+__shared_enricher = None
+__shared_enricher_lock = threading.Lock()
+
+
+def get_shared_enricher():
+    """
+    ArticleEnricher shared by all feeds refreshed in this (worker) process, so its pooled keep-alive connections are
+    re-used across feed tasks - created on first use, i.e. after the worker process was forked
+    """
+    global __shared_enricher
+    with __shared_enricher_lock:
+        if __shared_enricher is None:
+            __shared_enricher = ArticleEnricher()
+        return __shared_enricher
+
+
+ARTICLE_WRITE_LOCK_TIMEOUT = 60 * 5  # the lock expires if a worker dies while holding it
+ARTICLE_WRITE_LOCK_WAIT = 60 * 10  # max. seconds to wait for the lock
+
+
+@contextlib.contextmanager
+def article_write_lock():
+    """
+    Lock (in the cache shared by all workers) so that only one feed at a time creates and links articles - guids and
+    hashes are not unique, so two feeds listing the same story at the same time would both create it otherwise.
+    Yields a function to extend the lock during long writes.
+    """
+    token = uuid.uuid4().hex
+    deadline = time.monotonic() + ARTICLE_WRITE_LOCK_WAIT
+    while cache.add("articleWriteLock", token, ARTICLE_WRITE_LOCK_TIMEOUT) is False:
+        if time.monotonic() > deadline:
+            raise TimeoutError(f"Timed out after {ARTICLE_WRITE_LOCK_WAIT}s waiting for the article write lock")
+        time.sleep(0.1)
+    refreshed_at = time.monotonic()
+
+    def refresh_lock():
+        """extend the lock while it is still held (e.g. once per written article) so that it does not expire"""
+        nonlocal refreshed_at
+        if time.monotonic() - refreshed_at > ARTICLE_WRITE_LOCK_TIMEOUT / 2 and cache.get("articleWriteLock") == token:
+            cache.touch("articleWriteLock", ARTICLE_WRITE_LOCK_TIMEOUT)
+            refreshed_at = time.monotonic()
+
+    try:
+        yield refresh_lock
+    finally:
+        # only release the own lock - it might have expired and been taken by another worker meanwhile
+        if cache.get("articleWriteLock") == token:
+            cache.delete("articleWriteLock")
+
+
+def refresh_feed(feed, force_refetch, fetched_feed, enricher=None):
+    """
+    Process a downloaded feed (fetched_feed is None if the download failed), schedule its next refresh and save it.
+    Returns the number of added articles.
+    """
+    if fetched_feed is None:
+        # try again later - backs off if the feed keeps failing
+        schedule_next_fetch(feed, added_articles=0)
+        feed.save(update_fields=["fetch_interval", "next_fetch_at"])
+        return 0
+    added_articles, feed__last_fetched = fetch_feed(feed, force_refetch, fetched_feed=fetched_feed, enricher=enricher)
+    setattr(feed, "last_fetched", feed__last_fetched)
+    schedule_next_fetch(feed, added_articles=added_articles, fetched_feed=fetched_feed)
+    feed.save()
+    return added_articles
+
+
+RANKING_UPDATE_BATCH_SIZE = 5_000  # rows per UPDATE statement (3 parameters each)
+
+
+def update_publisher_ranking(rows):
+    """
+    write the (pk, publisher_article_position, min_article_relevance) rows with one UPDATE ... FROM per batch (works
+    with SQLite >= 3.33 and PostgreSQL) - much faster than bulk_update()'s CASE WHEN statements for many rows
+    """
+    table = connection.ops.quote_name(Article._meta.db_table)
+    with transaction.atomic(), connection.cursor() as cursor:
+        for i in range(0, len(rows), RANKING_UPDATE_BATCH_SIZE):
+            batch = rows[i : i + RANKING_UPDATE_BATCH_SIZE]
+            cursor.execute(
+                f"WITH ranking (id, position, relevance) AS (VALUES {', '.join(['(%s, %s, %s)'] * len(batch))}) "
+                f"UPDATE {table} SET publisher_article_position = ranking.position, "
+                f"min_article_relevance = ranking.relevance FROM ranking WHERE {table}.id = ranking.id",
+                [value for row in batch for value in row],
+            )
+
+
+def rank_publisher_articles():
+    """
+    Apply the publisher feed position to the article relevance. Ranks the articles of every publisher by their
+    position in the publisher's feeds and scales the article relevance (min. relevance of all its feed positions) by
+    the rank. Computed in memory over two value queries and only the changed articles are written back in bulk.
+    """
+    ranked_articles = (
+        Article.objects.exclude(min_feed_position__isnull=True)
+        .exclude(min_article_relevance__isnull=True)
+        .exclude(content_type="video")
+    )
+    articles = {
+        pk: (
+            # same as F("min_feed_position") * 1000 / (F("max_importance") + 4) on the database (integer division)
+            min_feed_position * 1000 // ((max_importance or 0) + 4),
+            publisher_article_position,
+            current_relevance,
+            base_relevance,
+        )
+        for pk, min_feed_position, max_importance, publisher_article_position, current_relevance, base_relevance in (
+            ranked_articles.order_by()
+            .annotate(
+                current_relevance=Cast("min_article_relevance", FloatField()),
+                base_relevance=Cast(Min("feedposition__relevance"), FloatField()),
+            )
+            .values_list(
+                "pk",
+                "min_feed_position",
+                "max_importance",
+                "publisher_article_position",
+                "current_relevance",
+                "base_relevance",
             )
         )
-        len_articles = len(articles)
-        for i, article in enumerate(articles):
-            setattr(article, "publisher_article_position", int(len_articles - i))
-            setattr(
-                article,
-                "min_article_relevance",
-                min(
-                    float(
-                        round(
-                            (len_articles - i) * float(getattr(article, "min_article_relevance")),
-                            6,
-                        )
-                    ),
-                    10_000,
-                ),
+    }
+    publisher_articles = {}
+    for publisher_pk, article_pk, feed_count in (
+        FeedPosition.objects.filter(article__in=ranked_articles.values("pk"))
+        .order_by()
+        .values_list("feed__publisher_id", "article_id")
+        .annotate(feed_count=Count("pk"))
+    ):
+        publisher_articles.setdefault(publisher_pk, []).append((-articles[article_pk][0], feed_count, article_pk))
+
+    new_values = {}  # pk: (publisher_article_position, min_article_relevance)
+    for publisher_pk in sorted(publisher_articles.keys()):
+        ranking = sorted(publisher_articles[publisher_pk])
+        len_articles = len(ranking)
+        for i, (_, _, article_pk) in enumerate(ranking):
+            # an article of several publishers is scaled by its rank at every publisher
+            relevance = new_values[article_pk][1] if article_pk in new_values else articles[article_pk][3]
+            new_values[article_pk] = (
+                int(len_articles - i),
+                min(float(round((len_articles - i) * relevance, 6)), 10_000),
             )
-            article.save()
 
-    # refresh next refresh time
-    end_time = time.time()
+    changed_articles = [
+        (article_pk, publisher_article_position, decimal.Decimal(f"{min_article_relevance:.6f}"))
+        for article_pk, (publisher_article_position, min_article_relevance) in new_values.items()
+        if articles[article_pk][1] != publisher_article_position
+        or abs(articles[article_pk][2] - min_article_relevance) >= 0.0000005
+    ]
+    update_publisher_ranking(changed_articles)
+    print(
+        f"Ranked {len(new_values)} articles of {len(publisher_articles)} publishers "
+        f"({len(changed_articles)} changed)"
+    )
 
+
+def add_ai_summaries():
+    """Add AI summaries to the most relevant articles during business hours."""
     now = datetime.datetime.now()
     if now.hour >= 18 or now.hour < 6 or now.weekday() in [5, 6]:
         print(
@@ -259,27 +481,38 @@ def update_feeds():
         )
     else:
         min_article_relevance = (
-            Article.objects.filter(categories__icontains="FRONTPAGE", min_article_relevance__isnull=False)
+            Article.objects.filter(tagged_with("frontpage"), min_article_relevance__isnull=False)
             .order_by("min_article_relevance")[20]
             .min_article_relevance
         )
 
-        articles_add_ai_summary = Article.objects.filter(
-            has_full_text=True,
-            ai_summary__isnull=True,
-            min_article_relevance__isnull=False,
-            content_type="article",
-        ).filter(
-            Q(Q(categories__icontains="FRONTPAGE") & Q(min_article_relevance__lte=min_article_relevance))
-            | Q(
-                Q(categories__icontains="SIDEBAR")
-                & Q(publisher__renowned__gte=2)
-                & Q(pub_date__gte=settings.TIME_ZONE_OBJ.localize(datetime.datetime.now() - datetime.timedelta(days=2)))
+        articles_add_ai_summary = (
+            Article.objects.select_related("publisher")
+            .filter(
+                has_full_text=True,
+                ai_summary__isnull=True,
+                min_article_relevance__isnull=False,
+                content_type="article",
+            )
+            .filter(
+                Q(tagged_with("frontpage") & Q(min_article_relevance__lte=min_article_relevance))
+                | Q(
+                    tagged_with("sidebar")
+                    & Q(publisher__renowned__gte=2)
+                    & Q(
+                        pub_date__gte=settings.TIME_ZONE_OBJ.localize(
+                            datetime.datetime.now() - datetime.timedelta(days=2)
+                        )
+                    )
+                )
             )
         )
 
         add_ai_summary(article_obj_lst=articles_add_ai_summary)
 
+
+def delete_old_articles():
+    """Delete articles that are not in any feed anymore and older than 21 days (unless saved by the user)."""
     old_articles = (
         Article.objects.filter(
             min_article_relevance__isnull=True,
@@ -295,11 +528,41 @@ def update_feeds():
     else:
         print("No old articles to delete")
 
+
+def finalize_feed_refresh():
+    """All steps after the individual feeds were refreshed: keywords, ranking, AI summaries, clean-up, and grouping."""
+    add_article_keywords()
+    rank_publisher_articles()
+    add_ai_summaries()
+    delete_old_articles()
     find_grouped_articles()
 
-    print(f"Refreshed articles and added {added_articles} articles in" f" {int(end_time - start_time)} seconds")
 
-    # connection.close()
+def update_feeds(all_feeds=False):
+    """
+    Main function that refreshes/scrapes articles from article feed sources (only the due ones unless all_feeds).
+    Runs all steps in this process - the celery workflow in pageHome.refresh_feeds runs the same steps as tasks.
+    """
+    start_time = time.time()
+    feeds = prepare_feed_refresh(all_feeds=all_feeds)
+    force_refetch = os.getenv("FORCE_REFETCH", "False").lower() == "true"
+
+    # download feeds concurrently but process them (i.e. all database writes) one after another in this thread
+    added_articles = 0
+    feed_timings = []
+    fetch_start_time = time.perf_counter()
+    with ArticleEnricher() as enricher:
+        for feed, fetched_feed, download_time in FeedDownloader(conditional=not force_refetch).download(feeds):
+            processing_start_time = time.perf_counter()
+            added_articles += refresh_feed(feed, force_refetch, fetched_feed=fetched_feed, enricher=enricher)
+            if fetched_feed is not None:
+                feed_timings.append((feed, download_time, time.perf_counter() - processing_start_time))
+    print_fetch_timings(feed_timings, wall_time=time.perf_counter() - fetch_start_time)
+
+    finalize_feed_refresh()
+
+    end_time = time.time()
+    print(f"Refreshed articles and added {added_articles} articles in" f" {int(end_time - start_time)} seconds")
 
 
 def calcualte_relevance(publisher, feed, feed_position, hash, pub_date, article_type):
@@ -370,122 +633,164 @@ def calcualte_relevance(publisher, feed, feed_position, hash, pub_date, article_
 
 def delete_feed_positions(feed):
     """Deletes all feed positions of a respective feed"""
-    all_feedpositions = feed.feedposition_set.all()
-    all_feedpositions.delete()
-
-
-@ratelimit.sleep_and_retry
-@ratelimit.limits(calls=30, period=60)
-def check_limit_openai():
-    """Empty function just to check for calls to API"""
-    # limit of 90k tokens per minute = 90k / 3k per requests = 30 requests
-    # limit of 3500 requests per minute
-    # min(3.5k, 30) = 30 requests per minute
-    return
+    replace_feed_positions(feed=feed, feed_positions=[])
 
 
 def add_ai_summary(article_obj_lst):
-    """Use OpenAI's ChatGPT API to get article summaries"""
-    if settings.OPENAI_API_KEY is None:
-        print("Not Requesting AI article summaries as OPENAI_API_KEY not set.")
-    else:
-        print(f"Requesting AI article summaries for {len(article_obj_lst)} articles.")
-
-        # openai.api_key = settings.OPENAI_API_KEY
-        client = OpenAI(api_key=settings.OPENAI_API_KEY)
-
-        TOTAL_API_COST = float(cache.get("OPENAI_API_COST_LAUNCH", 0.0))
-        COST_TOKEN_INPUT = 0.0005
-        COST_TOKEN_OUTPUT = 0.0015
-        NET_USD_TO_GROSS_GBP = 1.2 * 0.785
-        THIS_RUN_API_COST = 0
-        articles_summarized = 0
-
-        for article_obj in article_obj_lst:
-            logging = [
-                str(datetime.datetime.now().isoformat()),
-                str(article_obj.pk),
-                str(article_obj.publisher.name),
-                f'"{article_obj.title}"',
-                str(article_obj.pub_date.isoformat()),
-                str(article_obj.min_article_relevance),
-                f'"{article_obj.categories}"',
-            ]
-            try:
-                soup = BeautifulSoup(article_obj.full_text_html, "html5lib")
-                article_text = " ".join(html.unescape(soup.text).split())
-                # article_text = re.sub(r'\n+', '\n', article_text).strip()
-                if len(article_text) > 3000 * 5:
-                    article_text = article_text[: 3000 * 5]
-                if len(article_text) / 5 < 500:
-                    continue
-                elif len(article_text) / 5 < 1000:
-                    bullets = 2
-                elif len(article_text) / 5 < 2000:
-                    bullets = 3
-                else:
-                    bullets = 4
-                check_limit_openai()
-                completion = client.chat.completions.create(
-                    # completion = openai.ChatCompletion.create(
-                    model="gpt-3.5-turbo",
-                    messages=[
-                        {
-                            "role": "system",
-                            "content": f"Summarize this article in {bullets} bulletpoints",
-                        },
-                        {
-                            "role": "user",
-                            "content": article_text,
-                        },
-                    ],
-                )
-                article_summary = completion.choices[0].message.content
-                article_summary = article_summary.replace("- ", "<li>").replace("\n", "</li>\n")
-                article_summary = "<ul>\n" + article_summary + "</li>\n</ul>"
-                this_article_cost = round(
-                    float(
-                        (
-                            (completion.usage.prompt_tokens * COST_TOKEN_INPUT)
-                            + (completion.usage.completion_tokens * COST_TOKEN_OUTPUT)
-                        )
-                        / 1000
-                        * NET_USD_TO_GROSS_GBP
-                    ),
-                    8,
-                )
-                THIS_RUN_API_COST += this_article_cost
-                setattr(article_obj, "ai_summary", article_summary)
-                article_obj.save()
-                articles_summarized += 1
-                logging.extend(["SUCCESS", str(this_article_cost)])
-            except Exception as e:
-                print(f"Error getting AI article summary for {article_obj}:", e)
-                logging.extend(["ERROR", str(0)])
+    """Use OpenAI's ChatGPT API (or an OpenAI-compatible API) to get article summaries"""
+    articles_summarized, api_requests, this_run_api_cost = AISummarizer().summarize(article_obj_lst)
+    total_api_cost = float(cache.get("OPENAI_API_COST_LAUNCH", 0.0)) + this_run_api_cost
+    cache.set("OPENAI_API_COST_LAUNCH", total_api_cost, 3600 * 1000)
+    print(
+        f"Summarized {articles_summarized} articles with {api_requests} API requests costing"
+        f" {this_run_api_cost} GBP. Total API cost since container launch"
+        f" {total_api_cost} GBP."
+    )
 
-            with open(str(settings.BASE_DIR) + "/data/ai_summaries.csv", "a+") as myfile:
-                myfile.write(";".join(logging) + "\n")
 
-        TOTAL_API_COST += THIS_RUN_API_COST
-        cache.set("OPENAI_API_COST_LAUNCH", TOTAL_API_COST, 3600 * 1000)
-        print(
-            f"Summarized {articles_summarized} articles costing"
-            f" {THIS_RUN_API_COST} GBP. Total API cost since container launch"
-            f" {TOTAL_API_COST} GBP."
+# Article fields required to update an existing article from a feed - everything except e.g. the large full-text fields
+EXISTING_ARTICLE_FIELDS = [
+    "publisher",
+    "publisher__name",
+    "publisher__renowned",
+    "publisher__link",
+    "title",
+    "link",
+    "image_url",
+    "importance_type",
+    "content_type",
+    "extract",
+    "has_full_text",
+    "pub_date",
+    "added_date",
+    "last_updated_date",
+    "categories",
+    "guid",
+    "hash",
+]
+
+
+def __truncate_to_field(value, field_name):
+    """truncate str to max_length of the Article field as the values are truncated before saving too"""
+    max_length = Article._meta.get_field(field_name).max_length
+    if isinstance(value, str) and len(value) > max_length:
+        return value[:max_length]
+    return value
+
+
+def is_article_publisher(scraped_article, publisher):
+    """whether publisher is the scraped article's publisher - the feed's or the one listed by a news aggregator"""
+    scraped_publisher = scraped_article.article_publisher__final
+    if not isinstance(scraped_publisher, dict):
+        return scraped_publisher.pk == publisher.pk
+    if "link" in scraped_publisher:
+        # the same domain match as used to find the publisher of new articles from news aggregators
+        return ".".join(scraped_publisher["link"].split(".")[-2:]).lower() in (publisher.link or "").lower()
+    return scraped_article.feed_obj__model.publisher.pk == publisher.pk
+
+
+def find_existing_articles(scraped_articles):
+    """
+    Batched dedup stage: look up all guids and hashes of a feed's scraped articles with one query over a slim
+    projection and return a dict {("guid", guid): article, ("hash", hash): article} for the per-entry logic
+    """
+    guids = {__truncate_to_field(i.article_id__final, "guid") for i in scraped_articles}
+    hashes = {__truncate_to_field(i.article_hash__final, "hash") for i in scraped_articles}
+    if len(guids) == 0 and len(hashes) == 0:
+        return {}
+
+    existing_articles = {}
+    for article in (
+        Article.objects.filter(Q(guid__in=guids) | Q(hash__in=hashes))
+        .select_related("publisher")
+        .only(*EXISTING_ARTICLE_FIELDS)
+    ):
+        existing_articles.setdefault(("guid", article.guid), article)
+        existing_articles.setdefault(("hash", article.hash), article)
+    return existing_articles
+
+
+def get_existing_article(existing_articles, guid, hash):
+    """get matching existing article from result of find_existing_articles - guid match is preferred over hash"""
+    article_obj = existing_articles.get(("guid", __truncate_to_field(guid, "guid")))
+    if article_obj is None:
+        article_obj = existing_articles.get(("hash", __truncate_to_field(hash, "hash")))
+    return article_obj
+
+
+def find_known_articles(feed, scraped_articles, existing_articles, minhashes):
+    """
+    Add the existing articles of all scraped articles that are not known yet to existing_articles - by guid/hash or as
+    near-duplicate of the same publisher (e.g. a story re-published under a new link or listed by a news aggregator).
+    The signatures of new articles are added to minhashes {(guid, hash): minhash}. Returns the keys (guid, hash) of the
+    near-duplicates.
+    """
+    unknown_articles = [
+        i
+        for i in scraped_articles
+        if get_existing_article(existing_articles, guid=i.article_id__final, hash=i.article_hash__final) is None
+    ]
+    if len(unknown_articles) == 0:
+        return set()
+    for key, article_obj in find_existing_articles(unknown_articles).items():
+        existing_articles.setdefault(key, article_obj)
+
+    # near-duplicates are only linked to articles of the same publisher - entries linked before are found by their
+    # guid/hash, the signatures of the others are compared to the ones of the recently added articles
+    new_articles = {}
+    for scraped_article in unknown_articles:
+        guid, hash = scraped_article.article_id__final, scraped_article.article_hash__final
+        if get_existing_article(existing_articles, guid=guid, hash=hash) is None:
+            new_articles[(guid, hash)] = scraped_article
+    articles = Article.objects.select_related("publisher").only(*EXISTING_ARTICLE_FIELDS)
+    near_duplicates = find_linked_articles(list(new_articles.keys()), articles=articles)
+    new_minhashes = {}
+    for key, scraped_article in new_articles.items():
+        if key not in near_duplicates:
+            if key not in minhashes:
+                minhashes[key] = get_scraped_article_minhash(scraped_article)
+            new_minhashes[key] = minhashes[key]
+    near_duplicates.update(
+        find_near_duplicate_articles(
+            new_minhashes,
+            articles=articles,
+            is_match=lambda key, article_obj: is_article_publisher(new_articles[key], article_obj.publisher),
         )
+    )
+    for (guid, hash), article_obj in near_duplicates.items():
+        existing_articles[("guid", __truncate_to_field(guid, "guid"))] = article_obj
+        existing_articles[("hash", __truncate_to_field(hash, "hash"))] = article_obj
+    for scraped_article in unknown_articles:
+        article_obj = get_existing_article(
+            existing_articles, guid=scraped_article.article_id__final, hash=scraped_article.article_hash__final
+        )
+        if article_obj is not None:
+            # the feed's categories are added to the ones of the existing article
+            scraped_article.current_categories = article_obj.categories
+    if len(near_duplicates) > 0:
+        print(f"Feed '{feed}': {len(near_duplicates)} new articles are near-duplicates of existing articles")
+    return set(near_duplicates.keys())
 
 
-def fetch_feed(feed, force_refetch):
-    """Fetch/update/scrape all articles for a specific source feed"""
+def fetch_feed(feed, force_refetch, fetched_feed=None, enricher=None):
+    """
+    Fetch/update/scrape all articles for a specific source feed. The feed is downloaded here unless it was already
+    downloaded and parsed (e.g. concurrently by the FeedDownloader) and passed as fetched_feed. Article data is
+    fetched with the given ArticleEnricher to share its connection pool across feeds (or a new one otherwise).
+    """
     added_articles = 0
     updated_articles = 0
     no_change_articles = 0
 
-    feed_url = feed.url
-    if "http://FEED-CREATOR.local" in feed_url:
-        feed_url = feed_url.replace("http://FEED-CREATOR.local", settings.FEED_CREATOR_URL)
+    if fetched_feed is None:
+        fetched_feed = download_feed(feed, conditional=not force_refetch)
+        if fetched_feed is None:
+            return added_articles, feed.last_fetched
+
+    if fetched_feed.get("status") == 304:
+        print(f"Feed '{feed}' does not require refreshing - not modified since last download (HTTP 304)")
+        return added_articles, feed.last_fetched
 
-    fetched_feed = feedparser.parse(feed_url)
     fetched_feed__last_updated = []
     if hasattr(fetched_feed.feed, "updated_parsed"):
         fetched_feed__last_updated.append(
@@ -506,36 +811,35 @@ def fetch_feed(feed, force_refetch):
             f"(latest change at {fetched_feed__last_updated})"
         )
 
-    if len(fetched_feed.entries) > 0:
-        delete_feed_positions(feed)
-
-    for article_feed_position, feed_article in enumerate(fetched_feed.entries, 1):
+    scraped_articles = []
+    for feed_article in fetched_feed.entries:
         scraped_article = ScrapedArticle(feed_model=feed)
         scraped_article.add_feed_attrs(feed_obj=fetched_feed.feed, article_obj=feed_article)
-
-        scraped_article__url = scraped_article.article_link__final
-        scraped_article__hash = scraped_article.article_hash__final
-        scraped_article__guid = scraped_article.article_id__final
+        scraped_articles.append(scraped_article)
+
+    # check which articles already exist (incl. near-duplicates) - a few queries for the entire feed
+    existing_articles = {}
+    minhashes = {}
+    near_duplicate_keys = find_known_articles(feed, scraped_articles, existing_articles, minhashes)
+    feed_positions = []
+    new_article_minhashes = []
+    notification_candidates = []
+
+    # decide which articles require fetching additional data
+    fetch_lst = []
+    enrichment_jobs = []
+    full_text_scraping = feed.full_text_fetch == "Y" and settings.FULL_TEXT_URL is not None
+    for scraped_article in scraped_articles:
         scraped_article__last_updated = scraped_article.article_last_updated__final
-
-        # check if article already exists
-        matches = Article.objects.filter(
-            guid=scraped_article__guid[:95]
-            if isinstance(scraped_article__guid, str) and len(scraped_article__guid) > 95
-            else scraped_article__guid
+        article_obj = get_existing_article(
+            existing_articles, guid=scraped_article.article_id__final, hash=scraped_article.article_hash__final
         )
-        if len(matches) == 0:
-            matches = Article.objects.filter(
-                hash=scraped_article__hash[:100]
-                if isinstance(scraped_article__hash, str) and len(scraped_article__hash) > 100
-                else scraped_article__hash
-            )
 
-        # check if additional data fetching required
         fetch = False
-        full_text_scraping = feed.full_text_fetch == "Y"
-        if len(matches) > 0:
-            article_obj = matches[0]
+        if (scraped_article.article_id__final, scraped_article.article_hash__final) in near_duplicate_keys:
+            # only linked - the existing article is kept as it is
+            scraped_article.current_categories = article_obj.categories
+        elif article_obj is not None:
             scraped_article.current_categories = article_obj.categories
             # if article was updated or
             # article is missing image or extract and was published in the last 4 hours try getting content or
@@ -566,89 +870,114 @@ def fetch_feed(feed, force_refetch):
         else:
             fetch = True
 
+        fetch_lst.append(fetch)
         if fetch:
-            # fetch <meta> data
-            try:
-                article_html_response = requests.get(scraped_article__url, timeout=5)
-                scraped_article.parse_meta_attrs(response_obj=article_html_response)
-            except Exception as e:
-                print(f'Error fetching meta for "{scraped_article.article_title__final}": {e}')
-            if full_text_scraping and settings.FULL_TEXT_URL is not None:
-                # fetch full-text data
-                try:
-                    full_text_request_url = (
-                        f"{settings.FULL_TEXT_URL}extract.php?"
-                        f'url={urllib.parse.quote(scraped_article__url, safe="")}'
-                    )
-                    full_text_response = requests.get(full_text_request_url, timeout=5)
-                    if full_text_response.status_code == 200:
-                        full_text_json = full_text_response.json()
-                        scraped_article.parse_scrape_attrs(json_dict=full_text_json)
-                except Exception as e:
-                    print(f'Error fetching full-text for "{scraped_article.article_title__final}": {e}')
-
-        # create new entry
-        if len(matches) == 0:
-            article_kwargs = scraped_article.get_final_attrs()
-            # if feed is news aggregator - find correct article publisher
-            if isinstance((publisher := article_kwargs["publisher"]), dict):
-                if "link" in publisher:
-                    url = ".".join(publisher["link"].split(".")[-2:])
-                    matching_publishers = Publisher.objects.filter(link__icontains=url)
-                    # existing matching publisher found
-                    if len(matching_publishers) > 0:
-                        article_kwargs["publisher"] = matching_publishers[0]
-                    # no existing found - create new
+            enrichment_jobs.append((scraped_article, scraped_article.article_link__final, full_text_scraping))
+
+    # fetch <meta> data and full-text data of all articles of the feed concurrently
+    if enricher is None:
+        with ArticleEnricher() as enricher:
+            enricher.enrich(enrichment_jobs)
+    else:
+        enricher.enrich(enrichment_jobs)
+
+    # identify the language of all new/updated articles together - the meta data of the enrichment is included
+    identify_languages([i for i, fetch in zip(scraped_articles, fetch_lst) if fetch], feed.publisher.language)
+
+    # articles are created and linked by one feed at a time across all workers - another feed might have added some of
+    # the new articles (or near-duplicates of them) while this feed's articles were fetched, so they are looked up again
+    with article_write_lock() as refresh_write_lock:
+        near_duplicate_keys |= find_known_articles(feed, scraped_articles, existing_articles, minhashes)
+
+        for article_feed_position, (scraped_article, fetch) in enumerate(zip(scraped_articles, fetch_lst), 1):
+            refresh_write_lock()
+            scraped_article__guid = scraped_article.article_id__final
+            # looked up again as the article might have been created for an earlier entry of the same feed
+            article_obj = get_existing_article(
+                existing_articles, guid=scraped_article__guid, hash=scraped_article.article_hash__final
+            )
+
+            # create new entry
+            if article_obj is None:
+                article_kwargs = scraped_article.get_final_attrs()
+                # if feed is news aggregator - find correct article publisher
+                if isinstance((publisher := article_kwargs["publisher"]), dict):
+                    if "link" in publisher:
+                        url = ".".join(publisher["link"].split(".")[-2:])
+                        matching_publishers = Publisher.objects.filter(link__icontains=url)
+                        # existing matching publisher found
+                        if len(matching_publishers) > 0:
+                            article_kwargs["publisher"] = matching_publishers[0]
+                        # no existing found - create new
+                        else:
+                            publisher_obj = Publisher(**article_kwargs["publisher"], renowned=-2)
+                            publisher_obj.save()
+                            article_kwargs["publisher"] = publisher_obj
                     else:
-                        publisher_obj = Publisher(**article_kwargs["publisher"], renowned=-2)
-                        publisher_obj.save()
-                        article_kwargs["publisher"] = publisher_obj
-                else:
-                    article_kwargs["publisher"] = feed.publisher
-            # create article
-            article_obj = Article(**article_kwargs)
-            article_obj.save()
-            added_articles += 1
-
-        # update entry
-        elif fetch and len(matches) > 0:
-            article_kwargs = scraped_article.get_final_attrs()
-            _ = article_kwargs.pop("publisher")
-            for prop, new_value in article_kwargs.items():
-                if new_value is not None and new_value != "":
-                    setattr(article_obj, prop, new_value)
-            article_obj.save()
-            updated_articles += 1
-
-        # don't update entire entry - just categories
-        else:
-            curr_categories = getattr(article_obj, "categories", None)
-            updated_categories = scraped_article.article_tags__final
-            if updated_categories != curr_categories:
-                setattr(article_obj, "categories", updated_categories)
+                        article_kwargs["publisher"] = feed.publisher
+                # create article
+                article_obj = Article(**article_kwargs)
                 article_obj.save()
-            no_change_articles += 1
-
-        # Update article metrics
-        (new_max_importance, new_min_article_relevance) = calcualte_relevance(
-            publisher=feed.publisher,
-            feed=feed,
-            feed_position=article_feed_position,
-            hash=scraped_article__guid,
-            pub_date=article_obj.pub_date,
-            article_type=article_obj.content_type,
-        )
+                added_articles += 1
+                minhash = minhashes.get((scraped_article__guid, scraped_article.article_hash__final))
+                new_article_minhashes.append((article_obj, minhash))
+                # make sure the same article is not created twice if it is listed several times in the feed
+                existing_articles[("guid", article_obj.guid)] = article_obj
+                existing_articles[("hash", article_obj.hash)] = article_obj
+
+            # update entry (near-duplicates are only linked - the existing article is kept as it is)
+            elif fetch and (scraped_article__guid, scraped_article.article_hash__final) not in near_duplicate_keys:
+                article_kwargs = scraped_article.get_final_attrs()
+                _ = article_kwargs.pop("publisher")
+                for prop, new_value in article_kwargs.items():
+                    if new_value is not None and new_value != "":
+                        setattr(article_obj, prop, new_value)
+                article_obj.save()
+                updated_articles += 1
+
+            # don't update entire entry - just categories
+            else:
+                curr_categories = getattr(article_obj, "categories", None)
+                updated_categories = scraped_article.article_tags__final
+                if updated_categories != curr_categories:
+                    setattr(article_obj, "categories", updated_categories)
+                    article_obj.save()
+                no_change_articles += 1
+
+            # Update article metrics
+            (new_max_importance, new_min_article_relevance) = calcualte_relevance(
+                publisher=feed.publisher,
+                feed=feed,
+                feed_position=article_feed_position,
+                hash=scraped_article__guid,
+                pub_date=article_obj.pub_date,
+                article_type=article_obj.content_type,
+            )
 
-        # Add feed position linking
-        feed_position = FeedPosition(
-            feed=feed,
-            article=article_obj,
-            position=article_feed_position,
-            importance=new_max_importance,
-            relevance=new_min_article_relevance,
+            # Add feed position linking (saved in bulk for the entire feed below)
+            feed_positions.append(
+                FeedPosition(
+                    feed=feed,
+                    article=article_obj,
+                    position=article_feed_position,
+                    importance=new_max_importance,
+                    relevance=new_min_article_relevance,
+                )
+            )
+
+            # push notifications are sent below once the lock is released
+            notification_candidates.append((article_feed_position, article_obj))
+
+        if len(scraped_articles) > 0:
+            replace_feed_positions(feed=feed, feed_positions=feed_positions)
+        save_article_minhashes(new_article_minhashes)
+        # remember the near-duplicate links - the signatures are not compared again on the next refresh
+        save_near_duplicate_links(
+            [(guid, hash, get_existing_article(existing_articles, guid, hash)) for guid, hash in near_duplicate_keys]
         )
-        feed_position.save()
 
+    # push notifications are sent outside the lock as they wait for the push services
+    for article_feed_position, article_obj in notification_candidates:
         # check if important news for push notification
         now = datetime.datetime.now()
         notifications_sent = cache.get("notifications_sent", [])
@@ -709,6 +1038,13 @@ def fetch_feed(feed, force_refetch):
                     f"({article_obj.pk}) {article_obj.publisher.name} - {article_obj.title}: {e}"
                 )
 
+    # remember the validators only once the feed was processed successfully - validators longer than their field are
+    # not kept (a truncated ETag would never match, so the next download is unconditional instead)
+    validators = [("http_etag", fetched_feed.get("etag")), ("http_last_modified", fetched_feed.get("modified"))]
+    for field_name, value in validators:
+        max_length = feed._meta.get_field(field_name).max_length
+        setattr(feed, field_name, value if value is None or len(value) <= max_length else None)
+
     print(
         f"Refreshed '{feed}' feed with {added_articles} added, {updated_articles} changed, and {no_change_articles} "
         f"not modified articles (total feed {len(fetched_feed.entries)})"
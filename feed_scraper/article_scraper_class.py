@@ -1,17 +1,25 @@
 # -*- coding: utf-8 -*-
 
 import datetime
+import functools
 import html
 import re
 import time
 import urllib
 
-import langid
 from bs4 import BeautifulSoup
+from lxml import etree
+from lxml import html as lxml_html
 from django.conf import settings
-import requests
 
 from .google_news_decode import decode_google_news_url
+from .language_id import (
+    classify_languages,
+    get_candidate_languages,
+    get_declared_language,
+    get_language_code,
+    get_scraped_article_language_text,
+)
 
 # from newspaper import Article
 # import hashlib
@@ -55,6 +63,9 @@ HEADLINE_NEWS_KEYWORDS = [
 # keywords to detect paywall items
 PAYWALL_KEYWORDS = ["standard digital", "continue reading"]
 
+# text is treated as html if it contains at least one tag
+HTML_TAG_PATTERN = re.compile(r"<[a-zA-Z][^>]*>")
+
 
 def is_valid_url(url):
     """small helper function to check if url (e.g. image url) is a valid url"""
@@ -72,110 +83,197 @@ def ensure_dt_is_tz_aware(dt):
     return dt
 
 
-def html_clean_up(article_html):
-    """helper function to clean-up html code and remove unwanted parts"""
-    soup = BeautifulSoup(article_html, "html.parser")
-    for i, img in enumerate(soup.find_all("img")):
-        img["style"] = "max-width: 100%; max-height: 80vh; width: auto; height: auto;"
-        if img["src"].lower() in ["src", "none", ""]:
-            if "data-url" in img.attrs:
-                img["src"] = str(img["data-url"]).replace("${formatId}", "906")
-            elif "data-src" in img.attrs:
-                img["src"] = img["data-src"]
-        if "srcset" in img.attrs:
-            img["srcset"] = ""
-        img["referrerpolicy"] = "no-referrer"
-
-    for own_class in ["headline", "breaking", "live", "briefing"]:
-        matches = soup.find_all(class_=own_class)
-        for match in matches:
-            match["class"].remove(own_class)
-
-    for figure in soup.find_all("figure"):
-        figure["class"] = "figure"
-
-    for figcaption in soup.find_all("figcaption"):
-        figcaption["class"] = "figure-caption"
-
-    for span in soup.find_all("span", attrs={"data-caps": "initial"}):
-        span["class"] = "h3"
-
-    for a in soup.find_all("a"):
-        a["target"] = "_blank"
-        a["referrerpolicy"] = "no-referrer"
-        a["class"] = "link-trace"
-
-    for link in soup.find_all("link"):
-        if link is not None:
-            link.decompose()
-    for form in soup.find_all("form"):
-        if form is not None:
-            form.decompose()
-
-    for input in soup.find_all("input"):
-        if input is not None:
-            input.decompose()
-
-    for button in soup.find_all("button"):
-        if button is not None:
-            button.decompose()
-
-    for meta in soup.find_all("meta"):
-        if meta is not None:
-            meta.decompose()
-
-    for noscript in soup.find_all("noscript"):
-        if noscript is not None:
-            noscript.name = "div"
-
-    for div_type, id in [
-        ("div", "barrierContent"),
-        ("div", "nousermsg"),
-        ("div", "trial_print_message"),
-        ("div", "print_blocked_message"),
-        ("div", "copy_blocked_message"),
-        ("div", "posted-in"),
-        ("div", "related-articles"),
-        ("div", "video-html5-playlist"),
-        ("div", "article-meta"),
-        ("div", "hidden"),
-        ("p", "vjs-no-js"),
-        ("section", "ad"),
-        ("blockquote", "twitter-tweet"),
-        ("aside", "read-more"),
-        ("nav", "breadcrumbs"),
-        ("button", "toolbar-item-parent-share-2909"),
-        ("button", "CreateFreeAccountButton-buttonContainer"),
-        ("ul", "toolbar-item-dropdown-share-2909"),
-    ]:
-        divs = soup.find_all(div_type, id=id)
-        if divs is None:
-            divs = soup.find_all(div_type, class_=id)
-        if divs is not None:
-            for div in divs:
-                div.decompose()
-
-    article_html = soup.prettify()
-    article_text = soup.text
+# html clean-up rules
+IMG_STYLE = "max-width: 100%; max-height: 80vh; width: auto; height: auto;"
+OWN_CSS_CLASSES = ["headline", "breaking", "live", "briefing"]
+CSS_CLASS_BY_TAG = {"figure": "figure", "figcaption": "figure-caption", "a": "link-trace"}
+REMOVE_TAGS = {"link", "form", "input", "button", "meta"}
+REMOVE_TAGS_BY_ID = {
+    ("div", "barrierContent"),
+    ("div", "nousermsg"),
+    ("div", "trial_print_message"),
+    ("div", "print_blocked_message"),
+    ("div", "copy_blocked_message"),
+    ("div", "posted-in"),
+    ("div", "related-articles"),
+    ("div", "video-html5-playlist"),
+    ("div", "article-meta"),
+    ("div", "hidden"),
+    ("p", "vjs-no-js"),
+    ("section", "ad"),
+    ("blockquote", "twitter-tweet"),
+    ("aside", "read-more"),
+    ("nav", "breadcrumbs"),
+    ("button", "toolbar-item-parent-share-2909"),
+    ("button", "CreateFreeAccountButton-buttonContainer"),
+    ("ul", "toolbar-item-dropdown-share-2909"),
+}
+NON_TEXT_TAGS = {"script", "style", "template"}
+
+
+def __clean_up_element(element):
+    """apply the clean-up rules to a single element - returns False if the element is to be removed"""
+    tag = element.tag
+    if tag in REMOVE_TAGS:
+        return False
+    if tag == "noscript":
+        tag = element.tag = "div"
+    if (tag, element.get("id")) in REMOVE_TAGS_BY_ID:
+        return False
+
+    if (css_classes := element.get("class")) is not None:
+        css_classes = css_classes.split()
+        for own_class in OWN_CSS_CLASSES:
+            if own_class in css_classes:
+                css_classes.remove(own_class)
+        element.set("class", " ".join(css_classes))
+
+    if tag in CSS_CLASS_BY_TAG:
+        element.set("class", CSS_CLASS_BY_TAG[tag])
+    if tag == "a":
+        element.set("target", "_blank")
+        element.set("referrerpolicy", "no-referrer")
+    elif tag == "span" and element.get("data-caps") == "initial":
+        element.set("class", "h3")
+    elif tag == "img":
+        element.set("style", IMG_STYLE)
+        if element.get("src", "").lower() in ["src", "none", ""]:
+            if (data_url := element.get("data-url")) is not None:
+                element.set("src", data_url.replace("${formatId}", "906"))
+            elif (data_src := element.get("data-src")) is not None:
+                element.set("src", data_src)
+        if "srcset" in element.attrib:
+            element.set("srcset", "")
+        element.set("referrerpolicy", "no-referrer")
+    return True
+
+
+def is_html(text):
+    """small helper function to check if text contains html tags"""
+    return HTML_TAG_PATTERN.search(text) is not None
+
+
+def html_clean_up(article_html, img_lst=None):
+    """
+    helper function to clean-up html code and remove unwanted parts
+
+    The html is parsed once with lxml and all rewrites, removals and the text extraction happen in a single walk
+    over the element tree. If img_lst is given, the (cleaned-up) src of all images kept is appended to it.
+    """
+    try:
+        root = lxml_html.fragment_fromstring(article_html, create_parent="div")
+    except ValueError:  # lxml refuses str with an xml encoding declaration
+        root = lxml_html.fragment_fromstring(article_html.encode("utf-8"), create_parent="div")
+    except etree.ParserError:
+        return "", ""
+
+    text_parts = []
+    remove_elements = []
+    stack = [root]
+    while len(stack) > 0:
+        item = stack.pop()
+        if isinstance(item, str):  # text following a child element (i.e. its tail)
+            text_parts.append(item)
+            continue
+        if not isinstance(item.tag, str):  # comments and processing instructions
+            continue
+        if item is not root and __clean_up_element(item) is False:
+            remove_elements.append(item)
+            continue
+        if img_lst is not None and item.tag == "img" and (img_src := item.get("src")) is not None:
+            img_lst.append(img_src)
+        if item.text is not None and item.tag not in NON_TEXT_TAGS:
+            text_parts.append(item.text)
+        for child in reversed(item):
+            if child.tail is not None:
+                stack.append(child.tail)
+            stack.append(child)
+
+    for element in remove_elements:
+        element.drop_tree()  # keeps the text following the element
+
+    article_html = html.escape(root.text or "", quote=False) + "".join(
+        lxml_html.tostring(child, encoding="unicode") for child in root
+    )
+    article_text = "".join(text_parts)
     # article_text = " ".join(html.unescape(article_text).split())
     article_text = re.sub(r"\n+", "\n", article_text).strip()
 
     return article_html, article_text
 
 
+def get_html_elements(article_html):
+    """elements of the html in document order with their attributes - independent of the formatting"""
+    root = lxml_html.fragment_fromstring(article_html, create_parent="div")
+    return [
+        (element.tag, sorted((k, " ".join(v.split())) for k, v in element.attrib.items()))
+        for element in root.iterdescendants()
+        if isinstance(element.tag, str)
+    ]
+
+
+def final_attr(func):
+    """
+    decorator for the *__final properties of ScrapedArticle: the value is resolved once and then memoized until new
+    source data arrives (see ScrapedArticle.invalidate_final_attrs)
+    """
+    attr_name = func.__name__
+
+    @functools.wraps(func)
+    def wrapper(self):
+        if attr_name not in self.final_attrs_cache:
+            self.final_attrs_cache[attr_name] = func(self)
+        return self.final_attrs_cache[attr_name]
+
+    return property(wrapper)
+
+
+def invalidates_final_attrs(func):
+    """decorator for methods adding source data to ScrapedArticle - the memoized *__final values are reset afterwards"""
+
+    @functools.wraps(func)
+    def wrapper(self, *args, **kwargs):
+        try:
+            return func(self, *args, **kwargs)
+        finally:
+            self.invalidate_final_attrs()
+
+    return wrapper
+
+
 class ScrapedArticle:
     """
     Class to collect all article information from scraping.
 
     Class attribute naming scheme: field_name__source (sources: feed, meta, scrape)
+    The *__final attributes select the best value of all sources. They are resolved once and memoized until new data
+    is parsed.
     """
 
     def __init__(self, feed_model):
+        self.final_attrs_cache = {}
         self.feed_obj__model = feed_model
         self.paywall = False
         self.aggregator_source = False
         self.current_categories = None
 
+    def invalidate_final_attrs(self, *attr_names):
+        """forget the memoized *__final values (all unless attr_names are given) e.g. as new source data was added"""
+        if len(attr_names) == 0:
+            self.final_attrs_cache.clear()
+        for attr_name in attr_names:
+            self.final_attrs_cache.pop(attr_name, None)
+
+    @property
+    def current_categories(self):
+        """categories of the already existing article in the database"""
+        return self.__current_categories
+
+    @current_categories.setter
+    def current_categories(self, value):
+        self.__current_categories = value
+        self.invalidate_final_attrs("article_tags__final")
+
     ################################# PARSE AND STANDARDIZE ATTRIBUTES #################################
 
     def __parse_attrs(self, obj, translate_dict):
@@ -212,6 +310,12 @@ class ScrapedArticle:
         #    print()
         # print('Not Used:', [i for i in obj.keys() if i not in KEYS_USED])
 
+    def add_identified_language(self, language):
+        """add the language identified from the article text (two-letter code)"""
+        self.article_language__identified = language
+        self.invalidate_final_attrs("article_language__final")
+
+    @invalidates_final_attrs
     def add_feed_attrs(self, feed_obj, article_obj):
         """parse attributes from rss feed data"""
         FEED_MAPPING = {
@@ -252,11 +356,13 @@ class ScrapedArticle:
             None,
             "",
         ]:
-            if bool(BeautifulSoup(article_html, "html.parser").find()):  # html
+            self.article_summary_is_html__feed = is_html(article_html)
+            self.article_summary_img_lst__feed = []
+            if self.article_summary_is_html__feed:  # html
                 (
                     self.article_summary_html__feed,
                     self.article_summary_text__feed,
-                ) = html_clean_up(article_html)
+                ) = html_clean_up(article_html, img_lst=self.article_summary_img_lst__feed)
                 self.article_summary_text__feed = " ".join(html.unescape(self.article_summary_text__feed).split())
             else:
                 self.article_summary_text__feed = article_html
@@ -267,15 +373,15 @@ class ScrapedArticle:
             new_content_html = ""
             for content_i in content_lst:
                 content_i_value = content_i.get("value", "")
-                content_i_is_html = "html" in content_i.get("type", "") or (
-                    content_i_value != "" and bool(BeautifulSoup(content_i_value, "html.parser").find())
-                )
+                content_i_is_html = "html" in content_i.get("type", "") or is_html(content_i_value)
                 new_content_html += f"{content_i_value}<br>\n" if content_i_is_html else f"<p>{content_i_value}</p>\n"
+            self.article_content_img_lst__feed = []
             (
                 self.article_content_html__feed,
                 self.article_content_text__feed,
-            ) = html_clean_up(new_content_html)
+            ) = html_clean_up(new_content_html, img_lst=self.article_content_img_lst__feed)
 
+    @invalidates_final_attrs
     def parse_meta_attrs(self, response_obj):
         """parse attributes from <meta> tags in html of article link/url"""
         META_MAPPING = {
@@ -306,6 +412,7 @@ class ScrapedArticle:
                     setattr(self, key_dest, value)
                     break
 
+    @invalidates_final_attrs
     def parse_scrape_attrs(self, json_dict):
         """parse attributes from full-text scraper - currently used five-filters.org but later own scraper"""
         SCRAPE_MAPPING = {
@@ -326,14 +433,15 @@ class ScrapedArticle:
             value = ensure_dt_is_tz_aware(value)
             setattr(self, "article_last_updated__scrape", value)
         if (article_html := getattr(self, "article_content_html__scrape", None)) is not None:
+            self.article_content_img_lst__scrape = []
             (
                 self.article_content_html__scrape,
                 self.article_content_text__scrape,
-            ) = html_clean_up(article_html)
+            ) = html_clean_up(article_html, img_lst=self.article_content_img_lst__scrape)
 
     ################################# SELECT BEST ATTRIBUTES FROM ALL AVAILABLE #################################
 
-    @property
+    @final_attr
     def article_link__final(self):
         """article target url/link (decode/follow to true source if news aggregator like google news)"""
         article_url = self.article_link__feed
@@ -346,8 +454,9 @@ class ScrapedArticle:
             self.aggregator_source = True
         return article_url
 
-    @property
+    @final_attr
     def article_publisher__final(self):
+        _ = getattr(self, "article_link__final", None)  # resolves if the article is from a news aggregator
         if self.aggregator_source or self.feed_obj__model is None:
             publisher_dict = dict(getattr(self, "article_publisher__feed", {}))
             # rename keys to be identical to Publisher django model
@@ -358,7 +467,7 @@ class ScrapedArticle:
         else:
             return self.feed_obj__model.publisher
 
-    @property
+    @final_attr
     def article_id__final(self):
         """unique id from feed data or url as fallback"""
         feed_obj = self.feed_obj__model
@@ -368,13 +477,13 @@ class ScrapedArticle:
         else:
             return f'{pk}_{self.article_link__feed.split("?")[0].lower()}'
 
-    @property
+    @final_attr
     def article_hash__final(self):
         """unique hash using article url"""
         return f"{self.article_link__final.split('?')[0].lower()}"
         # return f"{hashlib.sha256(self.article_link__final.split('?')[0].lower().encode('utf-8')).hexdigest()}"
 
-    @property
+    @final_attr
     def article_img_lst__final(self):
         """get all image urls from all attributes ordered by most likely to be good article thumbnail to least"""
         img_lst = []
@@ -392,24 +501,18 @@ class ScrapedArticle:
                     img_lst.append(tmp_img_i["href"])
                 elif "src" in tmp_img_i and is_valid_url(tmp_img_i["src"]) and ".svg" not in tmp_img_i["src"]:
                     img_lst.append(tmp_img_i["src"])
-        if (tmp_content_html := getattr(self, "article_summary_html__feed", None)) is not None:
-            tmp_soup = BeautifulSoup(tmp_content_html, "html.parser")
-            for tmp_img in tmp_soup.find_all("img"):
-                if "src" in tmp_img.attrs and is_valid_url(tmp_img["src"]) and ".svg" not in tmp_img["src"]:
-                    img_lst.append(tmp_img["src"])
-        if (tmp_content_html := getattr(self, "article_content_html__feed", None)) is not None:
-            tmp_soup = BeautifulSoup(tmp_content_html, "html.parser")
-            for tmp_img in tmp_soup.find_all("img"):
-                if "src" in tmp_img.attrs and is_valid_url(tmp_img["src"]) and ".svg" not in tmp_img["src"]:
-                    img_lst.append(tmp_img["src"])
-        if (tmp_content_html := getattr(self, "article_content_html__scrape", None)) is not None:
-            tmp_soup = BeautifulSoup(tmp_content_html, "html.parser")
-            for tmp_img in tmp_soup.find_all("img"):
-                if "src" in tmp_img.attrs and is_valid_url(tmp_img["src"]) and ".svg" not in tmp_img["src"]:
-                    img_lst.append(tmp_img["src"])
+        # images within the html were collected when the html was cleaned-up - no need to parse the html again
+        for attr in [
+            "article_summary_img_lst__feed",
+            "article_content_img_lst__feed",
+            "article_content_img_lst__scrape",
+        ]:
+            for tmp_img in getattr(self, attr, []):
+                if is_valid_url(tmp_img) and ".svg" not in tmp_img:
+                    img_lst.append(tmp_img)
         return img_lst
 
-    @property
+    @final_attr
     def article_thumbnail__final(self):
         """take first image from image list as article thumbnail as image list is ordered"""
         img_lst = self.article_img_lst__final
@@ -418,7 +521,7 @@ class ScrapedArticle:
         else:
             return img_lst[0]
 
-    @property
+    @final_attr
     def article_importance_type__final(self):
         title_texts = [
             getattr(self, "article_title__feed", "").lower(),
@@ -441,7 +544,7 @@ class ScrapedArticle:
         else:
             return "normal"
 
-    @property
+    @final_attr
     def article_content_type__final(self):
         title_texts = [
             getattr(self, "feed_title__feed", "").lower(),
@@ -465,7 +568,7 @@ class ScrapedArticle:
         else:
             return "article"
 
-    @property
+    @final_attr
     def article_title__final(self):
         prio_order = [
             "article_title__feed",
@@ -475,13 +578,14 @@ class ScrapedArticle:
         if self.article_content_type__final == "ticker":
             # if live ticker prefer <meta> tag title and scraped title over feed provided title as might be outdated
             prio_order = prio_order[1:] + prio_order[:1]
+        _ = getattr(self, "article_link__final", None)  # resolves if the article is from a news aggregator
         for attr in prio_order:
             if (title := getattr(self, attr, None)) is not None:
                 if attr == "article_title__feed" and self.aggregator_source and " - " in title:
                     title = "".join(title.split(" - ")[:-1])
                 return title
 
-    @property
+    @final_attr
     def article_summary__final(self):
         prio_order = [
             "article_summary_text__feed",
@@ -495,9 +599,7 @@ class ScrapedArticle:
                 "article_summary__scrape",
                 "article_summary_text__feed",
             ]
-        elif getattr(self, "article_summary__feed", "") != "" and bool(
-            BeautifulSoup(getattr(self, "article_summary__feed", "empty"), "html.parser").find()
-        ):
+        elif getattr(self, "article_summary_is_html__feed", False):
             # if summary from feed is html prefer <meta> tag summary
             prio_order = [
                 "article_summary__meta",
@@ -512,7 +614,7 @@ class ScrapedArticle:
                     return summary
         return fallback_summary
 
-    @property
+    @final_attr
     def article_has_summary__final(self):
         summary = getattr(self, "article_summary__final", None)
         content = getattr(self, "article_content_text__final", None)
@@ -524,7 +626,7 @@ class ScrapedArticle:
             else:
                 return True
 
-    @property
+    @final_attr
     def article_content_source__final(self):
         content_feed = getattr(self, "article_content_text__feed", None)
         content_scrape = getattr(self, "article_content_text__scrape", None)
@@ -540,7 +642,7 @@ class ScrapedArticle:
         else:  # if no source
             return None
 
-    @property
+    @final_attr
     def article_content_text__final(self):
         if self.article_content_source__final == "scrape":
             return self.article_content_text__scrape
@@ -549,7 +651,7 @@ class ScrapedArticle:
         else:
             return None
 
-    @property
+    @final_attr
     def article_content_html__final(self):
         if self.article_content_source__final == "scrape":
             return self.article_content_html__scrape
@@ -558,7 +660,7 @@ class ScrapedArticle:
         else:
             return None
 
-    @property
+    @final_attr
     def article_has_content__final(self):
         return (
             self.paywall is False
@@ -566,7 +668,7 @@ class ScrapedArticle:
             and len(self.article_content_text__final) >= 1500
         )
 
-    @property
+    @final_attr
     def article_author__final(self):
         prio_order = [
             "article_author__feed",
@@ -577,39 +679,29 @@ class ScrapedArticle:
             if (author := getattr(self, attr, None)) is not None:
                 return author
 
-    @property
+    @final_attr
     def article_language__final(self):
-        language_lst = [
-            getattr(self, "article_language__feed", None),
-            getattr(self, "feed_language__feed", None),
-            getattr(self, "article_language__meta", None),
-        ]
-        all_three_agree = all(
-            [
-                all([j[:2].lower() == i[:2].lower() for j in language_lst if j is not None and len(j) >= 2])
-                for i in language_lst
-                if i is not None and len(i) >= 2
-            ]
-        )
-        if all_three_agree and language_lst != [None, None, None]:
-            for language_i in language_lst:
-                if language_i is not None and len(language_i) == 2:
-                    return f"{language_i}-XX"
-                elif language_i is not None and len(language_i) == 5:
-                    return language_i.replace("_", "-")
-
-        # if no suitable language attr found - detect yourself
-        lang = langid.classify(f"{self.article_title__final}\n{self.article_summary__final}")
-        return f"{lang[0]}-XX"
-
-    @property
+        if (language := get_declared_language(self)) is not None:
+            return language
+        # if the declared languages disagree or are missing - identified in a batch for the entire feed
+        # (see language_id.identify_languages) or detect yourself
+        if (language := getattr(self, "article_language__identified", None)) is None:
+            publisher_language = None if self.feed_obj__model is None else self.feed_obj__model.publisher.language
+            language = classify_languages(
+                [get_scraped_article_language_text(self)],
+                get_candidate_languages(publisher_language),
+                [{get_language_code(publisher_language)}],
+            )[0]
+        return f"{language}-XX"
+
+    @final_attr
     def article_published__final(self):
         prio_order = ["article_published__feed", "article_published__meta"]
         for attr in prio_order:
             if (published := getattr(self, attr, None)) is not None:
                 return published
 
-    @property
+    @final_attr
     def article_published_filled__final(self):
         prio_order = [
             "article_published__final",
@@ -625,7 +717,7 @@ class ScrapedArticle:
         # fallback - now
         return settings.TIME_ZONE_OBJ.localize(datetime.datetime.now())
 
-    @property
+    @final_attr
     def article_last_updated__final(self):
         prio_order = [
             "article_last_updated__feed",
@@ -636,7 +728,7 @@ class ScrapedArticle:
             if (updated := getattr(self, attr, None)) is not None:
                 return updated
 
-    @property
+    @final_attr
     def article_last_updated_filled__final(self):
         prio_order = [
             "article_last_updated__final",
@@ -647,7 +739,7 @@ class ScrapedArticle:
             if (updated := getattr(self, attr, None)) is not None:
                 return updated
 
-    @property
+    @final_attr
     def article_tags__final(self):
         tags = (
             [
@@ -672,20 +764,9 @@ class ScrapedArticle:
     def get_final_attrs(self):
         title = self.article_title__final
         extract = self.article_summary__final
+        # keywords are added by the batched keyword stage after the refresh (see keywords.py)
         categories = self.article_tags__final
 
-        if settings.OLLAMA_URL is not None:
-            data = {
-                "model": settings.OLLAMA_MODEL,
-                "prompt": f'List 5 keywords from this text: "{title}. {extract}"',
-                "stream": False,
-            }
-
-            response = requests.post(settings.OLLAMA_URL + "/api/generate", json=data)
-            ai_list = response.json().get("response")
-            ai_categories = [i[3:] for i in ai_list.split("\n")]
-            categories = ";".join(categories.split(";") + ai_categories)
-
         return {
             "publisher": self.article_publisher__final,
             "title": title,
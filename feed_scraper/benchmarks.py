@@ -0,0 +1,663 @@
+# -*- coding: utf-8 -*-
+"""Benchmarks of individual stages of the news refresh - run via 'python manage.py benchmark <suite>'"""
+
+import collections
+import csv
+import json
+import math
+import multiprocessing
+import os
+import pickle
+import tempfile
+import threading
+import time
+import types
+from concurrent.futures import ProcessPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+
+import langid
+import numpy as np
+from django.conf import settings
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.management import CommandError
+from django.db import connection, transaction
+from django.db.models import Count, Q
+from django.test.utils import CaptureQueriesContext
+
+from articles.models import Article, ArticleTag, tagged_with
+from articles.search import SEARCH_MAX_RESULTS, ensure_search_index, get_search_words, search_articles
+from feeds.models import Feed
+from news_platform.pages.pageAPI import (
+    ARTICLE_FILTER_PLANS,
+    dump_article_cards,
+    get_articles,
+    get_articles_query,
+    load_article_cards,
+)
+from preferences.models import Page
+
+from .article_grouping import cluster_articles
+from .article_scraper import (
+    ARTICLE_GROUP_BATCH_SIZE,
+    find_existing_articles,
+    get_existing_article,
+    get_pages_articles,
+    rank_publisher_articles,
+    save_article_groups,
+    update_combined_articles_relevance,
+)
+from . import ai_summaries, article_scraper_class
+from .ai_summaries import AISummarizer, get_article_summary_text, get_summary_bullets
+from .article_scraper_class import ScrapedArticle, final_attr, get_html_elements, html_clean_up
+from .embedding_backends import (
+    EMBEDDING_BACKENDS,
+    EMBEDDING_PARITY_MIN_COSINE,
+    get_cosine_similarities,
+    measure_embedding_backend,
+)
+from .embeddings import encode_texts, get_article_embeddings, get_article_text
+from .feed_fetcher import download_feed
+from .language_id import classify_languages, get_candidate_languages, get_language_model
+
+
+def __get_fetched_feeds(limit):
+    """download the first active rss feeds and return a list of (feed, fetched_feed)"""
+    fetched_feeds = []
+    for feed in Feed.objects.filter(active=True, feed_type="rss").order_by("pk")[:limit]:
+        if (fetched_feed := download_feed(feed, conditional=False)) is not None:
+            fetched_feeds.append((feed, fetched_feed))
+    return fetched_feeds
+
+
+def __get_scraped_articles(limit):
+    """download the first active rss feeds and return a list of (feed, [ScrapedArticle, ...])"""
+    feeds_scraped_articles = []
+    for feed, fetched_feed in __get_fetched_feeds(limit):
+        scraped_articles = []
+        for feed_article in fetched_feed.entries:
+            scraped_article = ScrapedArticle(feed_model=feed)
+            scraped_article.add_feed_attrs(feed_obj=fetched_feed.feed, article_obj=feed_article)
+            scraped_articles.append(scraped_article)
+        feeds_scraped_articles.append((feed, scraped_articles))
+    return feeds_scraped_articles
+
+
+def benchmark_cards(limit, **kwargs):
+    """
+    cache payload of the first page of every page view - the pickled Article instances (before) vs. the article cards
+    (after) and the time to load them limit times. Fails if the cards are not smaller or differ from the articles.
+    """
+    pages_kwargs = Page.objects.all().order_by("position_index").values_list("url_parameters_json", flat=True)
+    print(f"{'Page':<40} {'Articles':>8} {'Before KB':>9} {'After KB':>9} {'Before ms':>9} {'After ms':>9}")
+    sizes = {"before": 0, "after": 0}
+    for page_kwargs in pages_kwargs:
+        kwargs_hash, articles_query, _, ordering = get_articles_query(**page_kwargs)
+        articles = list(articles_query)
+        payloads = {"before": pickle.dumps(articles), "after": dump_article_cards(articles_query, ordering)}
+        seconds = {}
+        for name, load in [("before", pickle.loads), ("after", lambda i: load_article_cards(i)[0])]:
+            start_time = time.perf_counter()
+            for _ in range(limit):
+                loaded = load(payloads[name])
+            seconds[name] = (time.perf_counter() - start_time) / limit
+            sizes[name] += len(payloads[name])
+        for article, card in zip(articles, loaded):
+            if (article.pk, article.title, article.pub_date, article.publisher.name) != (
+                card["pk"],
+                card["title"],
+                card["pub_date"],
+                card["publisher"]["name"],
+            ):
+                raise CommandError(f"The article card of {article} differs from the article")
+        print(
+            f"{kwargs_hash[:40]:<40} {len(articles):>8} {len(payloads['before']) / 1024:>9.1f} "
+            f"{len(payloads['after']) / 1024:>9.1f} {seconds['before'] * 1000:>9.2f} {seconds['after'] * 1000:>9.2f}"
+        )
+
+    if sizes["after"] >= sizes["before"] > 0:
+        raise CommandError("The article cards are not smaller than the pickled articles")
+
+
+def benchmark_dedup(limit, **kwargs):
+    """count the queries to find existing articles per feed - per-entry lookups (before) vs. batched lookup (after)"""
+    print(f"{'Feed':<50} {'Entries':>7} {'Queries before':>15} {'Queries after':>14} {'ms before':>10} {'ms after':>9}")
+    for feed, scraped_articles in __get_scraped_articles(limit):
+        # resolve the keys upfront so that e.g. decoding Google News urls is not part of the measurement
+        keys = [(i.article_id__final, i.article_hash__final) for i in scraped_articles]
+
+        start_time = time.perf_counter()
+        with CaptureQueriesContext(connection) as queries_before:
+            for guid, hash in keys:
+                matches = Article.objects.filter(guid=guid[:95])
+                if len(matches) == 0:
+                    matches = Article.objects.filter(hash=hash[:100])
+                    len(matches)
+        time_before = time.perf_counter() - start_time
+
+        start_time = time.perf_counter()
+        with CaptureQueriesContext(connection) as queries_after:
+            existing_articles = find_existing_articles(scraped_articles)
+            for guid, hash in keys:
+                get_existing_article(existing_articles, guid=guid, hash=hash)
+        time_after = time.perf_counter() - start_time
+
+        print(
+            f"{str(feed)[:50]:<50} {len(keys):>7} {len(queries_before):>15} {len(queries_after):>14} "
+            f"{time_before * 1000:>10.1f} {time_after * 1000:>9.1f}"
+        )
+
+
+HTML_FIXTURES_DIR = os.path.join(os.path.dirname(__file__), "benchmark_fixtures")
+
+
+def benchmark_filters(limit, **kwargs):
+    """
+    count the queries to list the first page of every page view (with an unknown 'debug' parameter) and time the
+    compilation of the url parameters - uncompiled vs. memoized. Fails if any page needs more than two queries (the
+    articles and their publishers) i.e. a trial query per url parameter.
+    """
+    pages_kwargs = [
+        {**i, "debug": "true"}
+        for i in Page.objects.all().order_by("position_index").values_list("url_parameters_json", flat=True)
+    ]
+    print(f"{'Page':<50} {'Queries':>7} {'Compile ms':>10} {'Memoized ms':>11}")
+    max_queries = 0
+    for page_kwargs in pages_kwargs:
+        seconds = {}
+        for name in ["compile", "memoized"]:
+            start_time = time.perf_counter()
+            for _ in range(limit):
+                if name == "compile":
+                    ARTICLE_FILTER_PLANS.clear()
+                kwargs_hash, articles, _, _ = get_articles_query(**page_kwargs)
+            seconds[name] = (time.perf_counter() - start_time) / limit
+        with CaptureQueriesContext(connection) as queries:
+            list(articles)
+        max_queries = max(max_queries, len(queries))
+        print(
+            f"{kwargs_hash[:50]:<50} {len(queries):>7} {seconds['compile'] * 1000:>10.3f} "
+            f"{seconds['memoized'] * 1000:>11.3f}"
+        )
+
+    if max_queries > 2:
+        raise CommandError(f"Listing the articles of a page took up to {max_queries} queries instead of two")
+
+
+def benchmark_html(limit, path=None, **kwargs):
+    """
+    check html_clean_up returns the same html elements and text for all fixtures as the previous BeautifulSoup
+    implementation did (<fixture>.baseline.html/.txt) and measure MB/s
+    """
+    path = HTML_FIXTURES_DIR if path is None else path
+    fixtures = {}
+    for file_name in sorted(os.listdir(path)):
+        if file_name.endswith(".html") and ".baseline." not in file_name:
+            fixtures[file_name] = []
+            for suffix in [".html", ".baseline.html", ".baseline.txt"]:
+                with open(os.path.join(path, file_name[: -len(".html")] + suffix), encoding="utf-8") as file:
+                    fixtures[file_name].append(file.read())
+
+    all_equal = True
+    for file_name, (article_html, baseline_html, baseline_text) in fixtures.items():
+        new_html, new_text = html_clean_up(article_html)
+        html_equal = get_html_elements(baseline_html) == get_html_elements(new_html)
+        text_equal = baseline_text.split() == new_text.split()
+        all_equal = all_equal and html_equal and text_equal
+        print(
+            f"{file_name:<50} html {'equal' if html_equal else 'DIFFERENT'}, "
+            f"text {'equal' if text_equal else 'DIFFERENT'}"
+        )
+
+    total_mb = sum(len(i[0].encode("utf-8")) for i in fixtures.values()) * limit / 1_000_000
+    start_time = time.perf_counter()
+    for _ in range(limit):
+        for article_html, _, _ in fixtures.values():
+            html_clean_up(article_html)
+    print(f"{'html_clean_up':<25} {total_mb / (time.perf_counter() - start_time):8.2f} MB/s")
+
+    if not all_equal:
+        raise CommandError("html_clean_up output differs from the previous implementation")
+
+
+FINAL_ATTRS = [i for i in vars(ScrapedArticle) if i.endswith("__final")]
+
+
+def benchmark_pagination(limit, **kwargs):
+    """
+    page through all articles of every page view (limit articles per page, not cached) - by the cursor of the previous
+    page (after) vs. the page number i.e. an offset (before). Fails if the cursor pages skip or repeat any article.
+    """
+    pages_kwargs = Page.objects.all().order_by("position_index").values_list("url_parameters_json", flat=True)
+    print(f"{'Page':<40} {'Pages':>5} {'Before first/last ms':>20} {'After first/last ms':>19}")
+    for page_kwargs in pages_kwargs:
+        kwargs_hash, all_articles, _, _ = get_articles_query(max_length=None, **page_kwargs)
+        all_articles = [i.pk for i in all_articles]
+        seconds = {"before": [], "after": []}
+        articles = {"before": [], "after": []}
+        next_cursor = None
+        for page_num in range(1, max(1, math.ceil(len(all_articles) / limit)) + 1):
+            for name, page_kwarg in [("before", {"page": str(page_num)}), ("after", {"cursor": next_cursor})]:
+                page_kwarg = {k: v for k, v in page_kwarg.items() if v is not None}
+                start_time = time.perf_counter()
+                _, cards, _, cursor = get_articles(
+                    max_length=limit, force_recache=True, grouped_articles=False, **page_kwargs, **page_kwarg
+                )
+                seconds[name].append(time.perf_counter() - start_time)
+                articles[name] += [i["pk"] for i in cards]
+            next_cursor = cursor
+        print(
+            f"{kwargs_hash[:40]:<40} {len(seconds['after']):>5} "
+            f"{seconds['before'][0] * 1000:>9.1f}/{seconds['before'][-1] * 1000:<10.1f} "
+            f"{seconds['after'][0] * 1000:>9.1f}/{seconds['after'][-1] * 1000:<9.1f}"
+        )
+        if articles["after"] != all_articles:
+            raise CommandError(f"The cursor pages of {kwargs_hash} do not list each article once in order")
+
+
+def benchmark_parse(limit, path=None, **kwargs):
+    """
+    count the html parses per article and source and how often the *__final attributes are computed to resolve all
+    final attributes without memoization (before) and with memoization (after)
+    """
+    path = HTML_FIXTURES_DIR if path is None else path
+    with open(os.path.join(path, "live_blog.html"), encoding="utf-8") as file:
+        fixture_html = file.read()
+
+    # count the calls of the undecorated functions behind the *__final properties
+    computations = collections.Counter()
+
+    def counting_final_attr(attr_name, func, memoize):
+        def wrapper(self):
+            computations[attr_name] += 1
+            return func(self)
+
+        wrapper.__name__ = attr_name
+        return final_attr(wrapper) if memoize else property(wrapper)
+
+    def counting_final_attrs(memoize):
+        return {i: counting_final_attr(i, getattr(ScrapedArticle, i).fget.__wrapped__, memoize) for i in FINAL_ATTRS}
+
+    def resolve_final_attrs(scraped_article):
+        for attr_name in FINAL_ATTRS:
+            getattr(scraped_article, attr_name, None)
+
+    print(
+        f"{'Feed':<40} {'Articles':>8} {'Parses feed':>11} {'Parses meta':>11} {'Parses scrape':>13} "
+        f"{'Parses final':>12} {'Computed before':>15} {'Computed after':>14}"
+    )
+    for feed, fetched_feed in __get_fetched_feeds(limit):
+        counts = collections.Counter()
+        with (
+            mock.patch.object(
+                article_scraper_class.lxml_html,
+                "fragment_fromstring",
+                wraps=article_scraper_class.lxml_html.fragment_fromstring,
+            ) as lxml_parser,
+            mock.patch.object(article_scraper_class, "BeautifulSoup", wraps=article_scraper_class.BeautifulSoup) as bs4,
+            mock.patch.multiple(ScrapedArticle, **counting_final_attrs(memoize=True)),
+        ):
+
+            def count(name, func, *args):
+                parses_before, computations_before = lxml_parser.call_count + bs4.call_count, computations.total()
+                func(*args)
+                counts[f"parses {name}"] += lxml_parser.call_count + bs4.call_count - parses_before
+                counts[f"computations {name}"] += computations.total() - computations_before
+
+            for feed_article in fetched_feed.entries:
+                scraped_article = ScrapedArticle(feed_model=feed)
+                count("feed", scraped_article.add_feed_attrs, fetched_feed.feed, feed_article)
+                count("meta", scraped_article.parse_meta_attrs, types.SimpleNamespace(text=fixture_html))
+                count("scrape", scraped_article.parse_scrape_attrs, {"content": fixture_html})
+
+                with mock.patch.multiple(ScrapedArticle, **counting_final_attrs(memoize=False)):
+                    count("before", resolve_final_attrs, scraped_article)
+                count("final", resolve_final_attrs, scraped_article)
+
+        n = max(len(fetched_feed.entries), 1)
+        print(
+            f"{str(feed)[:40]:<40} {len(fetched_feed.entries):>8} {counts['parses feed'] / n:>11.1f} "
+            f"{counts['parses meta'] / n:>11.1f} {counts['parses scrape'] / n:>13.1f} "
+            f"{counts['parses final'] / n:>12.1f} "
+            f"{counts['computations before'] / n:>15.1f} {counts['computations final'] / n:>14.1f}"
+        )
+
+
+def benchmark_ranking(**kwargs):
+    """time the publisher ranking on the current database - all changes are rolled back"""
+    with transaction.atomic():
+        start_time = time.perf_counter()
+        with CaptureQueriesContext(connection) as queries:
+            rank_publisher_articles()
+        print(
+            f"Ranked {Article.objects.count()} articles in {(time.perf_counter() - start_time) * 1000:.0f} ms "
+            f"with {len(queries)} queries"
+        )
+        transaction.set_rollback(True)
+
+
+def benchmark_embeddings(limit, **kwargs):
+    """
+    encode the texts of the latest limit * 100 articles with every embedding backend and compare sentences per second
+    and peak memory - each backend runs in a fresh process. Fails if the onnx embeddings are not close to the torch
+    embeddings (cosine similarity of every article >= 0.99).
+    """
+    texts = [get_article_text(i) for i in Article.objects.order_by("-pk")[: limit * 100]]
+    if len(texts) == 0:
+        raise CommandError("No articles to encode - refresh the feeds first")
+
+    results = {}
+    print(f"{'Backend':<10} {'Texts':>6} {'Load s':>7} {'Sentences/s':>12} {'Peak memory MB':>15}")
+    for backend in EMBEDDING_BACKENDS:
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as executor:
+            vectors, sentences_per_second, peak_memory, load_time = executor.submit(
+                measure_embedding_backend, settings.EMBEDDING_MODEL, backend, texts, settings.EMBEDDING_ONNX_DIR
+            ).result()
+        results[backend] = vectors
+        print(f"{backend:<10} {len(texts):>6} {load_time:>7.1f} {sentences_per_second:>12.1f} {peak_memory:>15.0f}")
+
+    reference, vectors = results["torch"], results["onnx"]
+    cosine = get_cosine_similarities(reference, vectors)
+    print(f"Cosine similarity onnx vs. torch: min {cosine.min():.4f}, mean {cosine.mean():.4f}")
+    if cosine.min() < EMBEDDING_PARITY_MIN_COSINE:
+        raise CommandError(
+            f"onnx embeddings of {(cosine < EMBEDDING_PARITY_MIN_COSINE).sum()} articles differ from torch "
+            f"(cosine similarity < {EMBEDDING_PARITY_MIN_COSINE})"
+        )
+
+
+def benchmark_grouping(limit, **kwargs):
+    """
+    time encoding and clustering the articles of the first 1...limit pages - each page on its own (before) vs. the
+    articles of all pages together with every article only once (after)
+    """
+    pages_articles = get_pages_articles()[:limit]
+    # warm-up - load the embedding model and sklearn
+    cluster_articles(encode_texts(["Warm-up", "Warm-up"]))
+    print(
+        f"{'Pages':>5} {'Articles':>8} {'Unique':>6} {'Encode s before':>15} {'Encode s after':>14} "
+        f"{'Cluster s before':>16} {'Cluster s after':>15}"
+    )
+    for n_pages in range(1, len(pages_articles) + 1):
+        timings = collections.Counter()
+
+        def encode_and_cluster(articles, name):
+            start_time = time.perf_counter()
+            embeddings = encode_texts([get_article_text(i) for i in articles])
+            timings[f"encode {name}"] += time.perf_counter() - start_time
+            start_time = time.perf_counter()
+            cluster_articles(embeddings)
+            timings[f"cluster {name}"] += time.perf_counter() - start_time
+
+        for page_articles in pages_articles[:n_pages]:
+            encode_and_cluster(page_articles, "before")
+        unique_articles = list({i.pk: i for page_articles in pages_articles[:n_pages] for i in page_articles}.values())
+        encode_and_cluster(unique_articles, "after")
+
+        print(
+            f"{n_pages:>5} {sum(len(i) for i in pages_articles[:n_pages]):>8} {len(unique_articles):>6} "
+            f"{timings['encode before']:>15.2f} {timings['encode after']:>14.2f} "
+            f"{timings['cluster before']:>16.2f} {timings['cluster after']:>15.2f}"
+        )
+
+
+def get_article_groups_query_budget(n_groups):
+    """max. number of queries to save n_groups article groups - a fixed number per batch of groups"""
+    return 20 + 8 * math.ceil(n_groups / ARTICLE_GROUP_BATCH_SIZE)
+
+
+def benchmark_groups(limit, **kwargs):
+    """
+    count the queries and time to save the article groups of the full re-cluster of the first limit pages in bulk -
+    all changes are rolled back. Fails if saving exceeds the query budget (the query counts are also asserted by
+    articles.tests.SaveArticleGroupsTestCase).
+    """
+    articles = list({i.pk: i for page_articles in get_pages_articles()[:limit] for i in page_articles}.values())
+    groups_positions = cluster_articles(get_article_embeddings(articles))
+    print(f"{len(groups_positions)} groups of {sum(len(i) for i in groups_positions)} out of {len(articles)} articles")
+
+    with transaction.atomic():
+        current_articles = Article.objects.select_related("article_group").in_bulk([i.pk for i in articles])
+        articles = [current_articles[i.pk] for i in articles]
+        start_time = time.perf_counter()
+        with CaptureQueriesContext(connection) as queries:
+            save_article_groups(articles, groups_positions)
+            update_combined_articles_relevance()
+        print(f"{len(queries):>6} queries {(time.perf_counter() - start_time) * 1000:>9.0f} ms")
+        transaction.set_rollback(True)
+
+    budget = get_article_groups_query_budget(len(groups_positions))
+    if len(queries) > budget:
+        raise CommandError(f"Saving {len(groups_positions)} article groups took {len(queries)} > {budget} queries")
+
+
+class OpenAIStandInHandler(BaseHTTPRequestHandler):
+    """minimal OpenAI-compatible chat completions endpoint answering every request after a fixed latency"""
+
+    latency = 0.2  # seconds
+    requests = 0
+    lock = threading.Lock()
+
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        with self.lock:
+            type(self).requests += 1
+        time.sleep(self.latency)
+        prompt = " ".join(i["content"] for i in request["messages"])
+        body = json.dumps(
+            {
+                "id": "chatcmpl-stand-in",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": request["model"],
+                "choices": [
+                    {
+                        "index": 0,
+                        "message": {"role": "assistant", "content": f"- {prompt[:60]}\n- {prompt[-60:]}"},
+                        "finish_reason": "stop",
+                    }
+                ],
+                "usage": {
+                    "prompt_tokens": len(prompt) // 4,
+                    "completion_tokens": 40,
+                    "total_tokens": len(prompt) // 4 + 40,
+                },
+            }
+        ).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        """no access log"""
+
+
+def benchmark_summaries(limit, **kwargs):
+    """
+    summarize the latest (up to) limit * 10 articles with full text against a local OpenAI-compatible stand-in server
+    - one request at a time (before) vs. concurrently (after) and once more from the cache. All changes are rolled back.
+    Fails if the cached run makes any requests.
+    """
+    articles = [
+        i
+        for i in Article.objects.select_related("publisher").filter(has_full_text=True).order_by("-pk")[: limit * 50]
+        if get_summary_bullets(get_article_summary_text(i)) is not None
+    ][: limit * 10]
+    if len(articles) == 0:
+        raise CommandError("No articles with a full text long enough to summarize - refresh the feeds first")
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), OpenAIStandInHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    client = ai_summaries.OpenAI(api_key="none", base_url=f"http://127.0.0.1:{server.server_address[1]}/v1")
+    print(
+        f"{len(articles)} articles - the previous limit of 30 requests per minute alone would wait "
+        f"{max(0, len(articles) - 30) * 2:.0f} s"
+    )
+    print(f"{'Run':<7} {'Requests':>8} {'Seconds':>8} {'Articles/s':>10}")
+    summary_cache = None
+    try:
+        for name, max_workers in [("before", 1), ("after", None), ("cached", None)]:
+            summary_cache = LocMemCache(f"benchmark_summaries_{name}", {}) if name != "cached" else summary_cache
+            OpenAIStandInHandler.requests = 0
+            with (
+                transaction.atomic(),
+                tempfile.NamedTemporaryFile() as log_file,
+                mock.patch.object(ai_summaries, "cache", summary_cache),
+            ):
+                summarizer = AISummarizer(
+                    client=client, model="stand-in", max_workers=max_workers, log_path=log_file.name
+                )
+                start_time = time.perf_counter()
+                summarizer.summarize(articles)
+                seconds = time.perf_counter() - start_time
+                transaction.set_rollback(True)
+            print(f"{name:<7} {OpenAIStandInHandler.requests:>8} {seconds:>8.2f} {len(articles) / seconds:>10.1f}")
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    if OpenAIStandInHandler.requests > 0:
+        raise CommandError(f"Summarizing the same articles again made {OpenAIStandInHandler.requests} API requests")
+
+
+def benchmark_languages(limit, path=None, **kwargs):
+    """
+    identify the languages of the labelled feed entries in benchmark_fixtures/languages.tsv (repeated limit times) -
+    langid.classify per text with all languages (before) vs. in one batch per publisher language with the restricted
+    model (after) without and with the publisher priors. Fails if the accuracy is lower than before.
+    """
+    path = os.path.join(HTML_FIXTURES_DIR, "languages.tsv") if path is None else path
+    with open(path, encoding="utf-8") as file:
+        rows = [i for i in csv.reader(file, delimiter="\t") if len(i) > 0 and not i[0].startswith("#")]
+    fixtures = [(language, publisher_language, "\n".join(texts)) for language, publisher_language, *texts in rows]
+    publisher_languages = sorted({i[1] for i in fixtures})
+    print(
+        f"{len(fixtures)} labelled texts, candidate languages besides the publisher's: "
+        f"{','.join(get_candidate_languages())}"
+    )
+    # warm-up - load both models
+    langid.classify("Warm-up")
+    get_language_model()
+
+    def classify_feeds(use_priors):
+        """classify the texts of each publisher language together - like the entries of a feed"""
+        results = {}
+        for publisher_language in publisher_languages:
+            feed = [(i, text) for i, (_, language, text) in enumerate(fixtures) if language == publisher_language]
+            languages = classify_languages(
+                [text for _, text in feed],
+                get_candidate_languages(publisher_language),
+                [{publisher_language}] * len(feed) if use_priors else None,
+            )
+            results.update({i: language for (i, _), language in zip(feed, languages)})
+        return [results[i] for i in range(len(fixtures))]
+
+    accuracies = {}
+    print(f"{'Run':<26} {'Accuracy':>8} {'Texts/s':>9}")
+    for name, function in [
+        ("before (langid.classify)", lambda: [langid.classify(text)[0] for _, _, text in fixtures]),
+        ("after (batch, restricted)", lambda: classify_feeds(use_priors=False)),
+        ("after (batch, with priors)", lambda: classify_feeds(use_priors=True)),
+    ]:
+        start_time = time.perf_counter()
+        for _ in range(limit):
+            languages = function()
+        texts_per_second = len(fixtures) * limit / (time.perf_counter() - start_time)
+        accuracies[name] = sum(i == j[0] for i, j in zip(languages, fixtures)) / len(fixtures)
+        print(f"{name:<26} {accuracies[name]:>8.1%} {texts_per_second:>9.0f}")
+        for language, (expected, _, text) in zip(languages, fixtures):
+            if language != expected:
+                print(f"    {expected} identified as {language}: {text.splitlines()[0]}")
+
+    if accuracies["after (batch, with priors)"] < accuracies["before (langid.classify)"]:
+        raise CommandError("The batched language identification is less accurate than langid.classify")
+
+
+def benchmark_tags(limit, **kwargs):
+    """
+    filter the articles by the limit most common tags - searching the categories (before) vs. the indexed tags (after).
+    Fails if articles with categories have no tags i.e. 'python manage.py backfill_article_facets' is required.
+    """
+    if Article.objects.exclude(categories__isnull=True).exclude(categories="").exclude(tags__isnull=False).exists():
+        raise CommandError("Articles without tags - run 'python manage.py backfill_article_facets' first")
+    tag_names = ArticleTag.objects.values_list("name", flat=True).annotate(n=Count("article")).order_by("-n")[:limit]
+    print(f"{Article.objects.count()} articles")
+    print(f"{'Tag':<30} {'Before':>7} {'After':>7} {'Before ms':>9} {'After ms':>9}")
+    for tag_name in tag_names:
+        results = {}
+        for name, condition in [("before", Q(categories__icontains=tag_name)), ("after", tagged_with(tag_name))]:
+            start_time = time.perf_counter()
+            results[name] = (Article.objects.filter(condition).count(), time.perf_counter() - start_time)
+        print(
+            f"{tag_name[:30]:<30} {results['before'][0]:>7} {results['after'][0]:>7} "
+            f"{results['before'][1] * 1000:>9.1f} {results['after'][1] * 1000:>9.1f}"
+        )
+
+
+# max. median time of a search - over all articles, incl. fetching the listed data
+SEARCH_MAX_MEDIAN_SECONDS = 0.05
+
+
+def benchmark_search(limit, **kwargs):
+    """
+    search for two words of the titles of the limit latest articles and for the first letters of a word and time it.
+    Fails if a searched article is not found, if a changed title is not re-indexed, or if the median search is slower
+    than SEARCH_MAX_MEDIAN_SECONDS.
+    """
+    if not ensure_search_index():
+        raise CommandError(f"Full-text search is not supported by the {connection.vendor} database")
+    articles = list(Article.objects.exclude(content_type="group").order_by("-pk").values("pk", "title")[:limit])
+    if len(articles) == 0:
+        raise CommandError("No articles to search")
+    print(f"{Article.objects.count()} articles")
+
+    durations, missing = [], 0
+    for article in articles:
+        words = sorted(get_search_words(article["title"]), key=len, reverse=True)[:2]
+        # the two longest words of the title (which must find the article) and the first letters of the longest
+        for query in [" ".join(words), words[0][:4]] if len(words) > 0 else []:
+            start_time = time.perf_counter()
+            results = search_articles(query, SEARCH_MAX_RESULTS)
+            durations.append(time.perf_counter() - start_time)
+            # not found although all matching articles were returned
+            if query == " ".join(words) and len(results) < SEARCH_MAX_RESULTS:
+                missing += article["pk"] not in [i["pk"] for i in results]
+    print(
+        f"{len(durations)} searches: median {np.median(durations) * 1000:.1f} ms, "
+        f"max {np.max(durations) * 1000:.1f} ms, {missing} articles not within the results of their title words"
+    )
+
+    # bulk updates bypass save() - the index must follow them anyway
+    marker = "zqxbenchmarkmarker"
+    with transaction.atomic():
+        Article.objects.filter(pk=articles[0]["pk"]).update(title=f"{articles[0]['title']} {marker}")
+        found = [i["pk"] for i in search_articles(marker)] == [articles[0]["pk"]]
+        transaction.set_rollback(True)
+    print(f"Changed title re-indexed: {found}")
+
+    if not found:
+        raise CommandError("The search index does not follow updated articles")
+    if missing > 0:
+        raise CommandError(f"{missing} articles were not found by the words of their title")
+    if np.median(durations) > SEARCH_MAX_MEDIAN_SECONDS:
+        raise CommandError(f"Median search time above {SEARCH_MAX_MEDIAN_SECONDS * 1000:.0f} ms")
+
+
+BENCHMARKS = {
+    "cards": benchmark_cards,
+    "dedup": benchmark_dedup,
+    "embeddings": benchmark_embeddings,
+    "filters": benchmark_filters,
+    "grouping": benchmark_grouping,
+    "groups": benchmark_groups,
+    "html": benchmark_html,
+    "languages": benchmark_languages,
+    "pagination": benchmark_pagination,
+    "parse": benchmark_parse,
+    "ranking": benchmark_ranking,
+    "search": benchmark_search,
+    "summaries": benchmark_summaries,
+    "tags": benchmark_tags,
+}
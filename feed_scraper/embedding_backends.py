@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+"""
+Sentence embedding backends - does not require Django so that it can be used by the embedding server.
+
+- "torch": the sentence-transformer model as is
+- "onnx": the transformer of the sentence-transformer model exported to ONNX, int8-quantized and run with onnxruntime
+  on CPU. Needs a fraction of the memory of torch and encodes faster. The model is exported once into
+  EMBEDDING_ONNX_DIR (this needs torch, so it runs in a separate process).
+"""
+
+import json
+import multiprocessing
+import os
+import resource
+import time
+
+import numpy as np
+
+EMBEDDING_BACKENDS = ["torch", "onnx"]
+DEFAULT_EMBEDDING_ONNX_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "data", "onnx")
+ONNX_BATCH_SIZE = 8  # larger batches hardly encode faster on CPU but the peak memory grows with the batch size
+ONNX_OPSET_VERSION = 14
+ONNX_CONFIG_FILE = "embedding_config.json"
+ONNX_MODEL_FILE = "model_quantized.onnx"
+EMBEDDING_PARITY_MIN_COSINE = 0.99  # min. cosine similarity of the onnx and the torch embedding of every text
+
+
+def get_embedding_model_key(model_name, backend):
+    """name under which the embeddings of a model and backend are stored - switching the backend re-encodes"""
+    return model_name if backend == "torch" else f"{model_name}@{backend}-int8"
+
+
+def get_cosine_similarities(vectors_a, vectors_b):
+    """cosine similarity of each row of vectors_a with the same row of vectors_b"""
+    return (vectors_a * vectors_b).sum(axis=1) / (
+        np.linalg.norm(vectors_a, axis=1) * np.linalg.norm(vectors_b, axis=1) + 1e-12
+    )
+
+
+def get_onnx_model_dir(model_name, onnx_dir=None):
+    """directory of the exported onnx model"""
+    onnx_dir = (os.getenv("EMBEDDING_ONNX_DIR") or DEFAULT_EMBEDDING_ONNX_DIR) if onnx_dir is None else onnx_dir
+    return os.path.join(onnx_dir, model_name.replace("/", "__"))
+
+
+def export_onnx_model(model_name, model_dir):
+    """export the transformer of a sentence-transformer model to onnx, quantize its weights to int8 and save it with
+    its tokenizer and pooling config to model_dir"""
+    import torch
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+    from sentence_transformers import SentenceTransformer
+
+    sentence_transformer = SentenceTransformer(model_name, device="cpu")
+    config = {"max_seq_length": sentence_transformer.max_seq_length, "pooling": None, "normalize": False}
+    for module in sentence_transformer:
+        module_type = type(module).__name__
+        if module_type == "Pooling":
+            # sentence-transformers < 6 configures the pooling with one flag per mode
+            pooling_config = module.get_config_dict()
+            pooling_mode = pooling_config.get("pooling_mode") or [
+                {"pooling_mode_mean_tokens": "mean", "pooling_mode_cls_token": "cls"}.get(k)
+                for k, v in pooling_config.items()
+                if k.startswith("pooling_mode_") and v is True
+            ]
+            pooling_mode = [pooling_mode] if isinstance(pooling_mode, str) else list(pooling_mode)
+            if len(pooling_mode) != 1 or pooling_mode[0] not in ["mean", "cls"]:
+                raise ValueError(f"Pooling {pooling_mode} of '{model_name}' is not supported by the onnx backend")
+            config["pooling"] = pooling_mode[0]
+        elif module_type == "Normalize":
+            config["normalize"] = True
+        elif module_type != "Transformer":
+            raise ValueError(f"Module {module_type} of '{model_name}' is not supported by the onnx backend")
+    if config["pooling"] is None:
+        raise ValueError(f"'{model_name}' has no pooling supported by the onnx backend")
+
+    tokenizer = sentence_transformer.tokenizer
+    config["pad_token"], config["pad_token_id"] = tokenizer.pad_token, tokenizer.pad_token_id
+    transformer = sentence_transformer[0].auto_model.eval()
+    dummy_inputs = tokenizer(["An example sentence."], return_tensors="pt")
+    input_names = [i for i in ["input_ids", "attention_mask", "token_type_ids"] if i in dummy_inputs]
+
+    class LastHiddenState(torch.nn.Module):
+        def __init__(self):
+            super().__init__()
+            self.transformer = transformer
+
+        def forward(self, *inputs):
+            return self.transformer(**dict(zip(input_names, inputs))).last_hidden_state
+
+    os.makedirs(model_dir, exist_ok=True)
+    fp32_path = os.path.join(model_dir, "model.onnx")
+    with torch.no_grad():
+        torch.onnx.export(
+            LastHiddenState(),
+            tuple(dummy_inputs[i] for i in input_names),
+            fp32_path,
+            input_names=input_names,
+            output_names=["last_hidden_state"],
+            dynamic_axes={i: {0: "batch", 1: "sequence"} for i in input_names + ["last_hidden_state"]},
+            opset_version=ONNX_OPSET_VERSION,
+            dynamo=False,
+        )
+    quantize_dynamic(fp32_path, os.path.join(model_dir, ONNX_MODEL_FILE), weight_type=QuantType.QInt8)
+    os.remove(fp32_path)
+    tokenizer.save_pretrained(model_dir)
+    # written last - marks the export as complete
+    with open(os.path.join(model_dir, ONNX_CONFIG_FILE), "w") as file:
+        json.dump(config, file)
+
+
+class OnnxSentenceEncoder:
+    """sentence encoder running an exported (see export_onnx_model) model with onnxruntime"""
+
+    def __init__(self, model_dir, batch_size=ONNX_BATCH_SIZE):
+        import onnxruntime
+        from tokenizers import Tokenizer
+
+        with open(os.path.join(model_dir, ONNX_CONFIG_FILE)) as file:
+            self.config = json.load(file)
+        self.batch_size = batch_size
+        self.tokenizer = Tokenizer.from_file(os.path.join(model_dir, "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length=self.config["max_seq_length"])
+        self.tokenizer.enable_padding(pad_id=self.config["pad_token_id"], pad_token=self.config["pad_token"])
+        session_options = onnxruntime.SessionOptions()
+        session_options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = onnxruntime.InferenceSession(
+            os.path.join(model_dir, ONNX_MODEL_FILE), session_options, providers=["CPUExecutionProvider"]
+        )
+        self.input_names = [i.name for i in self.session.get_inputs()]
+
+    def __encode_batch(self, texts):
+        encodings = self.tokenizer.encode_batch(texts)
+        inputs = {
+            "input_ids": np.array([i.ids for i in encodings], dtype=np.int64),
+            "attention_mask": np.array([i.attention_mask for i in encodings], dtype=np.int64),
+            "token_type_ids": np.array([i.type_ids for i in encodings], dtype=np.int64),
+        }
+        hidden_state = self.session.run(None, {i: inputs[i] for i in self.input_names})[0]
+        if self.config["pooling"] == "cls":
+            vectors = hidden_state[:, 0]
+        else:
+            mask = inputs["attention_mask"][:, :, None].astype(np.float32)
+            vectors = (hidden_state * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        if self.config["normalize"]:
+            vectors = vectors / np.clip(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12, None)
+        return vectors.astype(np.float32)
+
+    def encode(self, texts):
+        """encode texts to a float32 matrix with one row per text"""
+        texts = [str(i) for i in texts]
+        if len(texts) == 0:
+            return np.zeros((0, 0), dtype=np.float32)
+        # batch texts of similar length together to keep the padding small
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        vectors = [None] * len(texts)
+        for start in range(0, len(order), self.batch_size):
+            batch = order[start : start + self.batch_size]
+            for i, vector in zip(batch, self.__encode_batch([texts[i] for i in batch])):
+                vectors[i] = vector
+        return np.vstack(vectors)
+
+
+def load_embedding_model(model_name, backend="torch", onnx_dir=None):
+    """load an embedding model with an encode(texts) method - exports the onnx model first if needed"""
+    if backend == "torch":
+        from sentence_transformers import SentenceTransformer
+
+        return SentenceTransformer(model_name)
+    if backend != "onnx":
+        raise ValueError(f"Unknown embedding backend '{backend}' - use one of {EMBEDDING_BACKENDS}")
+
+    model_dir = get_onnx_model_dir(model_name, onnx_dir)
+    if not os.path.exists(os.path.join(model_dir, ONNX_CONFIG_FILE)):
+        print(f"Exporting '{model_name}' to quantized onnx in {model_dir}...")
+        # export in a separate process so that torch is not kept in the memory of this one
+        process = multiprocessing.get_context("spawn").Process(target=export_onnx_model, args=(model_name, model_dir))
+        process.start()
+        process.join()
+        if process.exitcode != 0:
+            raise RuntimeError(f"Export of '{model_name}' to onnx failed")
+    return OnnxSentenceEncoder(model_dir)
+
+
+def measure_embedding_backend(model_name, backend, texts, onnx_dir=None):
+    """
+    encode the texts and return (vectors, sentences per second, peak memory in MB, seconds to load the model) - meant
+    to run in a fresh process (see benchmark_embeddings) so that the peak memory is the one of this backend only
+    """
+    start_time = time.perf_counter()
+    model = load_embedding_model(model_name, backend=backend, onnx_dir=onnx_dir)
+    load_time = time.perf_counter() - start_time
+    model.encode(texts[:8])  # warm-up
+    start_time = time.perf_counter()
+    vectors = np.asarray(model.encode(texts), dtype=np.float32)
+    sentences_per_second = len(texts) / (time.perf_counter() - start_time)
+    peak_memory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # kB on linux
+    return vectors, sentences_per_second, peak_memory, load_time
@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+"""
+Long-lived local embedding server - keeps one warm sentence-transformer model (torch or quantized onnx backend, see
+embedding_backends.py) for all celery worker children so that they neither import torch/onnxruntime nor load the
+model themselves. Requests of concurrent callers are encoded together in batches.
+
+Run with 'python -m feed_scraper.embedding_server' (does not require Django). Clients use
+feed_scraper.embeddings.encode_texts which posts to EMBEDDING_SERVER_URL.
+
+POST /encode {"model": "<model name>", "backend": "<backend>", "texts": ["...", ...]}
+    -> {"dim": <int>, "vectors": "<base64 float32 array>"}
+GET /health -> {"model": "<model name>", "backend": "<backend>"}
+"""
+
+import base64
+import json
+import os
+import queue
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+from feed_scraper.embedding_backends import load_embedding_model
+
+DEFAULT_EMBEDDING_SERVER_URL = "http://127.0.0.1:8765"
+MAX_BATCH_SIZE = 256  # max. number of texts encoded together
+MAX_BATCH_WAIT = 0.02  # seconds to wait for more requests before encoding a batch
+
+
+class EmbeddingBatcher:
+    """Collects the texts of concurrent requests and encodes them together in one model call"""
+
+    def __init__(self, model, max_batch_size=MAX_BATCH_SIZE, max_batch_wait=MAX_BATCH_WAIT):
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.max_batch_wait = max_batch_wait
+        self.__jobs = queue.Queue()
+        self.__thread = threading.Thread(target=self.__run, daemon=True)
+        self.__thread.start()
+
+    def encode(self, texts):
+        """encode texts to a float32 matrix - blocks until the batch containing the texts was encoded"""
+        job = {"texts": texts, "done": threading.Event(), "result": None, "error": None}
+        self.__jobs.put(job)
+        job["done"].wait()
+        if job["error"] is not None:
+            raise job["error"]
+        return job["result"]
+
+    def __collect_batch(self):
+        """wait for a request and collect further requests until the batch is full or max_batch_wait passed"""
+        jobs = [self.__jobs.get()]
+        n_texts = len(jobs[0]["texts"])
+        deadline = time.perf_counter() + self.max_batch_wait
+        while n_texts < self.max_batch_size and (remaining := deadline - time.perf_counter()) > 0:
+            try:
+                jobs.append(self.__jobs.get(timeout=remaining))
+            except queue.Empty:
+                break
+            n_texts += len(jobs[-1]["texts"])
+        return jobs
+
+    def __run(self):
+        """encode the collected batches one after another - the model is only ever used by this thread"""
+        while True:
+            jobs = self.__collect_batch()
+            try:
+                texts = [text for job in jobs for text in job["texts"]]
+                vectors = np.asarray(self.model.encode(texts), dtype=np.float32)
+                start = 0
+                for job in jobs:
+                    job["result"] = vectors[start : start + len(job["texts"])]
+                    start += len(job["texts"])
+            except Exception as e:
+                for job in jobs:
+                    job["error"] = e
+            for job in jobs:
+                job["done"].set()
+
+
+def make_handler(model_name, backend, batcher):
+    """request handler class serving the given model"""
+
+    class EmbeddingRequestHandler(BaseHTTPRequestHandler):
+        """HTTP interface of the embedding server"""
+
+        def __respond(self, status, data):
+            body = json.dumps(data).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path == "/health":
+                self.__respond(200, {"model": model_name, "backend": backend})
+            else:
+                self.__respond(404, {"error": "not found"})
+
+        def do_POST(self):
+            if self.path != "/encode":
+                self.__respond(404, {"error": "not found"})
+                return
+            try:
+                request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+            except ValueError as e:
+                self.__respond(400, {"error": f"invalid request: {e}"})
+                return
+            if request.get("model", model_name) != model_name or request.get("backend", backend) != backend:
+                self.__respond(
+                    400,
+                    {
+                        "error": f"server runs model '{model_name}' ({backend}) not "
+                        f"'{request.get('model', model_name)}' ({request.get('backend', backend)})"
+                    },
+                )
+                return
+            texts = [str(i) for i in request.get("texts", [])]
+            if len(texts) == 0:
+                self.__respond(200, {"dim": 0, "vectors": ""})
+                return
+            try:
+                vectors = batcher.encode(texts)
+            except Exception as e:
+                self.__respond(500, {"error": str(e)})
+                return
+            self.__respond(
+                200, {"dim": int(vectors.shape[1]), "vectors": base64.b64encode(vectors.tobytes()).decode("ascii")}
+            )
+
+        def log_message(self, format, *args):
+            """no access log - the refresh calls the server for every page"""
+
+    return EmbeddingRequestHandler
+
+
+def run_server(server_url=None, model_name=None, backend=None):
+    """load the model and serve requests until stopped"""
+    if server_url is None:
+        server_url = os.getenv("EMBEDDING_SERVER_URL") or DEFAULT_EMBEDDING_SERVER_URL
+    model_name = os.getenv("EMBEDDING_MODEL", "all-MiniLM-L6-v2") if model_name is None else model_name
+    backend = os.getenv("EMBEDDING_BACKEND", "torch") if backend is None else backend
+    address = urllib.parse.urlsplit(server_url)
+
+    print(f"Loading embedding model '{model_name}' ({backend})...")
+    batcher = EmbeddingBatcher(load_embedding_model(model_name, backend=backend))
+    server = ThreadingHTTPServer((address.hostname, address.port), make_handler(model_name, backend, batcher))
+    print(f"Embedding server for '{model_name}' ({backend}) listening at {server_url}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+
+    load_dotenv("data/.env")
+    run_server()
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+"""Sentence embeddings of articles - persisted per article so only new or changed articles are encoded"""
+
+import base64
+import hashlib
+import time
+
+import numpy as np
+import requests  # type: ignore
+from django.conf import settings
+
+from articles.models import ArticleEmbedding
+
+from .embedding_backends import get_embedding_model_key, load_embedding_model
+
+EMBEDDING_SERVER_TIMEOUT = 300  # seconds - encoding a page of new articles on CPU can take a while
+EMBEDDING_SERVER_RETRIES = 4  # connection retries while the server is (re-)starting
+EMBEDDING_SERVER_RETRY_WAIT = 5  # seconds before the first retry - doubled for each further retry
+
+__embedding_models = {}
+
+
+def get_embedding_model(model_name, backend):
+    """load the embedding model once per process"""
+    # the backends pull in torch or onnxruntime - they are only imported in the process that actually encodes (see
+    # find_grouped_articles) so that the web process does not pay for it
+    if (model_name, backend) not in __embedding_models:
+        __embedding_models[(model_name, backend)] = load_embedding_model(
+            model_name, backend=backend, onnx_dir=settings.EMBEDDING_ONNX_DIR
+        )
+    return __embedding_models[(model_name, backend)]
+
+
+def get_article_text(article):
+    """text of an article that is embedded"""
+    return f"{article.title}.\n{article.extract}"
+
+
+def get_text_hash(text):
+    """sha256 hash of the embedded text"""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def encode_texts_with_server(texts, model_name, backend):
+    """encode texts with the resident embedding server (see embedding_server.py)"""
+    response = requests.post(
+        f"{settings.EMBEDDING_SERVER_URL.rstrip('/')}/encode",
+        json={"model": model_name, "backend": backend, "texts": texts},
+        timeout=EMBEDDING_SERVER_TIMEOUT,
+    )
+    response.raise_for_status()
+    data = response.json()
+    return np.frombuffer(base64.b64decode(data["vectors"]), dtype=np.float32).reshape(len(texts), data["dim"])
+
+
+def encode_texts(texts, model_name=None, backend=None):
+    """
+    encode texts to a float32 matrix with one row per text - with the embedding server if configured (waits while the
+    server is (re-)starting and raises if it stays unreachable, the model is never loaded into the worker as a
+    fallback), otherwise with a model loaded into this process
+    """
+    model_name = settings.EMBEDDING_MODEL if model_name is None else model_name
+    backend = settings.EMBEDDING_BACKEND if backend is None else backend
+    if settings.EMBEDDING_SERVER_URL:
+        for retry in range(EMBEDDING_SERVER_RETRIES + 1):
+            try:
+                return encode_texts_with_server(texts, model_name, backend)
+            except requests.exceptions.ConnectionError as e:
+                if retry == EMBEDDING_SERVER_RETRIES:
+                    raise
+                wait = EMBEDDING_SERVER_RETRY_WAIT * 2**retry
+                print(f"Embedding server not reachable ({e}) - retrying in {wait}s")
+                time.sleep(wait)
+    return np.asarray(get_embedding_model(model_name, backend).encode(texts), dtype=np.float32)
+
+
+def get_article_embeddings(articles, model_name=None, backend=None):
+    """
+    Get the embeddings of the articles as float32 matrix (one row per article in the same order). Stored embeddings
+    are re-used if the article's text is unchanged - only new or changed articles are encoded and stored.
+    """
+    model_name = settings.EMBEDDING_MODEL if model_name is None else model_name
+    backend = settings.EMBEDDING_BACKEND if backend is None else backend
+    model_key = get_embedding_model_key(model_name, backend)
+    articles = list(articles)
+    texts = [get_article_text(i) for i in articles]
+    text_hashes = [get_text_hash(i) for i in texts]
+    stored_embeddings = {
+        article_id: (text_hash, vector)
+        for article_id, text_hash, vector in ArticleEmbedding.objects.filter(
+            article_id__in={i.pk for i in articles}, model_name=model_key
+        ).values_list("article_id", "text_hash", "vector")
+    }
+
+    embeddings = [None] * len(articles)
+    missing = {}  # text_hash: [positions of articles with that text]
+    for i, (article, text_hash) in enumerate(zip(articles, text_hashes)):
+        if (stored := stored_embeddings.get(article.pk)) is not None and stored[0] == text_hash:
+            embeddings[i] = np.frombuffer(bytes(stored[1]), dtype=np.float32)
+        else:
+            missing.setdefault(text_hash, []).append(i)
+
+    if len(missing) > 0:
+        positions = [i[0] for i in missing.values()]
+        new_embeddings = encode_texts([texts[i] for i in positions], model_name=model_name, backend=backend)
+        new_article_embeddings = {}
+        for article_positions, vector in zip(missing.values(), new_embeddings):
+            for i in article_positions:
+                embeddings[i] = vector
+                new_article_embeddings[articles[i].pk] = ArticleEmbedding(
+                    article_id=articles[i].pk, model_name=model_key, text_hash=text_hashes[i], vector=vector.tobytes()
+                )
+        ArticleEmbedding.objects.bulk_create(
+            new_article_embeddings.values(),
+            update_conflicts=True,
+            unique_fields=["article"],
+            update_fields=["model_name", "text_hash", "vector"],
+        )
+
+    print(f"Embeddings of {len(articles)} articles: {len(articles) - len(missing)} re-used, {len(missing)} encoded")
+    if len(articles) == 0:
+        return np.zeros((0, 0), dtype=np.float32)
+    return np.vstack(embeddings)
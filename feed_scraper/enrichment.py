@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+"""Asynchronous enrichment of scraped articles with <meta> data and full-text using pooled keep-alive connections"""
+
+import asyncio
+import threading
+import urllib
+
+import httpx
+from django.conf import settings
+
+ENRICHMENT_TIMEOUT = 5  # seconds per request
+
+
+def get_full_text_request_url(article_url):
+    """url of the full-text scraper (five-filters.org) to extract the full-text of an article"""
+    return f"{settings.FULL_TEXT_URL}extract.php?url={urllib.parse.quote(article_url, safe='')}"
+
+
+class ArticleEnricher:
+    """
+    Fetches the article webpages (for the <meta> data) and the full-texts of many scraped articles concurrently.
+
+    An event loop in a background thread owns one httpx client for the lifetime of the enricher, so keep-alive
+    connections are re-used across articles and feeds. The number of parallel requests is capped per domain and in
+    total. The responses are parsed into the ScrapedArticles in the calling thread.
+    """
+
+    def __init__(self, max_in_flight=None, max_per_domain=None, max_full_text=None):
+        self.max_in_flight = max(1, settings.ENRICHMENT_MAX_IN_FLIGHT if max_in_flight is None else max_in_flight)
+        self.max_per_domain = max(1, settings.ENRICHMENT_PER_DOMAIN if max_per_domain is None else max_per_domain)
+        # the full-text scraper is a single host serving all publishers, so it gets its own limit
+        self.max_full_text = max(1, settings.ENRICHMENT_FULL_TEXT if max_full_text is None else max_full_text)
+        self.__full_text_host = (
+            None if settings.FULL_TEXT_URL is None else urllib.parse.urlsplit(settings.FULL_TEXT_URL).netloc.lower()
+        )
+        self.__domain_semaphores = {}
+        self.__loop = asyncio.new_event_loop()
+        self.__thread = threading.Thread(target=self.__loop.run_forever, daemon=True)
+        self.__thread.start()
+        self.__client = self.__run(self.__open())
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __run(self, coroutine):
+        """run a coroutine in the background event loop and wait for its result"""
+        return asyncio.run_coroutine_threadsafe(coroutine, self.__loop).result()
+
+    async def __open(self):
+        """create the connection pool and global limit inside the event loop they belong to"""
+        self.__in_flight = asyncio.Semaphore(self.max_in_flight)
+        return httpx.AsyncClient(
+            timeout=ENRICHMENT_TIMEOUT,
+            follow_redirects=True,
+            limits=httpx.Limits(max_connections=self.max_in_flight, max_keepalive_connections=self.max_in_flight),
+        )
+
+    def close(self):
+        """close all pooled connections and stop the background event loop"""
+        self.__run(self.__client.aclose())
+        self.__loop.call_soon_threadsafe(self.__loop.stop)
+        self.__thread.join()
+        self.__loop.close()
+
+    def __domain_semaphore(self, url):
+        """get (or create) the semaphore limiting the parallel requests to a domain - only used inside the loop"""
+        host = urllib.parse.urlsplit(url).netloc.lower()
+        if host not in self.__domain_semaphores:
+            limit = self.max_full_text if host == self.__full_text_host else self.max_per_domain
+            self.__domain_semaphores[host] = asyncio.Semaphore(limit)
+        return self.__domain_semaphores[host]
+
+    async def __get(self, url):
+        """GET request once a slot for the domain and a global slot are free"""
+        async with self.__domain_semaphore(url), self.__in_flight:
+            return await self.__client.get(url)
+
+    async def __skip(self):
+        """placeholder for a request that is not required"""
+        return None
+
+    async def __enrich(self, jobs):
+        """send all requests of all jobs concurrently"""
+        return await asyncio.gather(
+            *[
+                asyncio.gather(
+                    self.__get(url),
+                    self.__get(get_full_text_request_url(url)) if full_text else self.__skip(),
+                    return_exceptions=True,
+                )
+                for _, url, full_text in jobs
+            ]
+        )
+
+    def enrich(self, jobs):
+        """
+        Enrich a batch of scraped articles. jobs is a list of (scraped_article, article_url, fetch_full_text). Blocks
+        until all requests of the batch finished, then parses the responses into the respective ScrapedArticle.
+        """
+        if len(jobs) == 0:
+            return
+        results = self.__run(self.__enrich(jobs))
+        for (scraped_article, _, _), (meta_response, full_text_response) in zip(jobs, results):
+            # <meta> data
+            try:
+                if isinstance(meta_response, Exception):
+                    raise meta_response
+                scraped_article.parse_meta_attrs(response_obj=meta_response)
+            except Exception as e:
+                print(f'Error fetching meta for "{scraped_article.article_title__final}": {e}')
+            # full-text data
+            try:
+                if isinstance(full_text_response, Exception):
+                    raise full_text_response
+                if full_text_response is not None and full_text_response.status_code == 200:
+                    scraped_article.parse_scrape_attrs(json_dict=full_text_response.json())
+            except Exception as e:
+                print(f'Error fetching full-text for "{scraped_article.article_title__final}": {e}')
@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+"""Concurrent downloading of rss feeds - network waits overlap while the database work stays in the calling thread"""
+
+import collections
+import concurrent.futures
+import functools
+import queue
+import threading
+import time
+import urllib
+
+import feedparser
+import requests  # type: ignore
+from django.conf import settings
+
+FEED_DOWNLOAD_TIMEOUT = 20  # seconds
+
+
+def get_feed_url(feed):
+    """get the url to download a feed from (e.g. replace placeholder of local feed-creator instance)"""
+    feed_url = feed.url
+    if "http://FEED-CREATOR.local" in feed_url:
+        feed_url = feed_url.replace("http://FEED-CREATOR.local", settings.FEED_CREATOR_URL)
+    return feed_url
+
+
+def get_feed_host(feed):
+    """get the host a feed is downloaded from"""
+    return urllib.parse.urlsplit(get_feed_url(feed)).netloc.lower()
+
+
+def download_feed(feed, conditional=True):
+    """
+    Download and parse a single rss feed. Does not touch the database so it is safe to run in any thread.
+    Returns the parsed feed or None if the feed could not be downloaded.
+
+    If conditional, the ETag/Last-Modified validators of the previous download are sent along. If the server answers
+    "304 Not Modified" the feed is not parsed and an empty result with status 304 is returned instead.
+    """
+    feed_url = get_feed_url(feed)
+    request_headers = {"User-Agent": feedparser.USER_AGENT}
+    if conditional and feed.http_etag:
+        request_headers["If-None-Match"] = feed.http_etag
+    if conditional and feed.http_last_modified:
+        request_headers["If-Modified-Since"] = feed.http_last_modified
+    try:
+        response = requests.get(feed_url, timeout=FEED_DOWNLOAD_TIMEOUT, headers=request_headers)
+        response.raise_for_status()
+    except Exception as e:
+        print(f"Error downloading feed '{feed}': {e}")
+        return None
+
+    if response.status_code == 304:
+        fetched_feed = feedparser.FeedParserDict(feed=feedparser.FeedParserDict(), entries=[])
+    else:
+        # pass on the response headers so that feedparser can resolve relative urls and detect the encoding
+        response_headers = {k.lower(): v for k, v in response.headers.items()}
+        response_headers["content-location"] = response.url
+        fetched_feed = feedparser.parse(response.content, response_headers=response_headers)
+    fetched_feed["status"] = response.status_code
+    fetched_feed["etag"] = response.headers.get("ETag", feed.http_etag if response.status_code == 304 else None)
+    fetched_feed["modified"] = response.headers.get(
+        "Last-Modified", feed.http_last_modified if response.status_code == 304 else None
+    )
+    return fetched_feed
+
+
+class FeedDownloader:
+    """
+    Bounded thread pool downloading feeds concurrently with a cap on the number of parallel requests per host
+    (e.g. all feeds served by the feed-creator instance or by Google News share one host).
+    """
+
+    def __init__(self, max_workers=None, max_per_host=None, conditional=True):
+        self.conditional = conditional
+        self.max_workers = max(1, settings.FEED_FETCH_WORKERS if max_workers is None else max_workers)
+        self.max_per_host = max(1, settings.FEED_FETCH_PER_HOST if max_per_host is None else max_per_host)
+
+    def __download(self, feed):
+        """download a single feed and measure the pure download time"""
+        start_time = time.perf_counter()
+        fetched_feed = download_feed(feed, conditional=self.conditional)
+        return fetched_feed, time.perf_counter() - start_time
+
+    def download(self, feeds):
+        """
+        Generator downloading all feeds in the worker pool and yielding (feed, fetched_feed, download_seconds) in
+        order of completion - i.e. the caller can already process a feed while the others are still downloading.
+
+        The feeds are queued per host and only submitted to the pool once their host has a free slot, so the workers
+        never wait for a busy host while feeds of other hosts are queued.
+        """
+        if self.max_workers == 1:
+            for feed in feeds:
+                yield feed, *self.__download(feed)
+            return
+
+        host_queues = collections.defaultdict(collections.deque)
+        for feed in feeds:
+            host_queues[get_feed_host(feed)].append(feed)
+        host_downloads = collections.Counter()
+        host_lock = threading.RLock()  # re-entrant as callbacks of already finished downloads run in the same thread
+        downloaded = queue.SimpleQueue()
+        n_feeds = sum(len(i) for i in host_queues.values())
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+
+            def submit_downloads():
+                """submit the queued feeds of all hosts with a free slot"""
+                with host_lock:
+                    for host, host_queue in host_queues.items():
+                        while len(host_queue) > 0 and host_downloads[host] < self.max_per_host:
+                            feed = host_queue.popleft()
+                            host_downloads[host] += 1
+                            future = executor.submit(self.__download, feed)
+                            future.add_done_callback(functools.partial(download_done, host, feed))
+
+            def download_done(host, feed, future):
+                """free the slot of the host for its next feed (runs in the worker thread)"""
+                with host_lock:
+                    host_downloads[host] -= 1
+                submit_downloads()
+                downloaded.put((feed, future))
+
+            submit_downloads()
+            try:
+                for _ in range(n_feeds):
+                    feed, future = downloaded.get()
+                    yield feed, *future.result()
+            finally:
+                with host_lock:
+                    host_queues.clear()  # no further downloads if the caller stops early
+
+
+def print_fetch_timings(feed_timings, wall_time):
+    """print per-feed wall time and the speed-up of the concurrent download compared to a sequential run"""
+    if len(feed_timings) == 0:
+        return
+    for feed, download_time, processing_time in sorted(feed_timings, key=lambda x: -(x[1] + x[2])):
+        print(
+            f"Feed '{feed}' took {download_time + processing_time:.2f}s "
+            f"({download_time:.2f}s download, {processing_time:.2f}s processing)"
+        )
+    sequential_time = sum(i[1] + i[2] for i in feed_timings)
+    print(
+        f"Fetched {len(feed_timings)} feeds in {wall_time:.1f}s instead of {sequential_time:.1f}s sequentially "
+        f"(speed-up {sequential_time / max(wall_time, 0.001):.1f}x)"
+    )
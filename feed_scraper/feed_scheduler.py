@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+"""Adaptive polling of rss feeds - every feed learns its own refresh interval and is only fetched when it is due"""
+
+import datetime
+
+from django.conf import settings
+from django.db.models import Q
+
+from feeds.models import Feed
+
+BUSY_FEED_NEW_ARTICLES = 3  # feeds with at least this many new articles per fetch are polled more often
+SPEED_UP_FACTOR = 0.5
+BACKOFF_FACTOR = 1.5
+IMPORTANT_FEED_IMPORTANCE = 3  # feeds with at least "Breaking & Top News" importance are never polled less often ...
+IMPORTANT_FEED_MAX_INTERVAL = 30  # ... than every 30 minutes
+
+# minutes per <sy:updatePeriod> of the RSS syndication module
+SYNDICATION_PERIODS = {
+    "hourly": 60,
+    "daily": 60 * 24,
+    "weekly": 60 * 24 * 7,
+    "monthly": 60 * 24 * 30,
+    "yearly": 60 * 24 * 365,
+}
+
+
+def get_syndication_interval(fetched_feed):
+    """
+    minutes between feed updates as announced by the publisher with <sy:updatePeriod> and <sy:updateFrequency>
+    or None if the feed has no (valid) syndication hints
+    """
+    if fetched_feed is None:
+        return None
+    period = SYNDICATION_PERIODS.get(str(fetched_feed.feed.get("sy_updateperiod", "")).strip().lower())
+    if period is None:
+        return None
+    try:
+        frequency = max(int(str(fetched_feed.feed.get("sy_updatefrequency", "1")).strip()), 1)
+    except ValueError:
+        frequency = 1
+    return period / frequency
+
+
+def get_max_interval(feed):
+    """longest allowed interval for a feed - breaking news feeds are kept fast"""
+    if feed.importance >= IMPORTANT_FEED_IMPORTANCE:
+        return min(settings.FEED_MAX_INTERVAL, IMPORTANT_FEED_MAX_INTERVAL)
+    return settings.FEED_MAX_INTERVAL
+
+
+def schedule_next_fetch(feed, added_articles, fetched_feed=None, now=None):
+    """
+    Learn the refresh interval of a feed and set when it is due next (the feed is not saved). The interval backs off
+    if the feed had no new articles (or could not be downloaded), speeds up for busy feeds, and does not go below the
+    update period announced in the syndication hints of the feed.
+    """
+    now = settings.TIME_ZONE_OBJ.localize(datetime.datetime.now()) if now is None else now
+    interval = settings.FEED_DEFAULT_INTERVAL if feed.fetch_interval is None else feed.fetch_interval
+
+    if added_articles >= BUSY_FEED_NEW_ARTICLES:
+        interval *= SPEED_UP_FACTOR
+    elif added_articles == 0:
+        interval *= BACKOFF_FACTOR
+
+    if (syndication_interval := get_syndication_interval(fetched_feed)) is not None:
+        interval = max(interval, syndication_interval)
+
+    interval = int(round(min(max(interval, settings.FEED_MIN_INTERVAL), get_max_interval(feed))))
+    setattr(feed, "fetch_interval", interval)
+    setattr(feed, "next_fetch_at", now + datetime.timedelta(minutes=interval))
+    return interval
+
+
+def get_due_feeds(feeds, now=None):
+    """filter the feeds (queryset) to the ones that are due - feeds that were never fetched are always due"""
+    now = settings.TIME_ZONE_OBJ.localize(datetime.datetime.now()) if now is None else now
+    # feeds becoming due within the next minute are fetched now rather than waiting a full dispatch cycle
+    return feeds.filter(Q(next_fetch_at__isnull=True) | Q(next_fetch_at__lte=now + datetime.timedelta(minutes=1)))
+
+
+def has_due_feeds():
+    """check if any active rss feed is due for refreshing"""
+    return get_due_feeds(Feed.objects.filter(active=True, feed_type="rss")).exists()
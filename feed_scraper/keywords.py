@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+"""
+Keyword tagging of new articles as a batched stage after the feeds were refreshed - the keywords are added to the
+categories of the articles.
+
+- "ollama": keywords from the LLM at OLLAMA_URL - KEYWORD_MAX_CONCURRENCY requests at a time with a timeout. Articles
+  the LLM fails for get the built-in keywords.
+- "builtin": TF-IDF keywords (words and two-word phrases) with the new articles as corpus - fast, CPU only
+- "none": no keywords
+
+Keywords are cached by a hash of the extractor, title, and extract, so e.g. re-published articles are not tagged again.
+"""
+
+import concurrent.futures
+import datetime
+import hashlib
+import re
+
+import requests
+from django.conf import settings
+from django.core.cache import cache
+
+from articles.models import Article, save_article_tags, truncate_long_fields
+
+KEYWORD_EXTRACTORS = ["ollama", "builtin", "none"]
+KEYWORDS_PER_ARTICLE = 5
+KEYWORD_CACHE_SECONDS = 3600 * 24 * 14
+KEYWORD_FIRST_RUN_HOURS = 24  # articles tagged by the first run - later runs tag the articles added since the last
+OLLAMA_TIMEOUT = 30  # seconds per request
+LIST_MARKER_PATTERN = re.compile(r"^\s*(?:\d+[.)]|[-*•])\s*")
+WORD_PATTERN = re.compile(r"\b[^\W\d_][\w'-]+\b")  # words of at least two characters starting with a letter
+PHRASE_SPLIT_PATTERN = re.compile(r"[^\w\s'-]+")
+
+
+def get_keyword_text(article_obj):
+    """text the keywords are extracted from"""
+    return f"{article_obj.title or ''}. {article_obj.extract or ''}"
+
+
+def get_keyword_cache_key(text, extractor):
+    """cache key of the keywords of a text"""
+    model = settings.OLLAMA_MODEL if extractor == "ollama" else extractor
+    return f"articleKeywords_{hashlib.sha256(f'{model} {text}'.encode('utf-8')).hexdigest()}"
+
+
+def get_keyword_candidates(text):
+    """words and two-word phrases of the text - phrases neither span punctuation nor stop words"""
+    from sklearn.feature_extraction.text import ENGLISH_STOP_WORDS
+
+    candidates = []
+    for phrase in PHRASE_SPLIT_PATTERN.split(text.lower()):
+        run = []
+        for word in WORD_PATTERN.findall(phrase) + [None]:
+            if word is not None and word not in ENGLISH_STOP_WORDS:
+                run.append(word)
+                continue
+            candidates += run + [f"{i} {j}" for i, j in zip(run, run[1:])]
+            run = []
+    return candidates
+
+
+def extract_builtin_keywords(texts, n=KEYWORDS_PER_ARTICLE):
+    """TF-IDF keywords of each text with the texts as corpus - returned as written in the text"""
+    # imported here so that only the celery worker loads sklearn - the web process also imports the article scraper
+    from sklearn.feature_extraction.text import TfidfVectorizer
+
+    if len(texts) == 0:
+        return []
+    vectorizer = TfidfVectorizer(analyzer=get_keyword_candidates, sublinear_tf=True)
+    try:
+        scores = vectorizer.fit_transform(texts)
+    except ValueError:  # only stop words
+        return [[] for _ in texts]
+    terms = vectorizer.get_feature_names_out()
+
+    keywords = []
+    for text, row in zip(texts, scores):
+        row = row.tocoo()
+        text_keywords = []
+        for term in terms[row.col[row.data.argsort(kind="stable")[::-1]]]:
+            if len(text_keywords) == n:
+                break
+            # skip words of a chosen phrase and phrases of a chosen word
+            if any(set(term.split(" ")) & set(i.lower().split(" ")) for i in text_keywords):
+                continue
+            match = re.search(r"\b" + r"\s+".join(re.escape(i) for i in term.split(" ")) + r"\b", text, re.IGNORECASE)
+            text_keywords.append(term if match is None else match.group(0))
+        keywords.append(text_keywords)
+    return keywords
+
+
+def request_ollama_keywords(text):
+    """keywords of the text from the LLM at OLLAMA_URL"""
+    response = requests.post(
+        settings.OLLAMA_URL + "/api/generate",
+        json={
+            "model": settings.OLLAMA_MODEL,
+            "prompt": f'List {KEYWORDS_PER_ARTICLE} keywords from this text: "{text}"',
+            "stream": False,
+        },
+        timeout=OLLAMA_TIMEOUT,
+    )
+    response.raise_for_status()
+    keywords = [LIST_MARKER_PATTERN.sub("", i).strip(" \"'") for i in response.json().get("response", "").split("\n")]
+    return [i for i in keywords if i != ""][:KEYWORDS_PER_ARTICLE]
+
+
+def get_keywords(texts, extractor=None, max_workers=None):
+    """keywords of each text - from the cache, the LLM (concurrently), or the built-in extractor"""
+    extractor = settings.KEYWORD_EXTRACTOR if extractor is None else extractor
+    if extractor not in KEYWORD_EXTRACTORS:
+        raise ValueError(f"Unknown keyword extractor '{extractor}' - use one of {KEYWORD_EXTRACTORS}")
+    if extractor == "none" or len(texts) == 0:
+        return [[] for _ in texts]
+    max_workers = max(1, settings.KEYWORD_MAX_CONCURRENCY if max_workers is None else max_workers)
+
+    cache_keys = [get_keyword_cache_key(i, extractor) for i in texts]
+    keywords = cache.get_many(cache_keys)
+    missing = {k: text for k, text in zip(cache_keys, texts) if k not in keywords}
+    if extractor == "ollama" and len(missing) > 0:
+        llm_keywords = {}
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {executor.submit(request_ollama_keywords, text): k for k, text in missing.items()}
+            for future in concurrent.futures.as_completed(futures):
+                try:
+                    llm_keywords[futures[future]] = future.result()
+                except Exception as e:
+                    print(f"Error getting keywords from Ollama: {e}")
+        cache.set_many(llm_keywords, KEYWORD_CACHE_SECONDS)
+        keywords.update(llm_keywords)
+        missing = {k: text for k, text in missing.items() if k not in llm_keywords}
+        if len(missing) > 0:
+            print(f"Using built-in keywords for {len(missing)} articles")
+
+    builtin_keywords = dict(zip(missing.keys(), extract_builtin_keywords(list(missing.values()))))
+    # built-in keywords are not cached if the LLM failed - it is asked again next time
+    if extractor == "builtin":
+        cache.set_many(builtin_keywords, KEYWORD_CACHE_SECONDS)
+    keywords.update(builtin_keywords)
+    return [keywords[k] for k in cache_keys]
+
+
+def add_categories(categories, keywords):
+    """';'-separated categories with the keywords not yet included (case-insensitive)"""
+    categories = [i for i in (categories or "").split(";") if i != ""]
+    for keyword in keywords:
+        if keyword.lower() not in [i.lower() for i in categories]:
+            categories.append(keyword)
+    return ";".join(categories)
+
+
+def add_article_keywords():
+    """add keywords to the categories of all articles added since the last run and save them in bulk"""
+    run_start = settings.TIME_ZONE_OBJ.localize(datetime.datetime.now())
+    if settings.KEYWORD_EXTRACTOR == "none":
+        return
+    last_run = cache.get("articleKeywordsLastRun")
+    added_since = (
+        run_start - datetime.timedelta(hours=KEYWORD_FIRST_RUN_HOURS)
+        if last_run is None
+        else datetime.datetime.fromisoformat(last_run)
+    )
+    articles = list(
+        Article.objects.filter(added_date__gte=added_since)
+        .exclude(content_type__in=["group", "video"])
+        .only("pk", "title", "extract", "categories")
+    )
+    print(f"Adding keywords ({settings.KEYWORD_EXTRACTOR}) to {len(articles)} new articles...")
+
+    changed_articles = []
+    for article_obj, keywords in zip(articles, get_keywords([get_keyword_text(i) for i in articles])):
+        if (categories := add_categories(article_obj.categories, keywords)) != (article_obj.categories or ""):
+            setattr(article_obj, "categories", categories)
+            truncate_long_fields(sender=Article, instance=article_obj)
+            changed_articles.append(article_obj)
+    Article.objects.bulk_update(changed_articles, ["categories"], batch_size=500)
+    save_article_tags(changed_articles)
+    cache.set("articleKeywordsLastRun", run_start.isoformat(), 60 * 60 * 24 * 7)
+    print(f"Added keywords to {len(changed_articles)} articles.")
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+"""
+Batched language identification of the new articles of a feed.
+
+The langid model is loaded once per process and restricted to the candidate languages: ALLOWED_LANGUAGES, the
+publisher's language, and LANGUAGE_ID_LANGUAGES (common languages - so that articles in other languages are still
+recognised and filtered out by ALLOWED_LANGUAGES). Short texts like headlines are often mistaken for rare languages by
+the full model. All texts of a feed are scored with one matrix product. The publisher's language and the languages
+declared by the feed and the article are used as priors. Articles whose declared languages agree are not classified
+at all.
+"""
+
+import functools
+
+import langid.langid
+import numpy as np
+from django.conf import settings
+
+DECLARED_LANGUAGE_ATTRS = ["article_language__feed", "feed_language__feed", "article_language__meta"]
+# prior weight of a language declared by the publisher/feed/article compared to any other candidate language (1)
+LANGUAGE_PRIOR_WEIGHT = 4
+
+
+@functools.lru_cache(maxsize=1)
+def get_language_model():
+    """the langid model (decoding it takes about a second, so it is only done once per process)"""
+    return langid.langid.LanguageIdentifier.from_modelstring(langid.langid.model)
+
+
+def get_language_code(language):
+    """two-letter code of a language like 'en', 'en-GB', 'en_US' or None"""
+    if language is None or len(language.strip()) < 2:
+        return None
+    return language.strip()[:2].lower()
+
+
+def get_declared_language(scraped_article):
+    """
+    language declared by the feed entry, the feed, and the article's <meta> data (e.g. 'en-GB', 'de-XX') if they do
+    not contradict each other - None if none is declared or they disagree
+    """
+    languages = [
+        i for i in (getattr(scraped_article, attr, None) for attr in DECLARED_LANGUAGE_ATTRS) if get_language_code(i)
+    ]
+    if len(languages) == 0 or len({get_language_code(i) for i in languages}) > 1:
+        return None
+    for language in languages:
+        if len(language) == 2:
+            return f"{language}-XX"
+        elif len(language) == 5:
+            return language.replace("_", "-")
+    return f"{get_language_code(languages[0])}-XX"
+
+
+def get_candidate_languages(publisher_language=None):
+    """languages of the model the texts are classified into"""
+    model_languages = get_language_model().nb_classes
+    extra_languages = f"{settings.ALLOWED_LANGUAGES},{settings.LANGUAGE_ID_LANGUAGES}"
+    if "*" in extra_languages:
+        return list(model_languages)
+    candidates = {get_language_code(i) for i in extra_languages.split(",")} | {get_language_code(publisher_language)}
+    return [i for i in model_languages if i in candidates]
+
+
+def classify_languages(texts, candidate_languages, prior_languages=None):
+    """
+    two-letter language code of each text - the texts are scored together with the model restricted to the candidate
+    languages. prior_languages are the publisher's/declared languages of each text (more likely than the others).
+    """
+    if len(texts) == 0:
+        return []
+    model = get_language_model()
+    indexes = [list(model.nb_classes).index(i) for i in candidate_languages]
+    features = np.vstack([model.instance2fv(i) for i in texts]).astype(np.float32)
+    scores = features @ model.nb_ptc[:, indexes] + model.nb_pc[indexes]
+    if prior_languages is not None:
+        for row, languages in enumerate(prior_languages):
+            for language in languages:
+                if language in candidate_languages:
+                    scores[row, candidate_languages.index(language)] += np.log(LANGUAGE_PRIOR_WEIGHT)
+    return [candidate_languages[i] for i in scores.argmax(axis=1)]
+
+
+def get_scraped_article_language_text(scraped_article):
+    """text the language of an article is identified from"""
+    return f"{scraped_article.article_title__final}\n{scraped_article.article_summary__final}"
+
+
+def identify_languages(scraped_articles, publisher_language=None):
+    """
+    add the identified language to all scraped articles of a feed whose declared languages do not agree (or are
+    missing) - classified in one batch
+    """
+    undeclared = [i for i in scraped_articles if get_declared_language(i) is None]
+    if len(undeclared) == 0:
+        return
+    prior_languages = [
+        {get_language_code(publisher_language)}
+        | {get_language_code(getattr(i, attr, None)) for attr in DECLARED_LANGUAGE_ATTRS}
+        for i in undeclared
+    ]
+    languages = classify_languages(
+        [get_scraped_article_language_text(i) for i in undeclared],
+        get_candidate_languages(publisher_language),
+        prior_languages,
+    )
+    for scraped_article, language in zip(undeclared, languages):
+        scraped_article.add_identified_language(language)
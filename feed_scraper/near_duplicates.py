@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+"""
+Near-duplicate detection at ingest - the same story re-published by a publisher (e.g. under a new link) or listed by
+news aggregators is linked to the already existing article before any article data is fetched or embedded.
+
+Every new article gets a MinHash signature of the word 3-shingles of its title and feed summary (the full text is only
+known after the enrichment fetch). The signature is split into bands which are stored as hashed keys (LSH index) -
+articles sharing at least one band key are candidates and their estimated Jaccard similarity is compared to
+NEAR_DUPLICATE_MIN_SIMILARITY. With 16 bands of 4 values, texts with 70% of their shingles in common are candidates
+with a probability of 98% and texts with 30% in common only with a probability of 12%.
+
+Only articles of the same publisher are linked - the same wire story of different publishers stays separate articles
+(their feed positions and categories would be mixed otherwise). The links are stored, so later refreshes find the
+article by the entry's guid/hash.
+"""
+
+import datetime
+import hashlib
+import re
+
+import numpy as np
+from django.conf import settings
+from django.db.models import Q
+
+from articles.models import Article, ArticleMinHash, ArticleMinHashBand, ArticleNearDuplicate
+
+SHINGLE_SIZE = 3  # words per shingle
+MIN_SHINGLES = 8  # shorter texts are too generic to be compared (e.g. "Live: latest updates")
+MINHASH_BANDS = 16
+MINHASH_BAND_SIZE = 4
+MINHASH_PERMUTATIONS = MINHASH_BANDS * MINHASH_BAND_SIZE
+MINHASH_PRIME = 4294967291  # largest prime < 2^32
+NEAR_DUPLICATE_DAYS = 3  # only articles added in the last days are candidates
+WORD_PATTERN = re.compile(r"\w+")
+
+
+def __get_permutation_parameters(name):
+    """fixed (a * x + b) % prime permutation parameters - derived from hashes so that they never change"""
+    hashes = [hashlib.blake2b(f"{name}{i}".encode("utf-8"), digest_size=4) for i in range(MINHASH_PERMUTATIONS)]
+    return np.array([int.from_bytes(i.digest(), "big") >> 1 | 1 for i in hashes], dtype=np.uint64)
+
+
+# a, b < 2^31 and the shingle hashes < 2^32 - a * x + b does not overflow uint64
+PERMUTATION_A = __get_permutation_parameters("a")
+PERMUTATION_B = __get_permutation_parameters("b")
+
+
+def get_minhash(text):
+    """MinHash signature (uint32 array) of the word shingles of the text or None if the text is too short"""
+    words = WORD_PATTERN.findall(str(text).lower())
+    shingles = {" ".join(words[i : i + SHINGLE_SIZE]) for i in range(len(words) - SHINGLE_SIZE + 1)}
+    if len(shingles) < MIN_SHINGLES:
+        return None
+    hashes = np.frombuffer(
+        b"".join(hashlib.blake2b(i.encode("utf-8"), digest_size=4).digest() for i in shingles), dtype=">u4"
+    ).astype(np.uint64)
+    permuted = (hashes[:, None] * PERMUTATION_A + PERMUTATION_B) % MINHASH_PRIME
+    return permuted.min(axis=0).astype(np.uint32)
+
+
+def get_minhash_band_keys(minhash):
+    """LSH keys of the bands of the signature - signed 64-bit hashes of the band number and its values"""
+    return [
+        int.from_bytes(
+            hashlib.blake2b(
+                i.to_bytes(1, "big") + minhash[i * MINHASH_BAND_SIZE : (i + 1) * MINHASH_BAND_SIZE].tobytes(),
+                digest_size=8,
+            ).digest(),
+            "big",
+            signed=True,
+        )
+        for i in range(MINHASH_BANDS)
+    ]
+
+
+def get_minhash_similarity(minhash_a, minhash_b):
+    """estimated Jaccard similarity of the shingles of two texts"""
+    return float(np.mean(minhash_a == minhash_b))
+
+
+def get_scraped_article_minhash(scraped_article):
+    """signature of the title and summary of the feed entry - available before any article data is fetched"""
+    return get_minhash(
+        f"{getattr(scraped_article, 'article_title__feed', '') or ''} "
+        f"{getattr(scraped_article, 'article_summary_text__feed', '') or ''}"
+    )
+
+
+def find_near_duplicate_articles(minhashes, articles=None, min_similarity=None, is_match=None):
+    """
+    find already existing articles (of the queryset articles) for the signatures {key: minhash} with three queries -
+    returns {key: article} with the most similar article with at least min_similarity (NEAR_DUPLICATE_MIN_SIMILARITY,
+    disabled if 0) for which is_match(key, article) is True (all articles if None)
+    """
+    articles = Article.objects.all() if articles is None else articles
+    min_similarity = settings.NEAR_DUPLICATE_MIN_SIMILARITY if min_similarity is None else min_similarity
+    minhashes = {k: v for k, v in minhashes.items() if v is not None}
+    if min_similarity <= 0 or len(minhashes) == 0:
+        return {}
+
+    band_keys = {k: get_minhash_band_keys(v) for k, v in minhashes.items()}
+    now = settings.TIME_ZONE_OBJ.localize(datetime.datetime.now())
+    added_since = now - datetime.timedelta(days=NEAR_DUPLICATE_DAYS)
+    candidate_ids = {}
+    for band_key, article_id in ArticleMinHashBand.objects.filter(
+        key__in={i for v in band_keys.values() for i in v}, article__added_date__gte=added_since
+    ).values_list("key", "article_id"):
+        candidate_ids.setdefault(band_key, set()).add(article_id)
+    if len(candidate_ids) == 0:
+        return {}
+    candidate_minhashes = {
+        article_id: np.frombuffer(signature, dtype=np.uint32)
+        for article_id, signature in ArticleMinHash.objects.filter(
+            article_id__in={i for v in candidate_ids.values() for i in v}
+        ).values_list("article_id", "signature")
+    }
+
+    # similar enough candidates of each signature - most similar first
+    matches = {}
+    for key, minhash in minhashes.items():
+        similarities = [
+            (get_minhash_similarity(minhash, candidate_minhashes[i]), i)
+            for i in {i for band_key in band_keys[key] for i in candidate_ids.get(band_key, [])}
+            if i in candidate_minhashes
+        ]
+        matches[key] = [i for similarity, i in sorted(similarities, reverse=True) if similarity >= min_similarity]
+    articles = articles.in_bulk({i for v in matches.values() for i in v})
+    near_duplicates = {}
+    for key, article_ids in matches.items():
+        for article_id in article_ids:
+            if article_id in articles and (is_match is None or is_match(key, articles[article_id])):
+                near_duplicates[key] = articles[article_id]
+                break
+    return near_duplicates
+
+
+def __truncate_link_key(guid, hash):
+    """guid and hash truncated to the max_length of the ArticleNearDuplicate fields (as they are when saved)"""
+    guid_length = ArticleNearDuplicate._meta.get_field("guid").max_length
+    hash_length = ArticleNearDuplicate._meta.get_field("hash").max_length
+    return (None if guid is None else guid[:guid_length]), hash[:hash_length]
+
+
+def find_linked_articles(keys, articles=None):
+    """
+    find the articles (of the queryset articles) that the feed entries [(guid, hash)] were linked to as near-duplicate
+    before with two queries - returns {(guid, hash): article}
+    """
+    articles = Article.objects.all() if articles is None else articles
+    if len(keys) == 0:
+        return {}
+    truncated_keys = {key: __truncate_link_key(*key) for key in keys}
+    links = {}
+    for guid, hash, article_id in ArticleNearDuplicate.objects.filter(
+        Q(guid__in={guid for guid, _ in truncated_keys.values() if guid is not None})
+        | Q(hash__in={hash for _, hash in truncated_keys.values()})
+    ).values_list("guid", "hash", "article_id"):
+        if guid is not None:
+            links.setdefault(("guid", guid), article_id)
+        links.setdefault(("hash", hash), article_id)
+    article_ids = {}
+    for key, (guid, hash) in truncated_keys.items():
+        if (article_id := links.get(("guid", guid), links.get(("hash", hash)))) is not None:
+            article_ids[key] = article_id
+    articles = articles.in_bulk(set(article_ids.values()))
+    return {k: articles[v] for k, v in article_ids.items() if v in articles}
+
+
+def save_near_duplicate_links(links):
+    """store the links [(guid, hash, article)] of feed entries to the article they are a near-duplicate of"""
+    link_objs = []
+    for guid, hash, article in links:
+        guid, hash = __truncate_link_key(guid, hash)
+        link_objs.append(ArticleNearDuplicate(guid=guid, hash=hash, article=article))
+    ArticleNearDuplicate.objects.bulk_create(link_objs, ignore_conflicts=True)  # entries might be linked already
+
+
+def save_article_minhashes(article_minhashes):
+    """store the signatures [(article, minhash)] of new articles and their LSH band keys with two queries"""
+    article_minhashes = [(article, minhash) for article, minhash in article_minhashes if minhash is not None]
+    ArticleMinHash.objects.bulk_create(
+        [ArticleMinHash(article=article, signature=minhash.tobytes()) for article, minhash in article_minhashes]
+    )
+    ArticleMinHashBand.objects.bulk_create(
+        [
+            ArticleMinHashBand(article=article, key=band_key)
+            for article, minhash in article_minhashes
+            for band_key in get_minhash_band_keys(minhash)
+        ]
+    )
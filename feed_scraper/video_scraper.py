@@ -10,10 +10,10 @@ import feedparser
 import scrapetube
 from django.conf import settings
 
-from articles.models import Article, FeedPosition
+from articles.models import Article, FeedPosition, replace_feed_positions
 from feeds.models import Feed
 
-from .article_scraper import calcualte_relevance, delete_feed_positions
+from .article_scraper import calcualte_relevance
 
 
 def __extract_number_from_datestr(full_str, identifier):
@@ -28,14 +28,17 @@ def __extract_number_from_datestr(full_str, identifier):
     return int("".join(reversed(reversed_int_str)))
 
 
-def update_videos():
-    """Main function that refreshes/scrapes videos from video feed sources."""
-    start_time = time.time()
-
+def get_video_feeds():
+    """active video feeds to refresh"""
     feeds = Feed.objects.filter(active=True).exclude(feed_type="rss")
     if settings.TESTING:
         # when testing is turned on only fetch 10% of feeds to not having to wait too long
         feeds = [feeds[i] for i in range(0, len(feeds), len(feeds) // (len(feeds) // 10))]
+    return list(feeds)
+
+
+def get_video_force_refetch():
+    """check if the videos are to be re-fetched even if the feed is up-to-date"""
     force_refetch = os.getenv("FORCE_REFETCH", "False").lower() == "true"
 
     if (
@@ -44,6 +47,15 @@ def update_videos():
         and datetime.datetime.now().hour < 15
     ):  # every Monday and Friday force re-fetch the videos to update outdated images / texts / etc
         force_refetch = True
+    return force_refetch
+
+
+def update_videos():
+    """Main function that refreshes/scrapes videos from video feed sources."""
+    start_time = time.time()
+
+    feeds = get_video_feeds()
+    force_refetch = get_video_force_refetch()
 
     added_videos = 0
     for feed in feeds:
@@ -84,6 +96,7 @@ def fetch_feed(feed, force_refetch, max_per_feed=200):
         videos = []
         src = "unknown"
 
+    feed_positions = None  # stays None if the feed is already up-to-date and the positions are kept
     for i, video in enumerate(videos):
         if i == 0:
             matches = Article.objects.filter(
@@ -101,7 +114,7 @@ def fetch_feed(feed, force_refetch, max_per_feed=200):
                 )
                 break
             else:
-                delete_feed_positions(feed)
+                feed_positions = []
 
         no_new_video = 0
         if no_new_video > 50:
@@ -255,15 +268,19 @@ def fetch_feed(feed, force_refetch, max_per_feed=200):
                 setattr(article_obj, k, v)
         article_obj.save()
 
-        # Add feed position linking
-        feed_position = FeedPosition(
-            feed=feed,
-            article=article_obj,
-            position=article__feed_position,
-            importance=max_importance,
-            relevance=min_article_relevance,
+        # Add feed position linking (saved in bulk for the entire feed below)
+        feed_positions.append(
+            FeedPosition(
+                feed=feed,
+                article=article_obj,
+                position=article__feed_position,
+                importance=max_importance,
+                relevance=min_article_relevance,
+            )
         )
-        feed_position.save()
+
+    if feed_positions is not None:
+        replace_feed_positions(feed=feed, feed_positions=feed_positions)
 
     total_articles = (
         article__feed_position
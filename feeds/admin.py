@@ -19,7 +19,7 @@ class FeedsInline(TabularInline):
     model = Feed
     fk_name = "publisher"
     extra = 0
-    exclude = ["last_fetched"]
+    exclude = ["last_fetched", "http_etag", "http_last_modified", "next_fetch_at", "fetch_interval"]
 
 
 class FeedImportExport(resources.ModelResource):
@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+"""manage.py command backfill_article_facets to fill the article tags and language codes of existing articles"""
+
+from django.core.management import BaseCommand
+from django.db.models.functions import Lower, Substr
+
+from articles.models import Article, get_untagged_articles, save_article_tags
+
+BATCH_SIZE = 2000
+
+
+class Command(BaseCommand):
+    """command for manage.py"""
+
+    # Show this when the user types help
+    help = "Fills the indexed tags and language codes of the articles that have categories/language but none yet"
+
+    def handle(self, *args, **options):
+        """
+        fills the missing language codes with one query and the missing tags in batches - only articles without them
+        are changed, so an interrupted backfill continues where it stopped when it runs again
+        """
+        Article.objects.filter(language__isnull=False, language_code__isnull=True).update(
+            language_code=Lower(Substr("language", 1, 2))
+        )
+        articles = get_untagged_articles().only("pk", "categories").order_by("pk")
+        last_pk = 0
+        while len(batch := list(articles.filter(pk__gt=last_pk)[:BATCH_SIZE])) > 0:
+            save_article_tags(batch, new=True)
+            last_pk = batch[-1].pk
+            print(f"Saved the tags of articles up to pk {last_pk}")
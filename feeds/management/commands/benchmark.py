@@ -0,0 +1,23 @@
+# -*- coding: utf-8 -*-
+"""manage.py command benchmark to measure the performance of individual stages of the news refresh"""
+
+from django.core.management import BaseCommand
+
+from feed_scraper.benchmarks import BENCHMARKS
+
+
+class Command(BaseCommand):
+    """command for manage.py"""
+
+    # Show this when the user types help
+    help = "Runs a benchmark of a stage of the news refresh e.g. 'python manage.py benchmark dedup --limit 5'"
+
+    def add_arguments(self, parser):
+        """command line arguments"""
+        parser.add_argument("suite", choices=sorted(BENCHMARKS.keys()), help="benchmark to run")
+        parser.add_argument("--limit", type=int, default=10, help="max. number of feeds/articles/repetitions")
+        parser.add_argument("--path", default=None, help="directory with fixtures to benchmark with")
+
+    def handle(self, *args, **options):
+        """runs the selected benchmark"""
+        BENCHMARKS[options["suite"]](**options)
@@ -65,6 +65,10 @@ class Feed(models.Model):
     url = models.URLField(max_length=600)
     active = models.BooleanField(default=True)
     last_fetched = models.DateTimeField(null=True, blank=True)
+    http_etag = models.CharField(max_length=250, null=True, blank=True)  # validators for conditional HTTP GET
+    http_last_modified = models.CharField(max_length=50, null=True, blank=True)
+    next_fetch_at = models.DateTimeField(null=True, blank=True)  # adaptive polling - see feed_scraper.feed_scheduler
+    fetch_interval = models.PositiveIntegerField(null=True, blank=True)  # learned refresh interval in minutes
     importance = models.SmallIntegerField(choices=NEWS_IMPORTANCE)
     FEED_TYPES = [
         ("rss", "RSS Feed"),
@@ -1,3 +1,111 @@
-from django.test import TestCase
+"""Tests for feeds app"""
 
-# Create your tests here.
+import importlib.util
+import os
+import tempfile
+import unittest
+
+from django.test import SimpleTestCase
+
+from feed_scraper.article_scraper_class import get_html_elements, html_clean_up
+from feed_scraper.embedding_backends import (
+    EMBEDDING_PARITY_MIN_COSINE,
+    get_cosine_similarities,
+    load_embedding_model,
+)
+
+# html fixtures (<name>.html) with the output of the previous BeautifulSoup html_clean_up (<name>.baseline.html/.txt)
+HTML_FIXTURES_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "feed_scraper", "benchmark_fixtures")
+
+
+class HtmlCleanUpTestCase(SimpleTestCase):
+    """html_clean_up returns the same elements and text as the previous BeautifulSoup implementation"""
+
+    def get_fixtures(self):
+        """{name: (input html, baseline html, baseline text)} of all html fixtures"""
+        fixtures = {}
+        for file_name in sorted(os.listdir(HTML_FIXTURES_DIR)):
+            if file_name.endswith(".html") and ".baseline." not in file_name:
+                name = file_name[: -len(".html")]
+                fixtures[name] = []
+                for suffix in [".html", ".baseline.html", ".baseline.txt"]:
+                    with open(os.path.join(HTML_FIXTURES_DIR, name + suffix), encoding="utf-8") as file:
+                        fixtures[name].append(file.read())
+        return fixtures
+
+    def test_fixtures_match_baseline(self):
+        fixtures = self.get_fixtures()
+        self.assertGreater(len(fixtures), 0)
+        for name, (article_html, baseline_html, baseline_text) in fixtures.items():
+            with self.subTest(fixture=name):
+                new_html, new_text = html_clean_up(article_html)
+                self.assertEqual(get_html_elements(new_html), get_html_elements(baseline_html))
+                self.assertEqual(new_text.split(), baseline_text.split())
+
+    def test_collects_image_sources(self):
+        img_lst = []
+        html_clean_up('<p>a</p><img src="none" data-src="https://example.com/a.jpg"><img src="/b.jpg">', img_lst)
+        self.assertEqual(img_lst, ["https://example.com/a.jpg", "/b.jpg"])
+
+    def test_image_without_src(self):
+        article_html, _ = html_clean_up('<img data-src="https://example.com/a.jpg">')
+        self.assertIn('src="https://example.com/a.jpg"', article_html)
+
+
+@unittest.skipUnless(
+    all(importlib.util.find_spec(i) is not None for i in ["torch", "onnxruntime", "sentence_transformers"]),
+    "the embedding backends require torch, onnxruntime and sentence-transformers",
+)
+class EmbeddingBackendParityTestCase(SimpleTestCase):
+    """the quantized onnx embeddings match the torch embeddings of the same sentence-transformer model"""
+
+    TEXTS = [
+        "the bank of england held interest rates",
+        "apple unveiled a new iphone with a faster chip and camera",
+        "storm closes ports",
+        "ferry crossings cancelled as the storm closes ports along the east coast of england",
+        "an unknown word",
+    ]
+
+    @classmethod
+    def setUpClass(cls):
+        """save a tiny randomly initialized sentence-transformer model - no model download required"""
+        super().setUpClass()
+        import torch
+        from sentence_transformers import SentenceTransformer, models
+        from transformers import BertConfig, BertModel, BertTokenizerFast
+
+        cls.temp_dir = tempfile.TemporaryDirectory()
+        transformer_dir = os.path.join(cls.temp_dir.name, "transformer")
+        os.makedirs(transformer_dir)
+        words = sorted({word for text in cls.TEXTS[:-1] for word in text.split()})
+        with open(os.path.join(transformer_dir, "vocab.txt"), "w") as file:
+            file.write("\n".join(["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]"] + words))
+        tokenizer = BertTokenizerFast(os.path.join(transformer_dir, "vocab.txt"))
+        torch.manual_seed(0)
+        config = BertConfig(
+            vocab_size=tokenizer.vocab_size,
+            hidden_size=32,
+            num_hidden_layers=2,
+            num_attention_heads=2,
+            intermediate_size=64,
+            max_position_embeddings=64,
+        )
+        BertModel(config).save_pretrained(transformer_dir)
+        tokenizer.save_pretrained(transformer_dir)
+        transformer = models.Transformer(transformer_dir, max_seq_length=32)
+        pooling = models.Pooling(transformer.get_word_embedding_dimension(), "mean")
+        cls.model_name = os.path.join(cls.temp_dir.name, "sentence-transformer")
+        SentenceTransformer(modules=[transformer, pooling, models.Normalize()], device="cpu").save(cls.model_name)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.temp_dir.cleanup()
+        super().tearDownClass()
+
+    def test_onnx_matches_torch(self):
+        onnx_dir = os.path.join(self.temp_dir.name, "onnx")
+        reference = load_embedding_model(self.model_name, backend="torch").encode(self.TEXTS)
+        vectors = load_embedding_model(self.model_name, backend="onnx", onnx_dir=onnx_dir).encode(self.TEXTS)
+        self.assertEqual(vectors.shape, reference.shape)
+        self.assertGreaterEqual(get_cosine_similarities(reference, vectors).min(), EMBEDDING_PARITY_MIN_COSINE)
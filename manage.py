@@ -84,8 +84,24 @@ if __name__ == "__main__":
 
         from django.contrib.auth.models import User
 
+        from articles.models import Article, get_untagged_articles
         from feeds.models import Feed
 
+        # Fill the indexed tags and language codes of the articles that are missing them (e.g. saved before they were
+        # added or an interrupted backfill)
+        if (
+            get_untagged_articles().exists()
+            or Article.objects.filter(language__isnull=False, language_code__isnull=True).exists()
+        ):
+            print("Backfill article tags and language codes")
+            sys.argv = [INITIAL_ARGV[0], "backfill_article_facets"]
+            main()
+
+        # Create the full-text search index of the articles (and index the existing ones) if it is missing
+        from articles.search import ensure_search_index
+
+        ensure_search_index()
+
         # Load initial feeds
         if len(Feed.objects.all()) == 0:
             print("Add default data")
@@ -5,6 +5,7 @@ import os
 
 from celery import Celery
 from celery.schedules import crontab
+from celery.signals import worker_ready
 
 # Set the default Django settings module for the 'celery' program.
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "news_platform.settings")
@@ -20,15 +21,29 @@ app.config_from_object("django.conf:settings", namespace="CELERY")
 # Load task modules from all registered Django apps.
 app.autodiscover_tasks()
 
+
+@worker_ready.connect
+def ensure_search_index_at_start(**kwargs):
+    """create the search index or re-create its triggers if they are missing, e.g. after a migration"""
+    from django.db import connection
+
+    from articles.search import ensure_search_index
+
+    ensure_search_index()
+    connection.close()
+
+
+# dispatcher - every feed is refreshed when it is due as per its learned refresh interval (see feed_scheduler). No
+# refreshes from midnight to 5am - the feeds due overnight are refreshed by the first dispatch in the morning.
 app.conf.beat_schedule = {
     "daytime": {
         "task": "news_platform.pages.pageHome.refresh_feeds",
-        "schedule": crontab(minute="*/15", hour="5-18"),
+        "schedule": crontab(minute="*/5", hour="5-17"),
         "args": (),
     },
     "nighttime": {
         "task": "news_platform.pages.pageHome.refresh_feeds",
-        "schedule": crontab(minute="*/30", hour="18-23"),
+        "schedule": crontab(minute="*/10", hour="18-23"),
         "args": (),
     },
     "webpush-cleanup": {
@@ -37,21 +52,3 @@ app.conf.beat_schedule = {
         "args": (),
     },
 }
-
-
-def is_task_already_executing(task_name: str) -> bool:
-    """Returns whether the task with given task_name is already being executed.
-
-    Args:
-        task_name: Name of the task to check if it is running currently.
-    Returns: A boolean indicating whether the task with the given task name is
-        running currently.
-    """
-    active_tasks = app.control.inspect().active()
-    task_count = 0
-    for worker, running_tasks in active_tasks.items():
-        for task in running_tasks:
-            if task["name"] == task_name:
-                task_count += 1
-
-    return task_count > 1
@@ -1,15 +1,21 @@
 # -*- coding: utf-8 -*-
 """Get article data for all views"""
 
+import base64
+import binascii
 import datetime
+import decimal
 import functools
+import json
 import urllib
 import requests
 import operator
 
 from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist, ValidationError
 from django.core.cache import cache
-from django.db.models import F, Q
+from django.db.models import Case, DateField, F, Q, Value, When
+from django.db.models.functions import TruncDate
 from django.forms.models import model_to_dict
 from django.http import HttpResponse
 from django.shortcuts import redirect
@@ -20,7 +26,8 @@ from rest_framework.response import Response
 from rest_framework.views import APIView
 
 from news_platform.celery import app
-from articles.models import Article
+from articles.models import Article, tagged_with
+from articles.search import get_search_words, search_articles
 from feeds.models import Publisher
 from preferences.models import url_parm_encode
 
@@ -43,93 +50,339 @@ def __convert_type(n):
                 return n
 
 
-def get_articles(max_length=72, force_recache=False, grouped_articles=True, **kwargs):
-    """Gets article request by user either from database or from cache"""
+# version of the cached article cards - increase if ARTICLE_CARD_FIELDS or the format change
+ARTICLE_CARD_CACHE_VERSION = 2
+# fields of the article cards - all fields home.html and RestHomeView use (incl. the debug view) but the full-texts
+ARTICLE_CARD_FIELDS = [
+    "pk",
+    "title",
+    "extract",
+    "image_url",
+    "link",
+    "has_full_text",
+    "importance_type",
+    "content_type",
+    "categories",
+    "language",
+    "read_later",
+    "pub_date",
+    "added_date",
+    "last_updated_date",
+    "guid",
+    "hash",
+    "publisher_article_position",
+    "min_feed_position",
+    "min_article_relevance",
+    "max_importance",
+    "publisher__name",
+    "publisher__paywall",
+    "publisher__renowned",
+    "group_html",  # list of the further articles of a group (full_text_html of content_type "group" only)
+]
+ARTICLE_CARD_DATE_FIELDS = ["pub_date", "added_date", "last_updated_date"]
+
+
+# compiled filters of the url parameters {kwargs_hash: filter plan} - the oldest are dropped beyond the max. number
+ARTICLE_FILTER_PLANS = {}
+ARTICLE_FILTER_PLANS_MAX = 1000
+# lookups a url parameter may end with (e.g. 'pub_date__gte') - values of these lookups are validated by the field
+ARTICLE_FILTER_LOOKUPS = ["exact", "iexact", "contains", "icontains", "gt", "gte", "lt", "lte", "startswith", "isnull"]
+
+
+def get_filter_field(field_path):
+    """
+    (field, lookup) of a url parameter like 'publisher__name' or 'pub_date__gte' validated against the fields of
+    Article and its related models - lookup is None if not given and (None, None) if there is no such field
+    """
+    opts = Article._meta
+    parts = field_path.split("__")
+    for i, name in enumerate(parts):
+        try:
+            field = opts.pk if name == "pk" else opts.get_field(name)
+        except FieldDoesNotExist:
+            return None, None
+        if i == len(parts) - 1:
+            return field, None
+        if i == len(parts) - 2 and parts[-1] in ARTICLE_FILTER_LOOKUPS and field.get_lookup(parts[-1]) is not None:
+            return field, parts[-1]
+        if not field.is_relation or field.related_model is None:
+            return None, None
+        opts = field.related_model._meta
+    return None, None
+
+
+def get_filter_condition(field_path, field, lookup, condition):
+    """Q of one value of a url parameter or None if the value is not valid for the field"""
+    condition = __convert_type(condition)
+    if lookup is None:
+        field_path = f"{field_path}__icontains" if isinstance(condition, str) else field_path
+    elif lookup == "isnull":
+        return Q(**{field_path: bool(condition)})
+    target_field = field.related_model._meta.pk if field.is_relation else field
+    try:
+        target_field.to_python(condition)
+    except (ValidationError, TypeError, ValueError):
+        return None
+    return Q(**{field_path: condition})
+
+
+def compile_article_filters(kwargs_hash, kwargs):
+    """
+    filter plan of the url parameters (without page) - the fields and values are validated against the Article model
+    instead of querying the database, unknown parameters (e.g. 'debug') and invalid values are ignored. The plans are
+    memoized per kwargs_hash.
+    """
+    if kwargs_hash in ARTICLE_FILTER_PLANS:
+        return ARTICLE_FILTER_PLANS[kwargs_hash]
+
+    plan = dict(
+        conditions=Q(),
+        exclude_sidebar=True,
+        has_language_filters=False,
+        has_read_later=False,
+        sidebar="special" in kwargs and "sidebar" in kwargs["special"],
+    )
+    for field_path, condition_lst in kwargs.items():
+        sub_conditions = Q()
+        if field_path.lower() == "special":
+            for condition in condition_lst:
+                if condition.lower() == "free-only":
+                    sub_conditions &= Q(Q(has_full_text=True) | Q(publisher__paywall="N")) & tagged_with("frontpage")
+                elif condition.lower() == "sidebar":
+                    sub_conditions &= tagged_with("sidebar")
+                    plan["exclude_sidebar"] = False
+        elif field_path == "categories":
+            # indexed lookup of the (whole) tags instead of searching the categories
+            sub_conditions = tagged_with(*condition_lst)
+            plan["exclude_sidebar"] = False
+        elif field_path == "language":
+            sub_conditions = Q(language_code__in=[i.strip()[:2].lower() for i in condition_lst])
+            plan["exclude_sidebar"] = False
+        elif (filter_field := get_filter_field(field_path))[0] is not None:
+            for condition in condition_lst:
+                if (condition_q := get_filter_condition(field_path, *filter_field, condition)) is not None:
+                    sub_conditions |= condition_q
+            plan["exclude_sidebar"] = False
+        if field_path == "language":
+            plan["has_language_filters"] = True
+        if field_path == "read_later":
+            plan["has_read_later"] = True
+        plan["conditions"] &= sub_conditions
+
+    if len(ARTICLE_FILTER_PLANS) >= ARTICLE_FILTER_PLANS_MAX:
+        del ARTICLE_FILTER_PLANS[next(iter(ARTICLE_FILTER_PLANS))]
+    ARTICLE_FILTER_PLANS[kwargs_hash] = plan
+    return plan
+
+
+# orderings of the article lists [(field or annotation, descending)] - nulls are always last and the pk breaks ties, so
+# that the next page can be selected by the values of the last article (keyset pagination) instead of an offset
+ARTICLE_ORDERINGS = {
+    "relevance": [
+        ("min_article_relevance", False),
+        ("pub_day", True),
+        ("max_importance", True),
+        ("last_updated_date", True),
+        ("pk", True),
+    ],
+    "read_later": [("last_updated_date", True), ("pk", True)],
+    "sidebar": [("added_date", True), ("pub_date", True), ("min_article_relevance", False), ("pk", True)],
+}
+
+
+def get_ordering_field(name):
+    """model field of an ordering field or annotation (to convert the cursor values)"""
+    if name == "pub_day":
+        return DateField()
+    return Article._meta.pk if name == "pk" else Article._meta.get_field(name)
+
+
+def encode_cursor(ordering, page_num, values):
+    """url-safe (lower-case, no commas) cursor of the next page after the article with the values of the ordering"""
+    values = [i.isoformat() if isinstance(i, (datetime.date, datetime.datetime)) else i for i in values]
+    values = [str(i) if isinstance(i, decimal.Decimal) else i for i in values]
+    cursor_json = json.dumps({"o": ordering, "p": page_num, "v": values}, separators=(",", ":"))
+    return base64.b32encode(cursor_json.encode("utf-8")).decode("ascii").rstrip("=").lower()
+
+
+def decode_cursor(cursor, ordering):
+    """(page number, values) of a cursor of the ordering - None if the cursor is invalid or of another ordering"""
+    try:
+        cursor = cursor.upper() + "=" * (-len(cursor) % 8)
+        cursor = json.loads(base64.b32decode(cursor).decode("utf-8"))
+        if cursor["o"] != ordering or len(cursor["v"]) != len(ARTICLE_ORDERINGS[ordering]):
+            return None
+        values = [
+            None if value is None else get_ordering_field(name).to_python(value)
+            for (name, _), value in zip(ARTICLE_ORDERINGS[ordering], cursor["v"])
+        ]
+        return int(cursor["p"]), values
+    except (binascii.Error, ValidationError, ValueError, TypeError, KeyError, AttributeError):
+        return None
+
+
+def get_keyset_condition(ordering, values):
+    """Q of the articles after the article with the values of the ordering (nulls last)"""
+    conditions = []
+    equal = Q()
+    for (name, descending), value in zip(ARTICLE_ORDERINGS[ordering], values):
+        if value is None:
+            # nothing comes after null but further nulls
+            equal &= Q(**{f"{name}__isnull": True})
+            continue
+        after = Q(**{f"{name}__{'lt' if descending else 'gt'}": value}) | Q(**{f"{name}__isnull": True})
+        conditions.append(equal & after)
+        equal &= Q(**{name: value})
+    return functools.reduce(operator.or_, conditions) if len(conditions) > 0 else Q(pk__in=[])
+
+
+def get_articles_query(max_length=72, grouped_articles=True, lookahead=0, **kwargs):
+    """
+    Gets the queryset of the articles requested by the user - returns (kwargs_hash, articles, page number, ordering).
+    Pages after the first are selected by the 'cursor' of the previous page or (slower) by the 'page' offset. The
+    queryset contains lookahead articles more than max_length (of the next page).
+    """
     kwargs_hash, kwargs = url_parm_encode(**kwargs)
     page_num = max(int(kwargs.pop("page", ["1"])[0]), 1) - 1
+    cursor = kwargs.pop("cursor", [None])[0]
+
+    plan = compile_article_filters(url_parm_encode(**kwargs)[0], kwargs)
+    conditions = plan["conditions"]
+    if grouped_articles:
+        conditions &= Q(article_group__isnull=True)
+    else:
+        conditions &= Q(articlegroup__isnull=True)
+        conditions &= ~Q(content_type="group")
+    articles = Article.objects.prefetch_related("publisher").filter(conditions)
+    ordering = "relevance"
+    has_language_filters = plan["has_language_filters"]
+    if plan["has_read_later"]:
+        ordering = "read_later"
+        has_language_filters = True
+    if plan["exclude_sidebar"]:
+        articles = articles.exclude(tagged_with("sidebar"))
+    if plan["sidebar"]:
+        ordering = "sidebar"
+        articles = articles.exclude(
+            pub_date__lte=settings.TIME_ZONE_OBJ.localize(datetime.datetime.now() - datetime.timedelta(days=5))
+        )
+    if has_language_filters is False and "*" not in settings.ALLOWED_LANGUAGES:
+        articles = articles.filter(
+            language_code__in=[x.strip()[:2].lower() for x in settings.ALLOWED_LANGUAGES.split(",")]
+        )
+    if ordering == "relevance":
+        articles = articles.annotate(pub_day=TruncDate("pub_date"))
+    articles = articles.order_by(
+        *[
+            F(name).desc(nulls_last=True) if descending else F(name).asc(nulls_last=True)
+            for name, descending in ARTICLE_ORDERINGS[ordering]
+        ]
+    )
+    if cursor is not None and (page_values := decode_cursor(cursor, ordering)) is not None:
+        page_num = page_values[0] - 1
+        articles = articles.filter(get_keyset_condition(ordering, page_values[1]))
+        if max_length is not None:
+            articles = articles[: max_length + lookahead]
+    elif max_length is not None:
+        articles = articles[page_num * max_length : (page_num + 1) * max_length + lookahead]
+    return kwargs_hash, articles, page_num + 1, ordering
+
+
+def dump_article_cards(articles, ordering, max_length=None, page_num=1):
+    """
+    compact json of the article cards of the articles queryset - loaded with values_list without model instances. If
+    the articles are one more than max_length, the last is cut and the cursor of the next page is added.
+    """
+    ordering_fields = [name for name, _ in ARTICLE_ORDERINGS[ordering]]
+    rows = list(
+        articles.annotate(
+            group_html=Case(When(content_type="group", then=F("full_text_html")), default=Value(None))
+        ).values_list(*ARTICLE_CARD_FIELDS, *ordering_fields)
+    )
+    next_cursor = None
+    if max_length is not None and len(rows) > max_length:
+        rows = rows[:max_length]
+        next_cursor = encode_cursor(ordering, page_num + 1, rows[-1][len(ARTICLE_CARD_FIELDS) :])
+    date_positions = [ARTICLE_CARD_FIELDS.index(i) for i in ARTICLE_CARD_DATE_FIELDS]
+    relevance_position = ARTICLE_CARD_FIELDS.index("min_article_relevance")
+    card_rows = []
+    for row in rows:
+        row = list(row[: len(ARTICLE_CARD_FIELDS)])
+        for i in date_positions:
+            row[i] = None if row[i] is None else row[i].isoformat()
+        row[relevance_position] = None if row[relevance_position] is None else float(row[relevance_position])
+        card_rows.append(row)
+    return json.dumps(
+        {
+            "version": ARTICLE_CARD_CACHE_VERSION,
+            "fields": ARTICLE_CARD_FIELDS,
+            "rows": card_rows,
+            "next_cursor": next_cursor,
+        },
+        separators=(",", ":"),
+    )
+
+
+def load_article_cards(cards_json):
+    """
+    (list of article cards (dicts with the ARTICLE_CARD_FIELDS and the publisher as dict), cursor of the next page)
+    from their json - None if missing or of another version
+    """
+    if not isinstance(cards_json, str):
+        return None
+    cards = json.loads(cards_json)
+    if cards.get("version") != ARTICLE_CARD_CACHE_VERSION or cards.get("fields") != ARTICLE_CARD_FIELDS:
+        return None
+    articles = []
+    for row in cards["rows"]:
+        article = dict(zip(ARTICLE_CARD_FIELDS, row))
+        for i in ARTICLE_CARD_DATE_FIELDS:
+            article[i] = None if article[i] is None else datetime.datetime.fromisoformat(article[i])
+        article["publisher"] = {
+            "name": article.pop("publisher__name"),
+            "paywall": article.pop("publisher__paywall"),
+            "renowned": article.pop("publisher__renowned"),
+        }
+        article["full_text_html"] = article.pop("group_html")
+        articles.append(article)
+    return articles, cards["next_cursor"]
 
-    articles = cache.get(kwargs_hash)
 
+def get_articles(max_length=72, force_recache=False, grouped_articles=True, **kwargs):
+    """
+    Gets the articles requested by user either from database or from cache - as article cards (see
+    load_article_cards) i.e. only the fields required to list the articles. Returns (kwargs_hash, articles, page
+    number, cursor of the next page or None if it is the last page).
+    """
+    kwargs_hash, url_kwargs = url_parm_encode(**kwargs)
+    page_num = int(url_kwargs.pop("page", ["1"])[0])
+    is_first_page = page_num <= 1 and url_kwargs.pop("cursor", None) is None
+
+    cards = None if force_recache else load_article_cards(cache.get(kwargs_hash))
+
+    # only the first pages are re-cached when the articles are refreshed
     cached_views_lst = cache.get("cached_views_lst")
-    if cached_views_lst is None:
-        cache.set("cached_views_lst", {kwargs_hash: kwargs}, 60 * 60 * 48)
-    elif kwargs_hash not in cached_views_lst:
+    if is_first_page and cached_views_lst is None:
+        cache.set("cached_views_lst", {kwargs_hash: url_kwargs}, 60 * 60 * 48)
+    elif is_first_page and kwargs_hash not in cached_views_lst:
         cache.set(
             "cached_views_lst",
-            {**cached_views_lst, **{kwargs_hash: kwargs}},
+            {**cached_views_lst, **{kwargs_hash: url_kwargs}},
             60 * 60 * 48,
         )
 
-    if articles is None or force_recache:
-        conditions = Q()
-        special_filters = kwargs["special"] if "special" in kwargs else None
-        exclude_sidebar = True
-        has_language_filters = False
-        has_read_later = False
-        for field, condition_lst in kwargs.items():
-            sub_conditions = Q()
-            for condition in condition_lst:
-                if field.lower() == "special":
-                    if condition.lower() == "free-only":
-                        sub_conditions &= Q(
-                            Q(Q(has_full_text=True) | Q(publisher__paywall="N")) & Q(categories__icontains="frontpage")
-                        )
-                    elif condition.lower() == "sidebar":
-                        sub_conditions &= Q(categories__icontains="SIDEBAR")
-                        exclude_sidebar = False
-                else:
-                    condition = __convert_type(condition)
-                    if isinstance(condition, str):
-                        sub_conditions |= Q(**{f"{field}__icontains": condition})
-                    else:
-                        sub_conditions |= Q(**{f"{field}": condition})
-                    exclude_sidebar = False
-            if field == "language":
-                has_language_filters = True
-            if field == "read_later":
-                has_read_later = True
-            try:
-                test_condition = Article.objects.filter(sub_conditions)
-            except Exception:
-                test_condition = []
-            if len(test_condition) > 0:
-                conditions &= sub_conditions
-        if grouped_articles:
-            conditions &= Q(article_group__isnull=True)
-        else:
-            conditions &= Q(articlegroup__isnull=True)
-            conditions &= ~Q(content_type="group")
-        articles = Article.objects.prefetch_related("publisher").filter(conditions)
-        articles = articles.order_by(
-            F("min_article_relevance").asc(nulls_last=True),
-            "-pub_date__date",
-            "-max_importance",
-            "-last_updated_date",
-        )
-        if has_read_later:
-            articles = articles.order_by("-last_updated_date")
-            has_language_filters = True
-        if exclude_sidebar:
-            articles = articles.exclude(categories__icontains="SIDEBAR")
-        if special_filters is not None and "sidebar" in special_filters:
-            articles = articles.order_by("-added_date", "-pub_date", "min_article_relevance").exclude(
-                pub_date__lte=settings.TIME_ZONE_OBJ.localize(datetime.datetime.now() - datetime.timedelta(days=5))
-            )
-        if has_language_filters is False and "*" not in settings.ALLOWED_LANGUAGES:
-            articles = articles.filter(
-                functools.reduce(
-                    operator.or_,
-                    (Q(language__icontains=x) for x in settings.ALLOWED_LANGUAGES.split(",")),
-                )
-            )
-        if max_length is not None:
-            lower_bound = page_num * max_length
-            upper_bound = min((page_num + 1) * max_length, len(articles))
-            articles = articles[lower_bound:upper_bound]
+    # one more article than shown is loaded to know if there is a next page without counting the articles
+    _, articles_query, page_num, ordering = get_articles_query(
+        max_length=max_length, grouped_articles=grouped_articles, lookahead=1, **kwargs
+    )
+    if cards is None:
+        cards_json = dump_article_cards(articles_query, ordering, max_length, page_num)
+        cards = load_article_cards(cards_json)
         if grouped_articles:
-            cache.set(kwargs_hash, articles, 60 * 60 * 48 if page_num == 0 else 10 * 60)
+            cache.set(kwargs_hash, cards_json, 60 * 60 * 48 if is_first_page else 10 * 60)
         print(f"Got {kwargs_hash} from database" + (" and cached it" if grouped_articles else ""))
-    return kwargs_hash, articles, page_num + 1
+    articles, next_cursor = cards
+    return kwargs_hash, articles, page_num, next_cursor
 
 
 class RestArticleAPIView(APIView):
@@ -172,12 +425,49 @@ class RestLastRefeshAPIView(APIView):
             dict(
                 lastRefreshed=cache.get("lastRefreshed"),
                 currentlyRefreshing=cache.get("currentlyRefreshing", False),
-                videoRefreshCycleCount=cache.get("videoRefreshCycleCount", 8),
+                videosRefreshedAt=cache.get("videosRefreshedAt"),
                 notifications_display=cache.get("notifications_display", []),
             )
         )
 
 
+class RestSearchView(APIView):
+    """RestAPI view to search the articles' titles, extracts, and full texts via /api/search/?q=<query>&limit=<n>"""
+
+    # the snippets are taken from the full texts - same access as the article data
+    authentication_classes = [SessionAuthentication, BasicAuthentication]
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, format=None):
+        """get method for Django"""
+        query = request.GET.get("q", "")
+        try:
+            limit = int(request.GET.get("limit", 20))
+        except ValueError:
+            return Response(data=dict(error="limit must be an integer"), status=status.HTTP_400_BAD_REQUEST)
+        if len(get_search_words(query)) == 0:
+            return Response(data=dict(error="q must contain a word"), status=status.HTTP_400_BAD_REQUEST)
+
+        articles = [
+            dict(
+                id=i["pk"],
+                title=i["title"],
+                publisher=i["publisher__name"],
+                snippet=i["snippet"],
+                rank=i["rank"],
+                image_url=i["image_url"],
+                has_full_text=i["has_full_text"],
+                content_type=i["content_type"],
+                external_link=i["link"],
+                internal_link=f"{settings.MAIN_HOST}/view/{i['pk']}/",
+                pub_date=i["pub_date"],
+                language=i["language"],
+            )
+            for i in search_articles(query, limit)
+        ]
+        return Response(articles)
+
+
 def ReadLaterView(request, action, pk):
     try:
         requested_article = Article.objects.get(pk=pk)
@@ -187,7 +477,7 @@ def ReadLaterView(request, action, pk):
         cached_views_lst = cache.get("cached_views_lst")
         for kwargs_hash, kwargs in [].items() if cached_views_lst is None else cached_views_lst.items():
             if "read_later" in kwargs_hash:
-                _, _, _ = get_articles(force_recache=True, **kwargs)
+                _, _, _, _ = get_articles(force_recache=True, **kwargs)
 
         return redirect("/")
 
@@ -209,7 +499,7 @@ def ArchiveView(request, action, pk):
         cached_views_lst = cache.get("cached_views_lst")
         for kwargs_hash, kwargs in [].items() if cached_views_lst is None else cached_views_lst.items():
             if "archive" in kwargs_hash or "read_later" in kwargs_hash:
-                _, _, _ = get_articles(force_recache=True, **kwargs)
+                _, _, _, _ = get_articles(force_recache=True, **kwargs)
 
         return redirect("/")
 
@@ -2,9 +2,11 @@
 """Responaible for home view at base url /"""
 
 import datetime
+import os
 import traceback
 import urllib.parse
 
+from celery import chord
 from django.conf import settings
 from django.core.cache import cache
 from django.db.models import Count, Min
@@ -14,11 +16,24 @@ from django.template.defaulttags import register
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
-from articles.models import Article
-from feed_scraper.article_scraper import update_feeds
-from feed_scraper.video_scraper import update_videos
+from articles.models import Article, FeedPosition
+from feed_scraper.article_scraper import (
+    add_ai_summaries,
+    delete_old_articles,
+    find_grouped_articles,
+    get_shared_enricher,
+    prepare_feed_refresh,
+    rank_publisher_articles,
+    refresh_feed,
+)
+from feed_scraper.feed_fetcher import download_feed
+from feed_scraper.feed_scheduler import has_due_feeds
+from feed_scraper.keywords import add_article_keywords
+from feed_scraper.video_scraper import fetch_feed as fetch_video_feed
+from feed_scraper.video_scraper import get_video_feeds, get_video_force_refetch
+from feeds.models import Feed
 from markets.scrape import scrape_market_data
-from news_platform.celery import app, is_task_already_executing
+from news_platform.celery import app
 from preferences.models import Page, get_page_lst, url_parm_encode
 from webpush.models import SubscriptionInfo
 
@@ -53,15 +68,15 @@ def split(value, key):
     return value.split(key)
 
 
-def refresh_all_pages():
-    """reshresh all cached pages with force_recache=True"""
+def refresh_all_pages(force_recache=True):
+    """reshresh all cached pages with force_recache=True (or only cache the pages not cached yet)"""
     cached_views_dict = cache.get("cached_views_lst", {})
     for k, v in get_page_lst().items():
         if k not in cached_views_dict:
             cached_views_dict[k] = v
 
     for view_hash, view_kwargs in cached_views_dict.items():
-        _, _, _ = get_articles(**view_kwargs, force_recache=True)
+        _, _, _, _ = get_articles(**view_kwargs, force_recache=force_recache)
 
 
 def get_stats():
@@ -88,59 +103,180 @@ def get_stats():
             )
 
 
+REFRESH_LOCK_TIMEOUT = 60 * 60 * 3  # the refresh lock expires if a workflow never finishes (e.g. a worker died)
+FEED_LOCK_TIMEOUT = 60 * 30
+
+
+def release_refresh_lock():
+    """mark the news refresh workflow as finished so that the next one can start"""
+    cache.set("currentlyRefreshing", False, 60 * 60 * 2)
+    cache.delete("refreshLock")
+
+
+@app.task(bind=True, time_limit=60 * 15)  # 15 min time limit
+def refresh_article_feed(self, feed_pk, force_refetch):
+    """Refresh a single rss feed - skipped if the feed is already being refreshed by another worker"""
+    if cache.add(f"feedLock_{feed_pk}", True, FEED_LOCK_TIMEOUT) is False:
+        print(f"Feed {feed_pk} is already being refreshed by another task")
+        return 0
+    try:
+        feed = Feed.objects.select_related("publisher").get(pk=feed_pk)
+        fetched_feed = download_feed(feed, conditional=not force_refetch)
+        return refresh_feed(feed, force_refetch, fetched_feed=fetched_feed, enricher=get_shared_enricher())
+    except Exception as e:
+        # never fail - the remaining workflow runs once all feeds are done
+        print(f"Error refreshing feed {feed_pk}: {e}")
+        print(traceback.format_exc())
+        return 0
+    finally:
+        cache.delete(f"feedLock_{feed_pk}")
+
+
+@app.task(bind=True, time_limit=60 * 15)  # 15 min time limit
+def refresh_video_feed(self, feed_pk, force_refetch):
+    """Refresh a single video feed - skipped if the feed is already being refreshed by another worker"""
+    if cache.add(f"feedLock_{feed_pk}", True, FEED_LOCK_TIMEOUT) is False:
+        print(f"Feed {feed_pk} is already being refreshed by another task")
+        return 0
+    try:
+        feed = Feed.objects.select_related("publisher").get(pk=feed_pk)
+        return fetch_video_feed(feed, force_refetch)
+    except Exception as e:
+        print(f"Error fetching videos for feed {feed_pk}: {e}")
+        return 0
+    finally:
+        cache.delete(f"feedLock_{feed_pk}")
+
+
+@app.task(bind=True, time_limit=60 * 10)  # 10 min time limit
+def refresh_market_data(self):
+    """Update market data"""
+    try:
+        scrape_market_data()
+    except Exception as e:
+        print(f"Error refreshing market data: {e}")
+    return 0
+
+
+@app.task(bind=True, time_limit=60 * 60)  # 1 hour time limit
+def rank_articles(self, added_lst, force=False):
+    """
+    Rank, tag, summarise, and clean-up the articles once all feeds were refreshed. The articles are always ranked as
+    refreshed feeds replace their positions (and reset the article relevance) even if no articles were added. The
+    remaining steps are skipped if no articles were added and they ran less than ARTICLE_RANKING_INTERVAL minutes ago
+    (unless forced) - returns None if skipped so that the grouping and re-caching are skipped too.
+    """
+    print(f"All feeds refreshed with {sum(added_lst)} new articles/videos")
+    rank_publisher_articles()
+    if sum(added_lst) == 0 and force is False and cache.get("articlesRanked", False):
+        print("No new articles - tagging, grouping, and re-caching skipped")
+        return None
+    cache.set("articlesRanked", True, settings.ARTICLE_RANKING_INTERVAL * 60)
+    get_stats()
+    add_article_keywords()
+    add_ai_summaries()
+    delete_old_articles()
+    return sum(added_lst)
+
+
+@app.task(bind=True, time_limit=60 * 60)  # 1 hour time limit
+def group_articles(self, added):
+    """Group articles about the same topic - skipped if the ranking was skipped"""
+    if added is not None:
+        try:
+            find_grouped_articles()
+        except Exception as e:
+            # the pages are re-cached anyway - the new articles are grouped by the next refresh
+            print(f"Error grouping articles: {e}")
+            print(traceback.format_exc())
+    return added
+
+
+@app.task(bind=True, time_limit=60 * 30)  # 30 min time limit
+def refresh_page_caches(self, added):
+    """Re-cache all pages (skipped if the ranking was skipped) and finish the news refresh workflow"""
+    try:
+        if added is not None:
+            refresh_all_pages()
+            now = settings.TIME_ZONE_OBJ.localize(datetime.datetime.now())
+            cache.set("lastRefreshed", str(now.isoformat()), 60 * 60 * 48)  # .utcnow()
+        print("refreshing finished")
+    finally:
+        release_refresh_lock()
+    return "DONE"
+
+
+@app.task(bind=True)
+def refresh_failed(self, *args):
+    """error callback of the news refresh workflow"""
+    print("refreshing failed")
+    release_refresh_lock()
+
+
 # @postpone
-@app.task(bind=True, time_limit=60 * 60 * 3, max_retries=5)  # 3 hour time limit
-def refresh_feeds(self):
-    """Main function to refresh all articles and videos"""
+@app.task(bind=True, time_limit=60 * 30, max_retries=5)  # 30 min time limit
+def refresh_feeds(self, all_feeds=False):
+    """
+    Dispatch the refresh of all due articles and videos (all feeds if all_feeds e.g. for manual refreshes) as celery
+    workflow: one task per feed (plus market data) run in parallel by all workers, followed by the ranking, the
+    grouping, and the re-caching of the pages (skipped if no articles were added, see rank_articles).
+    """
     print("refreshing started")
 
-    # currentlyRefreshing = cache.get("currentlyRefreshing")
-    currentlyRefreshing = is_task_already_executing("news_platform.pages.pageHome.refresh_feeds")
-    if currentlyRefreshing:
+    # the videos are due once the timestamp of their last refresh expired (after VIDEO_REFRESH_INTERVAL minutes)
+    refresh_videos = cache.get("videosRefreshedAt") is None
+    if all_feeds is False and refresh_videos is False and has_due_feeds() is False:
+        print("No feeds are due for refreshing")
+        return "NOTHING DUE"
+
+    # only one workflow at a time - the lock is released by the last step of the workflow
+    if cache.add("refreshLock", True, REFRESH_LOCK_TIMEOUT) is False:
         print("Already other task that is refreshing articles")
         return "ALREADY RUNNING"
 
-    response = ""
     try:
         cache.set("currentlyRefreshing", True, 60 * 60 * 2 + 300)
-        videoRefreshCycleCount = cache.get("videoRefreshCycleCount")
 
-        get_stats()
+        # Caching articles before updating (only the pages not cached yet - all pages are re-cached afterwards)
+        refresh_all_pages(force_recache=False)
 
-        # Caching articles before updating
-        refresh_all_pages()
+        force_refetch = os.getenv("FORCE_REFETCH", "False").lower() == "true"
+        feed_tasks = [refresh_article_feed.s(feed.pk, force_refetch) for feed in prepare_feed_refresh(all_feeds)]
+        if refresh_videos:
+            video_force_refetch = get_video_force_refetch()
+            feed_tasks += [refresh_video_feed.s(feed.pk, video_force_refetch) for feed in get_video_feeds()]
+            now = settings.TIME_ZONE_OBJ.localize(datetime.datetime.now())
+            cache.set("videosRefreshedAt", str(now.isoformat()), settings.VIDEO_REFRESH_INTERVAL * 60)
 
-        update_feeds()
-        response += "articles refreshed successfully; "
-        if videoRefreshCycleCount is None or videoRefreshCycleCount == 0:
-            update_videos()
-            cache.set("videoRefreshCycleCount", 8, 60 * 60 * 24)
-            response += "videos refreshed successfully; "
-        else:
-            print(f"Refreshing videos in {videoRefreshCycleCount - 1} cycles")
-            cache.set("videoRefreshCycleCount", videoRefreshCycleCount - 1, 60 * 60 * 24)
-            response += "video refresh not required; "
+        workflow = chord(
+            feed_tasks + [refresh_market_data.s()],
+            rank_articles.s(force=all_feeds) | group_articles.s() | refresh_page_caches.s(),
+        )
+        workflow.apply_async(link_error=refresh_failed.si())
 
-        refresh_all_pages()
+    except Exception as e:
+        release_refresh_lock()
+        print(traceback.format_exc())
+        raise self.retry(countdown=30, exc=e)
 
-        # Update marekt data
-        scrape_market_data()
-        response += "market data refreshed successfully; "
+    return f"DISPATCHED {len(feed_tasks)} feeds"
 
-        now = settings.TIME_ZONE_OBJ.localize(datetime.datetime.now())
-        cache.set("lastRefreshed", str(now.isoformat()), 60 * 60 * 48) # .utcnow()
 
-        response += "DONE"
-        cache.set("currentlyRefreshing", False, 60 * 60 * 2)
-        print("refreshing finished")
+def get_request_articles(request):
+    """articles requested by the url parameters - the frontpage if there are no parameters but the page"""
+    kwargs = dict(request.GET.items())
+    if len([i for i in kwargs if i not in ["page", "cursor"]]) == 0:
+        kwargs["categories"] = "frontpage"
+    return get_articles(**kwargs)
 
-    except Exception as e:
-        response += f"ERROR: {e}"
-        cache.set("currentlyRefreshing", False, 60 * 60 * 2)
-        print(traceback.format_exc())
-        raise self.retry(countdown=30, exc=e)
 
-    return response
+def add_feed_positions(articles):
+    """add the feed positions of the article cards for the debug view (not cached) with one query"""
+    feed_positions = {}
+    for position in FeedPosition.objects.select_related("feed").filter(article_id__in=[i["pk"] for i in articles]):
+        feed_positions.setdefault(position.article_id, []).append(position)
+    for article in articles:
+        article["feed_positions"] = feed_positions.get(article["pk"], [])
 
 
 def homeView(request, article=None):
@@ -150,24 +286,24 @@ def homeView(request, article=None):
     # scrape_market_data()
 
     # Get Articles
-    kwargs_hash, articles, page_num = (
-        get_articles(categories="frontpage") if len(request.GET) == 0 else get_articles(**request.GET)
-    )
-    _, sidebar, _ = get_articles(special="sidebar", max_length=100, grouped_articles=False)
+    kwargs_hash, articles, page_num, next_cursor = get_request_articles(request)
+    _, sidebar, _, _ = get_articles(special="sidebar", max_length=100, grouped_articles=False)
+    debug = "debug" in request.GET and request.GET["debug"].lower() == "true"
+    if debug:
+        add_feed_positions(articles)
 
-    # Get page infos
+    # Get page infos - the first, the current, and the next page (selected by the cursor after the last article)
     _, url_kwargs = url_parm_encode(**request.GET)
-    page_num = max(int(url_kwargs.pop("page", ["1"])[0]), 1)
-    page_pagination = []
-    for i in range(max(1, page_num - 1), max(1, page_num - 1) + 3):
-        url_kwargs["page"] = [f"{i}"]
-        page_pagination.append(
-            dict(
-                i=i,
-                css_class="active" if i == page_num else ("disabled" if len(articles) < 72 and i > page_num else ""),
-                url="/?" + urllib.parse.urlencode({k: ",".join(v) for k, v in url_kwargs.items()}),
-            )
+    url_kwargs = {k: ",".join(v) for k, v in url_kwargs.items() if k not in ["page", "cursor"]}
+    page_pagination = [] if page_num == 1 else [dict(i=1, css_class="", url="/?" + urllib.parse.urlencode(url_kwargs))]
+    page_pagination.append(dict(i=page_num, css_class="active", url=request.get_full_path()))
+    page_pagination.append(
+        dict(
+            i=page_num + 1,
+            css_class="disabled" if next_cursor is None else "",
+            url="/?" + urllib.parse.urlencode({**url_kwargs, "cursor": next_cursor or ""}),
         )
+    )
 
     # Get additional infos
     lastRefreshed = cache.get("lastRefreshed")
@@ -180,7 +316,7 @@ def homeView(request, article=None):
             "articles": articles,
             "sidebar": sidebar,
             "marketData": latestMarketData,
-            "debug": "debug" in request.GET and request.GET["debug"].lower() == "true",
+            "debug": debug,
             "authenticated": request.user.is_authenticated,
             "platform_name": settings.CUSTOM_PLATFORM_NAME,
             "webpush": {"group": "no" if settings.WEBPUSH_SETTINGS["VAPID_PRIVATE_KEY"] is None else "all"},
@@ -208,30 +344,31 @@ class RestHomeView(APIView):
 
     def get(self, request, format=None):
         """get method for Django"""
-        _, articles, _ = get_articles(categories="frontpage") if len(request.GET) == 0 else get_articles(**request.GET)
+        _, articles, _, next_cursor = get_request_articles(request)
 
         articles = [
             dict(
-                id=i.pk,
-                title=i.title,
-                publisher=i.publisher.name,
-                summary=i.extract,
-                image_url=i.image_url,
-                has_full_text=i.has_full_text,
-                has_paywall=i.publisher.paywall == "Y",
-                is_breaking_news=i.importance_type == "breaking",
-                content_type=i.content_type,
-                external_link=i.link,
-                internal_link=f"{settings.MAIN_HOST}/view/{i.pk}/",
-                pub_date=i.pub_date,
-                added_date=i.added_date,
-                categories=str(i.categories).split(";"),
-                language=i.language,
+                id=i["pk"],
+                title=i["title"],
+                publisher=i["publisher"]["name"],
+                summary=i["extract"],
+                image_url=i["image_url"],
+                has_full_text=i["has_full_text"],
+                has_paywall=i["publisher"]["paywall"] == "Y",
+                is_breaking_news=i["importance_type"] == "breaking",
+                content_type=i["content_type"],
+                external_link=i["link"],
+                internal_link=f"{settings.MAIN_HOST}/view/{i['pk']}/",
+                pub_date=i["pub_date"],
+                added_date=i["added_date"],
+                categories=str(i["categories"]).split(";"),
+                language=i["language"],
             )
             for i in articles
         ]
 
-        return Response(articles)
+        # the next page is requested with ?cursor=<X-Next-Cursor> - the header is missing on the last page
+        return Response(articles, headers=None if next_cursor is None else {"X-Next-Cursor": next_cursor})
 
 
 def RedirectView(request, article):
@@ -245,7 +382,7 @@ def RedirectView(request, article):
 
 def TriggerManualRefreshView(request):
     """view to trigger manual news refresh"""
-    task = refresh_feeds.delay()
+    task = refresh_feeds.delay(all_feeds=True)
 
     HTML_RESPONSE = f"""
     <html>
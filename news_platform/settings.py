@@ -323,14 +323,15 @@ WHITENOISE_AUTOREFRESH = DEBUG
 
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
-# Celery settings
-CELERY_BROKER_URL = "redis://localhost:6379"
-CELERY_RESULT_BACKEND = "redis://localhost:6379"
+# Celery settings - point all containers to the same redis to share the feed refresh work between them
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379")
+CELERY_BROKER_URL = REDIS_URL
+CELERY_RESULT_BACKEND = REDIS_URL
 
 CACHES = {
     "default": {
         "BACKEND": "django.core.cache.backends.redis.RedisCache",
-        "LOCATION": "redis://localhost:6379",
+        "LOCATION": REDIS_URL,
     }
 }
 
@@ -349,3 +350,27 @@ PWA_APP_DESCRIPTION = PWA_APP_NAME = CUSTOM_PLATFORM_NAME = os.getenv("CUSTOM_PL
 SIDEBAR_TITLE = os.getenv("SIDEBAR_TITLE", "Latest News")
 OLLAMA_URL = os.getenv("OLLAMA_URL")
 OLLAMA_MODEL = os.getenv("OLLAMA_MODEL", "tinyllama")
+FEED_FETCH_WORKERS = int(os.getenv("FEED_FETCH_WORKERS", "8"))  # parallel feed downloads (1 = sequential)
+FEED_FETCH_PER_HOST = int(os.getenv("FEED_FETCH_PER_HOST", "2"))  # max. parallel feed downloads from the same host
+ENRICHMENT_MAX_IN_FLIGHT = int(os.getenv("ENRICHMENT_MAX_IN_FLIGHT", "32"))  # max. parallel article data requests
+ENRICHMENT_PER_DOMAIN = int(os.getenv("ENRICHMENT_PER_DOMAIN", "4"))  # max. parallel requests to the same domain
+ENRICHMENT_FULL_TEXT = int(os.getenv("ENRICHMENT_FULL_TEXT", "8"))  # max. parallel requests to the FULL_TEXT_URL
+FEED_DEFAULT_INTERVAL = int(os.getenv("FEED_DEFAULT_INTERVAL", "15"))  # minutes between refreshes of a new feed
+FEED_MIN_INTERVAL = int(os.getenv("FEED_MIN_INTERVAL", "5"))  # min. minutes between refreshes of a busy feed
+FEED_MAX_INTERVAL = int(os.getenv("FEED_MAX_INTERVAL", "240"))  # max. minutes between refreshes of a quiet feed
+ARTICLE_RANKING_INTERVAL = int(os.getenv("ARTICLE_RANKING_INTERVAL", "30"))  # max. minutes between groupings
+VIDEO_REFRESH_INTERVAL = int(os.getenv("VIDEO_REFRESH_INTERVAL", "120"))  # minutes between refreshes of the videos
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "all-MiniLM-L6-v2")  # sentence-transformer to group articles
+EMBEDDING_SERVER_URL = os.getenv("EMBEDDING_SERVER_URL", "http://127.0.0.1:8765")  # empty to encode in-process
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "torch")  # "torch" or "onnx" (int8-quantized, CPU)
+EMBEDDING_ONNX_DIR = os.getenv("EMBEDDING_ONNX_DIR", os.path.join(BASE_DIR, "data", "onnx"))  # exported onnx models
+ARTICLE_GROUPING_FULL_RECLUSTER_HOURS = float(os.getenv("ARTICLE_GROUPING_FULL_RECLUSTER_HOURS", "6"))  # 0 = always
+NEAR_DUPLICATE_MIN_SIMILARITY = float(os.getenv("NEAR_DUPLICATE_MIN_SIMILARITY", "0.7"))  # 0 = disabled
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL") or None  # OpenAI-compatible API e.g. a local server - None = OpenAI
+OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-3.5-turbo")  # model of the AI summaries
+OPENAI_MAX_CONCURRENCY = int(os.getenv("OPENAI_MAX_CONCURRENCY", "8"))  # max. parallel AI summary requests
+OPENAI_TOKENS_PER_MINUTE = int(os.getenv("OPENAI_TOKENS_PER_MINUTE", "90000"))  # prompt + completion tokens limit
+OPENAI_REQUESTS_PER_MINUTE = int(os.getenv("OPENAI_REQUESTS_PER_MINUTE", "3500"))  # request limit of the API
+KEYWORD_EXTRACTOR = os.getenv("KEYWORD_EXTRACTOR", "ollama" if OLLAMA_URL else "none")  # "ollama", "builtin", "none"
+KEYWORD_MAX_CONCURRENCY = int(os.getenv("KEYWORD_MAX_CONCURRENCY", "4"))  # max. parallel requests to OLLAMA_URL
+LANGUAGE_ID_LANGUAGES = os.getenv("LANGUAGE_ID_LANGUAGES", "en,de,fr,es,it,pt,nl,sv,da,no,pl,ru,tr,ar,zh,ja")  # or "*"
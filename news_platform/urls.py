@@ -27,6 +27,7 @@ from news_platform.pages.pageAPI import (
     RestArticleAPIView,
     RestLastRefeshAPIView,
     RestPublisherAPIView,
+    RestSearchView,
     ImageErrorView,
 )
 from news_platform.pages.pageArticle import articleView
@@ -54,6 +55,7 @@ urlpatterns = [
     path("api/publisher/<int:pk>/", RestPublisherAPIView.as_view(), name="publisher_api"),
     path("api/page/", RestHomeView.as_view(), name="page_api"),
     path("api/refresh/", RestLastRefeshAPIView.as_view(), name="refesh_api"),
+    path("api/search/", RestSearchView.as_view(), name="search_api"),
     path("read-later/<str:action>/<int:pk>/", ReadLaterView, name="read-later"),
     path("archive/<str:action>/<int:pk>/", ArchiveView, name="read-later"),
     path("refresh/", TriggerManualRefreshView, name="refresh_news"),